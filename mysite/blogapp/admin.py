@@ -1,12 +1,17 @@
 from django.contrib import admin
 
 from blogapp.models import Article, Author, Category, Tag
+from blogapp.search import ARTICLE_INDEX
+from shopapp.admin_mixins import ExportAsCSVMixin, FullTextSearchMixin
 
 
 @admin.register(Article)
-class ArticleAdmin(admin.ModelAdmin):
+class ArticleAdmin(FullTextSearchMixin, admin.ModelAdmin, ExportAsCSVMixin):
+    actions = ['export_as_csv']
     list_display = ['pk', 'title', 'pub_date', 'content_short']
     list_display_links = ['pk', 'title']
+    search_fields = ['title', 'content']
+    search_index = ARTICLE_INDEX
 
     @classmethod
     def content_short(cls, obj: Article):
@@ -25,16 +30,19 @@ class TagInLine(admin.StackedInline):
     model = Article.tags.through
 
 @admin.register(Author)
-class AuthorAdmin(admin.ModelAdmin):
+class AuthorAdmin(admin.ModelAdmin, ExportAsCSVMixin):
+    actions = ['export_as_csv']
     list_display = ['pk', 'name']
     list_display_links = ['pk', 'name']
 
 @admin.register(Category)
-class CategoryAdmin(admin.ModelAdmin):
+class CategoryAdmin(admin.ModelAdmin, ExportAsCSVMixin):
+    actions = ['export_as_csv']
     list_display = ['pk', 'name']
     list_display_links = ['pk', 'name']
 
 @admin.register(Tag)
-class TagAdmin(admin.ModelAdmin):
+class TagAdmin(admin.ModelAdmin, ExportAsCSVMixin):
+    actions = ['export_as_csv']
     list_display = ['pk', 'name']
     list_display_links = ['pk', 'name']
@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class BlogappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'blogapp'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        from blogapp.search import ARTICLE_INDEX
+
+        post_migrate.connect(
+            ARTICLE_INDEX.post_migrate,
+            sender=self,
+            dispatch_uid='blogapp_article_fts',
+        )
@@ -0,0 +1,5 @@
+from shopapp.search import FullTextIndex
+
+from blogapp.models import Article
+
+ARTICLE_INDEX = FullTextIndex(Article, ('title', 'content'))
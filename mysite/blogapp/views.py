@@ -2,12 +2,32 @@ from django.views.generic import ListView
 from django.contrib.auth.mixins import LoginRequiredMixin
 
 from blogapp.models import Article
+from blogapp.search import ARTICLE_INDEX
+from shopapp.pagination import KeysetPaginationMixin, with_preview
 
+ARTICLE_TAGS_PREVIEW = 5
 
-class ArticleListView(LoginRequiredMixin, ListView):
-    queryset = (Article.objects
-                .select_related('author')
-                .select_related('category')
-                .prefetch_related('tags')
-                .defer('updated_at', 'content'))
+
+class ArticleListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
+    queryset = with_preview(
+        Article.objects
+        .select_related('author')
+        .select_related('category')
+        .defer('updated_at', 'content')
+        .order_by('pk'),
+        'tags',
+        ARTICLE_TAGS_PREVIEW,
+    )
     context_object_name = 'articles'
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        search = self.request.GET.get('q', '').split()
+        if search:
+            queryset = ARTICLE_INDEX.search(queryset, search)
+        return queryset
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['search'] = self.request.GET.get('q', '')
+        return context
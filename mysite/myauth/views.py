@@ -19,6 +19,8 @@ from django.views.generic import (
     DetailView,
 )
 
+from shopapp.pagination import KeysetPaginationMixin
+
 from .models import Profile
 
 
@@ -32,8 +34,8 @@ class AboutMeView(UpdateView):
         return self.request.user.profile
 
 
-class UsersListView(LoginRequiredMixin, ListView):
-    model = User
+class UsersListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
+    queryset = User.objects.order_by('pk')
     context_object_name = "users"
     template_name = "myauth/users_list.html"
 
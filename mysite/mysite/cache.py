@@ -0,0 +1,343 @@
+"""
+Two-tier cache backend.
+
+L1 is a per-process LRU bounded by the size of the pickled values, L2 is
+an SQLite file shared by every worker on the node. Each L2 row carries a
+stamp that changes on every write; L1 entries remember the stamp they were
+loaded with and are dropped as soon as it no longer matches, so a write or
+delete in one worker invalidates the copies held by all the others.
+
+The stamp is compared at most every `STAMP_CHECK_INTERVAL` seconds (1 by
+default) per entry; in between, L1 hits need no I/O at all. A write in
+another worker may therefore be seen up to that long after it happened.
+Writes and deletes in the same process update L1 immediately. With 0 every
+L1 hit costs an indexed SQLite read, but a write is never seen late.
+
+Example::
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'mysite.cache.TwoTierCache',
+            'LOCATION': '/var/cache/mysite/cache.sqlite3',
+            'OPTIONS': {
+                'L1_MAX_BYTES': 32 * 1024 * 1024,
+                'L1_TIMEOUT': 300,
+                'STAMP_CHECK_INTERVAL': 1,
+                'MAX_ENTRIES': 100000,
+            },
+        },
+    }
+"""
+import os
+import pickle
+import random
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from .instrumentation import record_cache_access, timed_call
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires REAL,
+    stamp INTEGER NOT NULL
+)
+"""
+_ALIVE = '(expires IS NULL OR expires > ?)'
+DEFAULT_STAMP_CHECK_INTERVAL = 1.0
+
+
+@dataclass
+class _Entry:
+    value: bytes
+    expires: float
+    stamp: int
+    checked_at: float
+
+
+class _MemoryTier:
+    """Process-wide LRU shared by all threads using the same location."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries: OrderedDict[str, _Entry] = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {
+            'l1': {'hits': 0, 'misses': 0, 'evictions': 0},
+            'l2': {'hits': 0, 'misses': 0, 'evictions': 0},
+        }
+
+    def count(self, tier: str, counter: str, amount: int = 1) -> None:
+        with self.lock:
+            self.stats[tier][counter] += amount
+
+    def get(self, key: str) -> _Entry | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: _Entry) -> None:
+        if len(entry.value) > self.max_bytes:
+            self.pop(key)
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous.value)
+            self.entries[key] = entry
+            self.size += len(entry.value)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted.value)
+                self.stats['l1']['evictions'] += 1
+
+    def pop(self, key: str) -> None:
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.size -= len(entry.value)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+_memory_tiers: dict[str, _MemoryTier] = {}
+_memory_tiers_lock = threading.Lock()
+
+
+class TwoTierCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = str(location)
+        self._l1_timeout = float(options.get('L1_TIMEOUT', 300))
+        self._stamp_check_interval = float(
+            options.get('STAMP_CHECK_INTERVAL', DEFAULT_STAMP_CHECK_INTERVAL)
+        )
+        with _memory_tiers_lock:
+            self._l1 = _memory_tiers.setdefault(
+                self._path,
+                _MemoryTier(int(options.get('L1_MAX_BYTES', 16 * 1024 * 1024))),
+            )
+        self._local = threading.local()
+
+    # L2 storage
+
+    def _connection(self) -> sqlite3.Connection:
+        # SQLite connections must not cross a fork, so every process
+        # (and thread) opens its own.
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            Path(self._path).parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(
+                self._path,
+                timeout=10,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(_SCHEMA)
+            self._local.connection = connection
+            self._local.pid = pid
+        return self._local.connection
+
+    def _read(self, key: str, now: float):
+        return self._connection().execute(
+            f'SELECT value, expires, stamp FROM cache_entries '
+            f'WHERE key = ? AND {_ALIVE}',
+            (key, now),
+        ).fetchone()
+
+    def _current_stamp(self, key: str, now: float) -> int | None:
+        row = self._connection().execute(
+            f'SELECT stamp FROM cache_entries WHERE key = ? AND {_ALIVE}',
+            (key, now),
+        ).fetchone()
+        return row[0] if row else None
+
+    def _remember(self, key: str, value: bytes, expires: float | None,
+                  stamp: int, now: float) -> None:
+        l1_expires = now + self._l1_timeout
+        if expires is not None:
+            l1_expires = min(l1_expires, expires)
+        self._l1.put(key, _Entry(value, l1_expires, stamp, now))
+
+    def _cull(self, connection: sqlite3.Connection, now: float) -> None:
+        if self._cull_frequency == 0 or random.random() > 0.01:
+            return
+        culled = connection.execute(
+            'DELETE FROM cache_entries WHERE expires IS NOT NULL AND expires <= ?',
+            (now,),
+        ).rowcount
+        (count,) = connection.execute(
+            'SELECT COUNT(*) FROM cache_entries'
+        ).fetchone()
+        if count > self._max_entries:
+            culled += connection.execute(
+                'DELETE FROM cache_entries WHERE key IN ('
+                'SELECT key FROM cache_entries '
+                'ORDER BY expires IS NULL, expires LIMIT ?)',
+                (count // self._cull_frequency,),
+            ).rowcount
+        if culled:
+            self._l1.count('l2', 'evictions', culled)
+
+    def _dumps(self, value) -> bytes:
+        return pickle.dumps(value, self.pickle_protocol)
+
+    # Cache API
+
+    @timed_call('cache')
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        entry = self._l1.get(key)
+        if entry is not None and entry.expires > now:
+            if (now - entry.checked_at < self._stamp_check_interval
+                    or self._current_stamp(key, now) == entry.stamp):
+                entry.checked_at = now
+                self._l1.count('l1', 'hits')
+                record_cache_access(hit=True)
+                return pickle.loads(entry.value)
+        if entry is not None:
+            self._l1.pop(key)
+        self._l1.count('l1', 'misses')
+
+        row = self._read(key, now)
+        if row is None:
+            self._l1.count('l2', 'misses')
+            record_cache_access(hit=False)
+            return default
+        self._l1.count('l2', 'hits')
+        record_cache_access(hit=True)
+        value, expires, stamp = row
+        self._remember(key, value, expires, stamp, now)
+        return pickle.loads(value)
+
+    async def aget(self, key, default=None, version=None):
+        # An L1 hit within STAMP_CHECK_INTERVAL needs no I/O, so it skips
+        # the thread hop of the default implementation.
+        now = time.time()
+        entry = self._l1.get(self.make_and_validate_key(key, version=version))
+        if (entry is not None and entry.expires > now
+                and now - entry.checked_at < self._stamp_check_interval):
+            self._l1.count('l1', 'hits')
+            record_cache_access(hit=True)
+            return pickle.loads(entry.value)
+        return await sync_to_async(self.get, thread_sensitive=True)(key, default, version)
+
+    @timed_call('cache')
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        pickled = self._dumps(value)
+        expires = self.get_backend_timeout(timeout)
+        stamp = secrets.randbits(62)
+        connection = self._connection()
+        connection.execute(
+            'INSERT OR REPLACE INTO cache_entries (key, value, expires, stamp) '
+            'VALUES (?, ?, ?, ?)',
+            (key, pickled, expires, stamp),
+        )
+        self._cull(connection, now)
+        self._remember(key, pickled, expires, stamp, now)
+
+    @timed_call('cache')
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        pickled = self._dumps(value)
+        expires = self.get_backend_timeout(timeout)
+        stamp = secrets.randbits(62)
+        added = self._connection().execute(
+            'INSERT INTO cache_entries (key, value, expires, stamp) '
+            'VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET value = excluded.value, '
+            'expires = excluded.expires, stamp = excluded.stamp '
+            'WHERE cache_entries.expires IS NOT NULL '
+            'AND cache_entries.expires <= ?',
+            (key, pickled, expires, stamp, now),
+        ).rowcount == 1
+        if added:
+            self._remember(key, pickled, expires, stamp, now)
+        return added
+
+    @timed_call('cache')
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        self._l1.pop(key)
+        return self._connection().execute(
+            f'UPDATE cache_entries SET expires = ? WHERE key = ? AND {_ALIVE}',
+            (self.get_backend_timeout(timeout), key, now),
+        ).rowcount == 1
+
+    @timed_call('cache')
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._l1.pop(key)
+        return self._connection().execute(
+            'DELETE FROM cache_entries WHERE key = ?', (key,),
+        ).rowcount == 1
+
+    @timed_call('cache')
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        now = time.time()
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute(
+                f'SELECT value, expires FROM cache_entries '
+                f'WHERE key = ? AND {_ALIVE}',
+                (key, now),
+            ).fetchone()
+            if row is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = pickle.loads(row[0]) + delta
+            pickled = self._dumps(value)
+            stamp = secrets.randbits(62)
+            connection.execute(
+                'UPDATE cache_entries SET value = ?, stamp = ? WHERE key = ?',
+                (pickled, stamp, key),
+            )
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        self._remember(key, pickled, row[1], stamp, now)
+        return value
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache_entries')
+        self._l1.clear()
+
+    def close(self, **kwargs):
+        # The connection is reused by the thread across requests.
+        pass
+
+    def get_stats(self) -> dict:
+        """Hit/miss/eviction counters per tier plus the current L1 size."""
+        with self._l1.lock:
+            stats = {tier: dict(counters)
+                     for tier, counters in self._l1.stats.items()}
+            stats['l1']['bytes'] = self._l1.size
+            stats['l1']['entries'] = len(self._l1.entries)
+        return stats
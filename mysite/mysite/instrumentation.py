@@ -0,0 +1,166 @@
+"""
+Per-request instrumentation shared by the metrics middleware and friends.
+
+`collect_request_stats()` makes a `RequestStats` current for the duration
+of a request (a `ContextVar`, so it follows the request into threads and
+tasks that copy the context). Database queries are counted by an execute
+wrapper installed once per connection, and cache backends report hits and
+misses through `record_cache_access`. Code of interest reports the time
+spent in it with `timed` / `timed_call` under a phase name ("cache",
+"serializer", ...). Outside of a request all of these are no-ops.
+
+`capture_queries()` additionally keeps the statements themselves; it is
+meant for profiling single requests, not for every request.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field, fields
+from functools import wraps
+from time import perf_counter
+from typing import Callable, Iterator, Optional
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+@dataclass
+class RequestStats:
+    queries: int = 0
+    sql_time: float = 0.0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    # Seconds per phase. Phases may overlap: "sql" is part of "view".
+    phases: dict[str, float] = field(default_factory=dict)
+
+    def add_phase(self, name: str, duration: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + duration
+
+    def merge(self, other: 'RequestStats') -> None:
+        for item in fields(self):
+            if item.name == 'phases':
+                for name, duration in other.phases.items():
+                    self.add_phase(name, duration)
+            else:
+                setattr(self, item.name,
+                        getattr(self, item.name) + getattr(other, item.name))
+
+
+@dataclass(frozen=True)
+class CapturedQuery:
+    sql: str
+    duration: float
+    many: bool
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar('request_stats', default=None)
+_captured: ContextVar[Optional[list]] = ContextVar('captured_queries', default=None)
+
+
+def current_stats() -> Optional[RequestStats]:
+    return _current.get()
+
+
+def record_cache_access(hit: bool) -> None:
+    stats = _current.get()
+    if stats is None:
+        return
+    if hit:
+        stats.cache_hits += 1
+    else:
+        stats.cache_misses += 1
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    """Adds the time spent inside the block to `phase` of the current stats."""
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        stats.add_phase(phase, perf_counter() - started)
+
+
+def timed_call(phase: str) -> Callable[[Callable], Callable]:
+    """Decorator version of `timed`, cheaper on hot paths."""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            stats = _current.get()
+            if stats is None:
+                return func(*args, **kwargs)
+            started = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats.add_phase(phase, perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def _execute_wrapper(execute, sql, params, many, context):
+    stats = _current.get()
+    captured = _captured.get()
+    if stats is None and captured is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = perf_counter() - started
+        if stats is not None:
+            stats.queries += 1
+            stats.sql_time += duration
+        if captured is not None:
+            captured.append(CapturedQuery(sql, duration, many))
+
+
+def install_execute_wrapper(connection, **kwargs) -> None:
+    # The wrapper stays on the connection, so it is installed only once
+    # even though `connection_created` fires on every reconnect.
+    if _execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute_wrapper)
+
+
+connection_created.connect(install_execute_wrapper, dispatch_uid='mysite_instrumentation')
+
+
+def _install_on_open_connections() -> None:
+    # Connections opened before the signal receiver was connected.
+    for connection in connections.all(initialized_only=True):
+        install_execute_wrapper(connection)
+
+
+@contextmanager
+def collect_request_stats() -> Iterator[RequestStats]:
+    """
+    Collects stats of everything run inside the block.
+
+    Blocks may be nested: the inner block gets its own stats, which are
+    added to the outer ones when it exits, and queries are counted once.
+    """
+    _install_on_open_connections()
+    outer = _current.get()
+    stats = RequestStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+        if outer is not None:
+            outer.merge(stats)
+
+
+@contextmanager
+def capture_queries() -> Iterator[list[CapturedQuery]]:
+    """Collects SQL statements (without parameters) run inside the block."""
+    _install_on_open_connections()
+    captured: list[CapturedQuery] = []
+    token = _captured.set(captured)
+    try:
+        yield captured
+    finally:
+        _captured.reset(token)
@@ -0,0 +1,349 @@
+"""
+Per-view request metrics in the Prometheus text format.
+
+`MetricsMiddleware` records, per resolved URL name, HTTP method and status:
+request count, a latency histogram, SQL query count and time, cache hits
+and misses, and response size. Each worker process keeps its counters in
+memory and writes them to its own file in `METRICS_DIR` at most every
+`FLUSH_INTERVAL` seconds. The `/metrics` view sums the files of all
+workers, so a scrape sees the whole server rather than one worker.
+Counters of stopped workers are merged into one `RETIRED_NAME` file on
+scrape, so counters never go backwards and the directory does not grow
+with every restart. `/metrics` is served to staff users and, if
+`METRICS_TOKEN` is set, to requests with `Authorization: Bearer <token>`.
+
+The middleware runs natively under both WSGI and ASGI.
+"""
+import atexit
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from time import perf_counter
+from typing import AsyncIterator, Iterable, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: files of stopped workers are kept as they are.
+    fcntl = None
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+from django.views.decorators.http import require_safe
+
+from .instrumentation import RequestStats, collect_request_stats
+
+FLUSH_INTERVAL = 1.0
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LABELS = ('view', 'method', 'status')
+
+COUNTERS = {
+    'requests': ('django_http_requests_total', 'Requests handled.'),
+    'queries': ('django_db_queries_total', 'SQL queries executed.'),
+    'sql_time': ('django_db_query_duration_seconds_total', 'Time spent in SQL queries.'),
+    'cache_hits': ('django_cache_hits_total', 'Cache reads that found a value.'),
+    'cache_misses': ('django_cache_misses_total', 'Cache reads that found nothing.'),
+    'response_bytes': ('django_http_response_size_bytes_total', 'Response body bytes sent.'),
+}
+HISTOGRAM = ('django_http_request_duration_seconds', 'Request latency.')
+RETIRED_NAME = 'retired.json'
+MERGE_LOCK_NAME = '.merge.lock'
+
+
+def _new_series() -> dict:
+    return {
+        **dict.fromkeys(COUNTERS, 0),
+        'duration_sum': 0.0,
+        'buckets': [0] * len(BUCKETS),
+    }
+
+
+def _add_items(merged: dict[tuple, dict], items: Iterable[dict]) -> None:
+    for item in items:
+        series = merged[tuple(item['labels'])]
+        for name in (*COUNTERS, 'duration_sum'):
+            series[name] += item[name]
+        for index, count in enumerate(item['buckets']):
+            series['buckets'][index] += count
+
+
+def _dump_items(series: dict[tuple, dict]) -> list[dict]:
+    return [{'labels': list(labels), **values} for labels, values in series.items()]
+
+
+def _write_atomic(path: Path, data: str) -> None:
+    tmp = path.with_name(f'.{path.name}.tmp')
+    tmp.write_text(data)
+    os.replace(tmp, path)
+
+
+def _read_json(path: Path, default):
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return default
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricsRegistry:
+    """Counters of the current process, flushed to a file of its own."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._directory: Optional[Path] = None
+        self.reset()
+
+    def reset(self) -> None:
+        """Forgets the counters of this process and starts a new file."""
+        self._pid = os.getpid()
+        self._series: dict[tuple, dict] = defaultdict(_new_series)
+        self._flushed_at = 0.0
+        # Start time keeps files apart when a pid is reused by a new worker.
+        self._filename = f'{self._pid}-{time.time_ns()}.json'
+
+    def _check_fork(self) -> None:
+        # Counters inherited from the parent process belong to its file.
+        if os.getpid() != self._pid:
+            self.reset()
+
+    def directory(self) -> Path:
+        if self._directory is not None:
+            return self._directory
+        return Path(settings.METRICS_DIR)
+
+    @contextmanager
+    def discarded(self) -> Iterator[None]:
+        """
+        Requests made inside the block (by management commands) are counted in
+        a temporary directory and then forgotten, so they reach neither the
+        real `METRICS_DIR` nor the flush at exit. Counters from before the
+        block are flushed to the real directory first.
+        """
+        self.flush(force=True)
+        with tempfile.TemporaryDirectory() as directory:
+            with self._lock:
+                self._directory = Path(directory)
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self._directory = None
+                self.reset()
+
+    def observe(self, labels: tuple, duration: float, stats: RequestStats,
+                response_bytes: int) -> None:
+        with self._lock:
+            self._check_fork()
+            series = self._series[labels]
+            series['requests'] += 1
+            series['queries'] += stats.queries
+            series['sql_time'] += stats.sql_time
+            series['cache_hits'] += stats.cache_hits
+            series['cache_misses'] += stats.cache_misses
+            series['response_bytes'] += response_bytes
+            series['duration_sum'] += duration
+            for index, bound in enumerate(BUCKETS):
+                if duration <= bound:
+                    series['buckets'][index] += 1
+        self.flush()
+
+    def add_response_bytes(self, labels: tuple, size: int) -> None:
+        with self._lock:
+            self._check_fork()
+            self._series[labels]['response_bytes'] += size
+        self.flush()
+
+    def flush(self, force: bool = False) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._check_fork()
+            if not self._series or (not force and now - self._flushed_at < FLUSH_INTERVAL):
+                return
+            self._flushed_at = now
+            directory = self.directory()
+            directory.mkdir(parents=True, exist_ok=True)
+            _write_atomic(directory / self._filename, json.dumps(_dump_items(self._series)))
+
+    def retire_stopped_workers(self) -> None:
+        """
+        Adds the counters of workers that are no longer running to the
+        `RETIRED_NAME` file and removes their files.
+
+        The retired file lists the files it already includes, so a crash
+        between writing it and removing them does not count them twice.
+        Runs under a file lock; if another process is merging, it is skipped.
+        """
+        directory = self.directory()
+        if fcntl is None or not directory.exists():
+            return
+        with open(directory / MERGE_LOCK_NAME, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            retired_path = directory / RETIRED_NAME
+            retired = _read_json(retired_path, {'merged': [], 'series': []})
+            for name in retired['merged']:
+                (directory / name).unlink(missing_ok=True)
+            stopped = [
+                path for path in directory.glob('*.json')
+                if path.name.partition('-')[0].isdigit()
+                and not _is_alive(int(path.name.partition('-')[0]))
+            ]
+            if not stopped:
+                return
+            merged: dict[tuple, dict] = defaultdict(_new_series)
+            _add_items(merged, retired['series'])
+            for path in stopped:
+                _add_items(merged, _read_json(path, []))
+            _write_atomic(retired_path, json.dumps({
+                'merged': [path.name for path in stopped],
+                'series': _dump_items(merged),
+            }))
+            for path in stopped:
+                path.unlink(missing_ok=True)
+
+    def collect(self) -> dict[tuple, dict]:
+        """Counters of all workers, summed per label set."""
+        self.flush(force=True)
+        self.retire_stopped_workers()
+        directory = self.directory()
+        merged: dict[tuple, dict] = defaultdict(_new_series)
+        retired = _read_json(directory / RETIRED_NAME, {'merged': [], 'series': []})
+        _add_items(merged, retired['series'])
+        for path in directory.glob('*.json'):
+            if path.name != RETIRED_NAME and path.name not in retired['merged']:
+                _add_items(merged, _read_json(path, []))
+        return merged
+
+
+registry = MetricsRegistry()
+atexit.register(registry.flush, force=True)
+
+
+def _counting(chunks, labels: tuple) -> Iterator[bytes]:
+    size = 0
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+    finally:
+        registry.add_response_bytes(labels, size)
+
+
+async def _acounting(chunks, labels: tuple) -> AsyncIterator[bytes]:
+    size = 0
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+    finally:
+        registry.add_response_bytes(labels, size)
+
+
+class MetricsMiddleware:
+    """Records per-view metrics. Should be the first middleware."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if self.async_mode:
+            return self.__acall__(request)
+        started = perf_counter()
+        with collect_request_stats() as stats:
+            response = self.get_response(request)
+        self.observe(request, response, perf_counter() - started, stats)
+        return response
+
+    async def __acall__(self, request: HttpRequest):
+        started = perf_counter()
+        with collect_request_stats() as stats:
+            response = await self.get_response(request)
+        self.observe(request, response, perf_counter() - started, stats)
+        return response
+
+    @staticmethod
+    def observe(request: HttpRequest, response, duration: float,
+                stats: RequestStats) -> None:
+        match = request.resolver_match
+        labels = (
+            match.view_name if match else 'unmatched',
+            request.method,
+            str(response.status_code),
+        )
+        if response.streaming:
+            # The body is produced after the view returns; count it as it goes.
+            counting = _acounting if response.is_async else _counting
+            response.streaming_content = counting(response.streaming_content, labels)
+            size = 0
+        else:
+            size = len(response.content)
+        registry.observe(labels, duration, stats, size)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(labels: tuple, **extra) -> str:
+    pairs = [*zip(LABELS, labels), *extra.items()]
+    return '{%s}' % ','.join(f'{name}="{_escape(value)}"' for name, value in pairs)
+
+
+def render_metrics(series: dict[tuple, dict]) -> str:
+    lines = []
+    items = sorted(series.items())
+    for key, (name, help_text) in COUNTERS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        lines += [f'{name}{_format_labels(labels)} {values[key]}' for labels, values in items]
+    name, help_text = HISTOGRAM
+    lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+    for labels, values in items:
+        for bound, count in zip(BUCKETS, values['buckets']):
+            lines.append(f'{name}_bucket{_format_labels(labels, le=str(bound))} {count}')
+        lines.append(f'{name}_bucket{_format_labels(labels, le="+Inf")} {values["requests"]}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {values["duration_sum"]}')
+        lines.append(f'{name}_count{_format_labels(labels)} {values["requests"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def _has_token(request: HttpRequest) -> bool:
+    token = settings.METRICS_TOKEN
+    if not token:
+        return False
+    expected = f'Bearer {token}'
+    received = request.headers.get('Authorization', '')
+    return hmac.compare_digest(received.encode(), expected.encode())
+
+
+@require_safe
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    """Metrics of all workers, for staff users or with `Bearer METRICS_TOKEN`."""
+    if not (request.user.is_staff or _has_token(request)):
+        return HttpResponse('Unauthorized', status=401)
+    return HttpResponse(
+        render_metrics(registry.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
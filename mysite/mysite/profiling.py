@@ -0,0 +1,235 @@
+"""
+On-demand request profiler.
+
+`ProfilerMiddleware` profiles a request with cProfile and records its SQL
+statements when either a staff user sends the `X-Profile` header or the
+request is picked by `PROFILER_SAMPLE_RATE` (0 by default). Any other
+request costs one header lookup and one comparison.
+
+Each profile is stored in `PROFILER_DIR` as a `.prof` file (the `pstats`
+format, readable by `python -m pstats` or snakeviz) next to a `.json` file
+with the request summary and statements. Only the newest `PROFILER_KEEP`
+profiles are kept. Staff can browse them, the most expensive first, at
+`/profiles/`.
+
+Under ASGI an async view is profiled as well, but the profile also holds
+whatever else the event loop ran meanwhile.
+"""
+import cProfile
+import io
+import json
+import pstats
+import random
+import re
+import time
+import uuid
+from dataclasses import asdict
+from pathlib import Path
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import FileResponse, Http404, HttpRequest
+from django.shortcuts import render
+from django.utils import timezone
+
+from .instrumentation import capture_queries
+
+PROFILE_HEADER = 'X-Profile'
+# Statements kept per profile; the totals still cover all of them.
+MAX_STATEMENTS = 500
+STATS_LINES = 60
+SORT_KEYS = ('cumulative', 'tottime', 'ncalls')
+
+_profile_id = re.compile(r'^\d+-[0-9a-f]{8}$')
+
+
+def profiles_dir() -> Path:
+    return Path(settings.PROFILER_DIR)
+
+
+def _new_profile_id() -> str:
+    # Starts with a timestamp, so ids sort by the time of the request.
+    return f'{time.time_ns()}-{uuid.uuid4().hex[:8]}'
+
+
+def save_profile(profiler: cProfile.Profile, summary: dict, queries: list) -> str:
+    directory = profiles_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    profile_id = _new_profile_id()
+    profiler.dump_stats(directory / f'{profile_id}.prof')
+    summary = {
+        'id': profile_id,
+        **summary,
+        'queries': len(queries),
+        'sql_time': sum(query.duration for query in queries),
+        'statements': [asdict(query) for query in queries[:MAX_STATEMENTS]],
+    }
+    (directory / f'{profile_id}.json').write_text(json.dumps(summary))
+    prune_profiles(settings.PROFILER_KEEP)
+    return profile_id
+
+
+def prune_profiles(keep: int) -> None:
+    summaries = sorted(profiles_dir().glob('*.json'), reverse=True)
+    for path in summaries[keep:]:
+        path.unlink(missing_ok=True)
+        path.with_suffix('.prof').unlink(missing_ok=True)
+
+
+def load_profiles() -> list[dict]:
+    profiles = []
+    for path in profiles_dir().glob('*.json'):
+        try:
+            profiles.append(json.loads(path.read_text()))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def load_profile(profile_id: str) -> dict:
+    if not _profile_id.match(profile_id):
+        raise Http404
+    try:
+        return json.loads((profiles_dir() / f'{profile_id}.json').read_text())
+    except (OSError, ValueError):
+        raise Http404
+
+
+class ProfilerMiddleware:
+    """
+    Profiles selected requests. Must come after `AuthenticationMiddleware`,
+    which provides `request.user` for the staff check.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.should_profile(request):
+            return self.get_response(request)
+        return self.profile(request)
+
+    async def __acall__(self, request: HttpRequest):
+        if PROFILE_HEADER in request.headers:
+            user = await request.auser()
+            if not user.is_staff:
+                return await self.get_response(request)
+        elif not self.sampled():
+            return await self.get_response(request)
+        return await self.aprofile(request)
+
+    @classmethod
+    def should_profile(cls, request: HttpRequest) -> bool:
+        if PROFILE_HEADER in request.headers:
+            return request.user.is_staff
+        return cls.sampled()
+
+    @staticmethod
+    def sampled() -> bool:
+        sample_rate = settings.PROFILER_SAMPLE_RATE
+        return sample_rate > 0 and random.random() < sample_rate
+
+    @staticmethod
+    def start_profiler():
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active in this process (Python 3.12+
+            # allows only one), so this request goes unprofiled.
+            return None
+        return profiler
+
+    def profile(self, request: HttpRequest):
+        profiler = self.start_profiler()
+        if profiler is None:
+            return self.get_response(request)
+        started = perf_counter()
+        try:
+            with capture_queries() as queries:
+                response = self.get_response(request)
+        finally:
+            profiler.disable()
+        return self.save(request, response, profiler, perf_counter() - started, queries)
+
+    async def aprofile(self, request: HttpRequest):
+        profiler = self.start_profiler()
+        if profiler is None:
+            return await self.get_response(request)
+        started = perf_counter()
+        try:
+            with capture_queries() as queries:
+                response = await self.get_response(request)
+        finally:
+            profiler.disable()
+        return self.save(request, response, profiler, perf_counter() - started, queries)
+
+    @staticmethod
+    def save(request: HttpRequest, response, profiler: cProfile.Profile,
+             duration: float, queries: list):
+        match = request.resolver_match
+        profile_id = save_profile(profiler, {
+            'path': request.get_full_path(),
+            'method': request.method,
+            'view': match.view_name if match else '',
+            'status': response.status_code,
+            'duration': duration,
+            'created_at': timezone.now().isoformat(),
+            # Streaming bodies are produced after the view returns.
+            'streaming': response.streaming,
+        }, queries)
+        response.headers['X-Profile-Id'] = profile_id
+        return response
+
+
+@staff_member_required
+def profile_list(request: HttpRequest):
+    """Stored profiles, the slowest first (`?order=recent` for the newest)."""
+    order = request.GET.get('order', 'duration')
+    key = 'id' if order == 'recent' else 'duration'
+    profiles = sorted(load_profiles(), key=lambda item: item[key], reverse=True)
+    return render(request, 'profiling/profile_list.html', {
+        'profiles': profiles,
+        'order': order,
+    })
+
+
+@staff_member_required
+def profile_detail(request: HttpRequest, profile_id: str):
+    summary = load_profile(profile_id)
+    sort = request.GET.get('sort')
+    if sort not in SORT_KEYS:
+        sort = SORT_KEYS[0]
+    output = io.StringIO()
+    try:
+        stats = pstats.Stats(str(profiles_dir() / f'{profile_id}.prof'), stream=output)
+    except OSError:
+        raise Http404
+    stats.strip_dirs().sort_stats(sort).print_stats(STATS_LINES)
+    statements = sorted(summary['statements'], key=lambda item: item['duration'], reverse=True)
+    return render(request, 'profiling/profile_detail.html', {
+        'profile': summary,
+        'statements': statements,
+        'stats': output.getvalue(),
+        'sort': sort,
+        'sort_keys': SORT_KEYS,
+    })
+
+
+@staff_member_required
+def profile_download(request: HttpRequest, profile_id: str):
+    load_profile(profile_id)
+    path = profiles_dir() / f'{profile_id}.prof'
+    if not path.exists():
+        raise Http404
+    return FileResponse(path.open('rb'), as_attachment=True, filename=path.name)
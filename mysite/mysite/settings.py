@@ -77,14 +77,18 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'mysite.metrics.MetricsMiddleware',
+    'mysite.timing.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'mysite.profiling.ProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'mysite.timing.ViewTimingMiddleware',
 ]
 
 ROOT_URLCONF = 'mysite.urls'
@@ -92,7 +96,7 @@ ROOT_URLCONF = 'mysite.urls'
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [],
+        'DIRS': [BASE_DIR / 'mysite' / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
@@ -122,12 +126,30 @@ DATABASES = {
 # Cache
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'orders_cache',
+        'BACKEND': 'mysite.cache.TwoTierCache',
+        'LOCATION': os.getenv(
+            'DJANGO_CACHE_LOCATION',
+            DATABASE_DIR / 'cache.sqlite3',
+        ),
+        'OPTIONS': {
+            'L1_MAX_BYTES': 32 * 1024 * 1024,
+            'L1_TIMEOUT': 300,
+            # Seconds a cached value may lag behind a write in another worker
+            'STAMP_CHECK_INTERVAL': float(
+                os.getenv('DJANGO_CACHE_STAMP_CHECK_INTERVAL', '1'),
+            ),
+            'MAX_ENTRIES': 100000,
+        },
     },
 }
 
 
+# Tests run with the cache (and other file-backed state) in a temporary
+# directory, see mysite/test_runner.py
+
+TEST_RUNNER = 'mysite.test_runner.TestRunner'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -154,6 +176,10 @@ REST_FRAMEWORK = {
         'django_filters.rest_framework.DjangoFilterBackend',
     ],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_RENDERER_CLASSES': [
+        'mysite.timing.TimedJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
 }
 
 SPECTACULAR_SETTINGS = {
@@ -185,6 +211,42 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'uploads'
 
+# Shop RSS feed: default and maximum number of items (`?limit=`)
+
+LATEST_PRODUCTS_FEED_ITEMS = int(os.getenv('DJANGO_FEED_ITEMS', 5))
+LATEST_PRODUCTS_FEED_MAX_ITEMS = int(os.getenv('DJANGO_FEED_MAX_ITEMS', 100))
+
+# Pre-rendered sitemaps (see mysite/sitemaps.py and `build_sitemaps`)
+
+SITEMAP_ROOT = Path(os.getenv('DJANGO_SITEMAP_ROOT', DATABASE_DIR / 'sitemaps'))
+SITEMAP_DOMAIN = os.getenv('DJANGO_SITEMAP_DOMAIN', '127.0.0.1:8000')
+SITEMAP_PROTOCOL = os.getenv('DJANGO_SITEMAP_PROTOCOL', 'https')
+SITEMAP_SECTION_SIZE = int(os.getenv('DJANGO_SITEMAP_SECTION_SIZE', 10000))
+
+# Per-view metrics (see mysite/metrics.py), served on /metrics to staff
+# users and to scrapers that send `Authorization: Bearer <METRICS_TOKEN>`
+
+METRICS_DIR = Path(os.getenv('DJANGO_METRICS_DIR', DATABASE_DIR / 'metrics'))
+METRICS_TOKEN = os.getenv('DJANGO_METRICS_TOKEN', '')
+
+# Request profiler (see mysite/profiling.py): staff users send the
+# X-Profile header, or a share of all requests is sampled
+
+PROFILER_DIR = Path(os.getenv('DJANGO_PROFILER_DIR', DATABASE_DIR / 'profiles'))
+PROFILER_SAMPLE_RATE = float(os.getenv('DJANGO_PROFILER_SAMPLE_RATE', '0'))
+PROFILER_KEEP = int(os.getenv('DJANGO_PROFILER_KEEP', '100'))
+
+# Server-Timing header and slow request log (see mysite/timing.py)
+
+SERVER_TIMING = os.getenv('DJANGO_SERVER_TIMING', '0') == '1'
+# Milliseconds; 0 turns the slow request log off
+SLOW_REQUEST_THRESHOLD = float(os.getenv('DJANGO_SLOW_REQUEST_MS', '1000'))
+
+# Sales rollups (see shopapp/rollups.py): seconds between refreshes by
+# a background thread in every worker; 0 leaves it to `refresh_rollups`
+
+SALES_ROLLUP_INTERVAL = float(os.getenv('DJANGO_SALES_ROLLUP_INTERVAL', '0'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
@@ -219,5 +281,12 @@ LOGGING = {
                 'console',
             ],
         },
+        'mysite.slow_requests': {
+            'level': 'WARNING',
+            'handlers': [
+                'console',
+            ],
+            'propagate': False,
+        },
     },
 }
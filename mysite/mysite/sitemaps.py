@@ -1,5 +1,240 @@
+"""
+Pre-rendered sitemap index.
+
+Every sitemap in `sitemaps` is split into sections (see `ShopSitemap`).
+`build_sitemaps` renders each section into `SITEMAP_ROOT` and records a
+fingerprint of its content in `manifest.json`; sections whose fingerprint
+did not change are not rendered again. The views below only serve those
+files, with `ETag` and `Last-Modified` taken from the manifest. A section
+added since the last build is rendered on demand; until `build_sitemaps`
+has run at least once the views answer 503 instead of rendering every
+section inside a request. Builds hold a file lock from loading the
+manifest to saving it, so a section rendered on demand and a concurrent
+`build_sitemaps` do not overwrite each other's manifest entries.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows: builds are not serialized.
+    fcntl = None
+
+from django.conf import settings
+from django.contrib.sitemaps.views import SitemapIndexItem, x_robots_tag
+from django.http import FileResponse, Http404, HttpResponse
+from django.template import loader
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_safe
+
 from shopapp.sitemap import ShopSitemap
 
 sitemaps = {
     'shop': ShopSitemap,
 }
+
+MANIFEST_NAME = 'manifest.json'
+INDEX_NAME = 'sitemap.xml'
+LOCK_NAME = '.build.lock'
+# Seconds a client should wait for `build_sitemaps` before asking again.
+NOT_BUILT_RETRY_AFTER = 300
+
+
+def sitemap_root() -> Path:
+    return Path(settings.SITEMAP_ROOT)
+
+
+def section_filename(name: str, number: int) -> str:
+    return f'sitemap-{name}-{number}.xml'
+
+
+def load_manifest() -> dict:
+    try:
+        return json.loads((sitemap_root() / MANIFEST_NAME).read_text())
+    except FileNotFoundError:
+        return {}
+
+
+@contextmanager
+def _build_lock() -> Iterator[None]:
+    """Serializes load → build → save of the manifest between processes."""
+    sitemap_root().mkdir(parents=True, exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    with open(sitemap_root() / LOCK_NAME, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    # Readers never see a half-written file, even while another process
+    # or thread rebuilds the same section: every writer gets its own
+    # temporary file.
+    with tempfile.NamedTemporaryFile(
+        dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp', delete=False,
+    ) as tmp:
+        tmp.write(data)
+    try:
+        os.replace(tmp.name, path)
+    except BaseException:
+        os.unlink(tmp.name)
+        raise
+
+
+def _save_manifest(manifest: dict) -> None:
+    data = json.dumps(manifest, indent=2, sort_keys=True).encode()
+    _write_atomic(sitemap_root() / MANIFEST_NAME, data)
+
+
+def _absolute_url(path: str) -> str:
+    return f'{settings.SITEMAP_PROTOCOL}://{settings.SITEMAP_DOMAIN}{path}'
+
+
+def build_section(manifest: dict, name: str, number: int,
+                  force: bool = False) -> bool:
+    """Renders one section if its content changed. Returns True if it did."""
+    sitemap = sitemaps[name](section=number)
+    filename = section_filename(name, number)
+    path = sitemap_root() / filename
+    fingerprint, lastmod = sitemap.fingerprint()
+    entry = manifest.get(filename)
+    if lastmod is None:
+        # Nothing to list: every product in the range is gone or archived.
+        path.unlink(missing_ok=True)
+        return manifest.pop(filename, None) is not None
+    if (not force and entry is not None
+            and entry['fingerprint'] == fingerprint and path.exists()):
+        return False
+    urls = sitemap.get_urls(
+        site=SimpleNamespace(domain=settings.SITEMAP_DOMAIN),
+        protocol=settings.SITEMAP_PROTOCOL,
+    )
+    content = loader.render_to_string('sitemap.xml', {'urlset': urls})
+    _write_atomic(path, content.encode())
+    manifest[filename] = {
+        'fingerprint': fingerprint,
+        'lastmod': lastmod.isoformat(),
+        'generated_at': time.time(),
+    }
+    return True
+
+
+def build_index(manifest: dict) -> bool:
+    """Renders the index of all sections listed in the manifest."""
+    items = [
+        SitemapIndexItem(
+            _absolute_url(reverse('sitemap_section', kwargs={'filename': filename})),
+            datetime.fromisoformat(entry['lastmod']),
+        )
+        for filename, entry in sorted(manifest.items())
+        if filename != INDEX_NAME
+    ]
+    content = loader.render_to_string('sitemap_index.xml', {'sitemaps': items})
+    fingerprint = hashlib.sha1(content.encode()).hexdigest()
+    path = sitemap_root() / INDEX_NAME
+    entry = manifest.get(INDEX_NAME)
+    if entry is not None and entry['fingerprint'] == fingerprint and path.exists():
+        return False
+    _write_atomic(path, content.encode())
+    manifest[INDEX_NAME] = {'fingerprint': fingerprint, 'generated_at': time.time()}
+    return True
+
+
+def build_sitemaps(force: bool = False) -> tuple[int, int]:
+    """
+    Brings all section files and the index up to date.
+
+    Returns the number of rebuilt (or removed) and unchanged sections.
+    """
+    with _build_lock():
+        manifest = load_manifest()
+        current = {INDEX_NAME}
+        built = unchanged = 0
+        for name, sitemap_class in sitemaps.items():
+            for number in sitemap_class().sections():
+                current.add(section_filename(name, number))
+                if build_section(manifest, name, number, force):
+                    built += 1
+                else:
+                    unchanged += 1
+        for filename in set(manifest) - current:
+            (sitemap_root() / filename).unlink(missing_ok=True)
+            del manifest[filename]
+            built += 1
+        build_index(manifest)
+        _save_manifest(manifest)
+    return built, unchanged
+
+
+def _parse_filename(filename: str) -> tuple[str, int]:
+    name, _, number = filename.removeprefix('sitemap-').removesuffix('.xml').rpartition('-')
+    if name not in sitemaps or not number.isdigit():
+        raise Http404('Unknown sitemap section.')
+    number = int(number)
+    if number not in sitemaps[name]().sections():
+        raise Http404('Unknown sitemap section.')
+    return name, number
+
+
+def _not_built() -> HttpResponse:
+    response = HttpResponse(
+        'Sitemaps are not built yet.', status=503, content_type='text/plain',
+    )
+    response.headers['Retry-After'] = str(NOT_BUILT_RETRY_AFTER)
+    return response
+
+
+def _serve(request, filename: str, entry: dict):
+    etag = quote_etag(entry['fingerprint'])
+    last_modified = int(entry['generated_at'])
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified,
+    )
+    if response is None:
+        path = sitemap_root() / filename
+        response = FileResponse(path.open('rb'), content_type='application/xml')
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+@x_robots_tag
+@require_safe
+def index(request):
+    manifest = load_manifest()
+    if INDEX_NAME not in manifest or not (sitemap_root() / INDEX_NAME).exists():
+        return _not_built()
+    return _serve(request, INDEX_NAME, manifest[INDEX_NAME])
+
+
+@x_robots_tag
+@require_safe
+def section(request, filename: str):
+    manifest = load_manifest()
+    if filename not in manifest or not (sitemap_root() / filename).exists():
+        name, number = _parse_filename(filename)
+        if not manifest:
+            return _not_built()
+        with _build_lock():
+            # Another process may have built the section while we waited.
+            manifest = load_manifest()
+            build_section(manifest, name, number)
+            build_index(manifest)
+            _save_manifest(manifest)
+        if filename not in manifest:
+            raise Http404('Empty sitemap section.')
+    return _serve(request, filename, manifest[filename])
@@ -0,0 +1,46 @@
+"""
+Test runner that keeps the suite away from the files of the running site.
+
+Settings that point at files under `DATABASE_DIR` (see `isolated_settings`)
+are redirected into a temporary directory for the whole run, so tests
+never read or clear the real cache and never write metrics, sitemaps or
+profiles next to those of the site.
+"""
+import copy
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from .metrics import registry
+
+
+def isolated_settings(directory: Path) -> dict:
+    caches = copy.deepcopy(settings.CACHES)
+    caches['default']['LOCATION'] = str(directory / 'cache.sqlite3')
+    return {
+        'CACHES': caches,
+        'METRICS_DIR': directory / 'metrics',
+        'SITEMAP_ROOT': directory / 'sitemaps',
+        'PROFILER_DIR': directory / 'profiles',
+    }
+
+
+class TestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._tmp_dir = tempfile.TemporaryDirectory(prefix='mysite-tests-')
+        self._settings_override = override_settings(
+            **isolated_settings(Path(self._tmp_dir.name)),
+        )
+        self._settings_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        # Otherwise the flush at exit would write the counters of the
+        # test requests into the real METRICS_DIR.
+        registry.reset()
+        self._settings_override.disable()
+        self._tmp_dir.cleanup()
+        super().teardown_test_environment(**kwargs)
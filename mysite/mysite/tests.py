@@ -0,0 +1,361 @@
+import json
+import math
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from mysite.cache import TwoTierCache, _MemoryTier
+from mysite.instrumentation import RequestStats, collect_request_stats
+from mysite.metrics import BUCKETS, MetricsRegistry, registry
+from mysite.profiling import load_profiles
+from mysite import sitemaps
+from mysite.sitemaps import build_sitemaps
+from shopapp.models import Product
+
+
+class TwoTierCacheTestCase(SimpleTestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.location = Path(self.tmp_dir.name) / 'cache.sqlite3'
+        self.cache = self.make_worker(self.location, STAMP_CHECK_INTERVAL=0)
+        self.other_worker = self.make_worker(self.location, STAMP_CHECK_INTERVAL=0)
+
+    @staticmethod
+    def make_worker(location, **options):
+        cache = TwoTierCache(location, {'OPTIONS': options})
+        # Each worker process has its own L1.
+        cache._l1 = _MemoryTier(1024)
+        return cache
+
+    def test_l1_hit_after_l2_read(self):
+        self.cache.set('key', 'value')
+        self.assertEqual(self.other_worker.get('key'), 'value')
+        self.assertEqual(self.other_worker.get('key'), 'value')
+        stats = self.other_worker.get_stats()
+        self.assertEqual(stats['l1']['hits'], 1)
+        self.assertEqual(stats['l2']['hits'], 1)
+
+    def test_write_in_one_worker_invalidates_other(self):
+        self.cache.set('key', 'old')
+        self.assertEqual(self.other_worker.get('key'), 'old')
+        self.cache.set('key', 'new')
+        self.assertEqual(self.other_worker.get('key'), 'new')
+        self.cache.delete('key')
+        self.assertIsNone(self.other_worker.get('key'))
+
+    def test_stamp_is_checked_after_interval(self):
+        worker = self.make_worker(self.location, STAMP_CHECK_INTERVAL=1)
+        self.cache.set('key', 'old')
+        self.assertEqual(worker.get('key'), 'old')
+        self.cache.set('key', 'new')
+        # Within the interval the L1 copy is served without reading L2.
+        with mock.patch.object(worker, '_current_stamp') as current_stamp:
+            self.assertEqual(worker.get('key'), 'old')
+        current_stamp.assert_not_called()
+        with mock.patch('mysite.cache.time.time', return_value=time.time() + 2):
+            self.assertEqual(worker.get('key'), 'new')
+
+    def test_settings_check_stamps(self):
+        self.assertGreater(settings.CACHES['default']['OPTIONS']['STAMP_CHECK_INTERVAL'], 0)
+        # Tests never touch the cache file of the running site.
+        self.assertNotEqual(
+            Path(settings.CACHES['default']['LOCATION']).parent, settings.DATABASE_DIR,
+        )
+
+    def test_l1_is_bounded_in_bytes(self):
+        for i in range(10):
+            self.cache.set(f'key_{i}', 'x' * 200)
+        stats = self.cache.get_stats()
+        self.assertLessEqual(stats['l1']['bytes'], 1024)
+        self.assertGreater(stats['l1']['evictions'], 0)
+        self.assertEqual(self.cache.get('key_0'), 'x' * 200)
+
+    def test_expired_entries_are_missing(self):
+        self.cache.set('key', 'value', timeout=-1)
+        self.assertIsNone(self.other_worker.get('key'))
+        self.assertTrue(self.cache.add('key', 'added'))
+        self.assertFalse(self.other_worker.add('key', 'other'))
+        self.assertEqual(self.other_worker.get('key'), 'added')
+
+    def test_incr_is_shared(self):
+        self.cache.set('counter', 1)
+        self.assertEqual(self.other_worker.incr('counter'), 2)
+        self.assertEqual(self.cache.get('counter'), 2)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+
+@override_settings(SITEMAP_SECTION_SIZE=2)
+class SitemapTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = [
+            Product.objects.create(name=f'Product {i}', archived=i == 4)
+            for i in range(5)
+        ]
+        # Sections are ranges of primary keys, so line them up with them.
+        cls.first_section = math.ceil(cls.products[0].pk / 2)
+
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        settings_override = override_settings(SITEMAP_ROOT=tmp_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_only_changed_sections_are_rebuilt(self):
+        built, unchanged = build_sitemaps()
+        self.assertGreater(built, 0)
+        sections = built + unchanged
+        self.assertEqual(build_sitemaps(), (0, sections))
+
+        Product.objects.filter(pk=self.products[0].pk).update(archived=True)
+        self.assertEqual(build_sitemaps(), (1, sections - 1))
+
+    def test_not_built(self):
+        response = self.client.get(reverse('sitemap'))
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+        url = reverse('sitemap_section', kwargs={
+            'filename': f'sitemap-shop-{self.first_section}.xml',
+        })
+        self.assertEqual(self.client.get(url).status_code, 503)
+        self.assertFalse(any(Path(settings.SITEMAP_ROOT).glob('*.xml')))
+
+    def test_index_lists_sections(self):
+        build_sitemaps()
+        response = self.client.get(reverse('sitemap'))
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content).decode()
+        filename = f'sitemap-shop-{self.first_section}.xml'
+        self.assertIn(filename, content)
+
+    def test_section_conditional_get(self):
+        build_sitemaps()
+        filename = f'sitemap-shop-{self.first_section}.xml'
+        url = reverse('sitemap_section', kwargs={'filename': filename})
+        # A missing section file is rendered on demand.
+        (Path(settings.SITEMAP_ROOT) / filename).unlink()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content).decode()
+        self.assertIn(self.products[0].get_absolute_url(), content)
+        self.assertNotIn(self.products[4].get_absolute_url(), content)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(list(Path(settings.SITEMAP_ROOT).glob('.*.tmp')), [])
+
+    def test_on_demand_build_keeps_concurrent_changes(self):
+        build_sitemaps()
+        filename = f'sitemap-shop-{self.first_section}.xml'
+        other = f'sitemap-shop-{self.first_section + 1}.xml'
+        (Path(settings.SITEMAP_ROOT) / filename).unlink()
+        build_lock = sitemaps._build_lock
+
+        def concurrent_build():
+            # Another process saves the manifest while the request waits for the lock.
+            manifest = sitemaps.load_manifest()
+            manifest[other]['generated_at'] = 1.0
+            sitemaps._save_manifest(manifest)
+            return build_lock()
+
+        url = reverse('sitemap_section', kwargs={'filename': filename})
+        with mock.patch.object(sitemaps, '_build_lock', concurrent_build):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        manifest = json.loads((Path(settings.SITEMAP_ROOT) / 'manifest.json').read_text())
+        self.assertEqual(manifest[other]['generated_at'], 1.0)
+        self.assertIn(filename, manifest)
+
+    def test_unknown_section(self):
+        url = reverse('sitemap_section', kwargs={'filename': 'sitemap-shop-999.xml'})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        settings_override = override_settings(METRICS_DIR=self.tmp_dir.name, METRICS_TOKEN='')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        registry.reset()
+        self.staff = User.objects.create_user(username='metrics', is_staff=True)
+
+    @staticmethod
+    def sample(text: str, name: str, view: str) -> float:
+        prefix = f'{name}{{view="{view}",method="GET",status="200"}} '
+        for line in text.splitlines():
+            if line.startswith(prefix):
+                return float(line[len(prefix):])
+        return 0.0
+
+    def test_request_is_recorded_per_view(self):
+        Product.objects.create(name='Product')
+        self.client.get(reverse('shopapp:products_list'))
+        self.client.force_login(self.staff)
+        text = self.client.get(reverse('metrics')).content.decode()
+        view = 'shopapp:products_list'
+        self.assertEqual(self.sample(text, 'django_http_requests_total', view), 1)
+        self.assertGreater(self.sample(text, 'django_db_queries_total', view), 0)
+        self.assertGreater(self.sample(text, 'django_http_response_size_bytes_total', view), 0)
+        self.assertEqual(
+            self.sample(text, 'django_http_request_duration_seconds_count', view), 1,
+        )
+
+    def test_workers_are_summed(self):
+        labels = ('shopapp:index', 'GET', '200')
+        for worker in (MetricsRegistry(), MetricsRegistry()):
+            worker.observe(labels, 0.02, RequestStats(queries=3, cache_hits=1), 10)
+            worker.flush(force=True)
+        series = registry.collect()[labels]
+        self.assertEqual(series['requests'], 2)
+        self.assertEqual(series['queries'], 6)
+        self.assertEqual(series['cache_hits'], 2)
+        self.assertEqual(series['response_bytes'], 20)
+        self.assertEqual(series['buckets'][BUCKETS.index(0.025)], 2)
+
+    def test_stopped_workers_are_retired(self):
+        labels = ('shopapp:index', 'GET', '200')
+        worker = MetricsRegistry()
+        worker.observe(labels, 0.02, RequestStats(queries=3), 10)
+        worker.flush(force=True)
+        stopped = Path(self.tmp_dir.name) / '999999999-1.json'
+        (Path(self.tmp_dir.name) / worker._filename).rename(stopped)
+        worker.reset()
+        for _ in range(2):
+            self.assertEqual(registry.collect()[labels]['queries'], 3)
+        self.assertFalse(stopped.exists())
+        self.assertEqual(
+            [path.name for path in Path(self.tmp_dir.name).glob('*.json')],
+            ['retired.json'],
+        )
+
+    def test_discarded_requests_are_not_recorded(self):
+        labels = ('shopapp:products_list', 'GET', '200')
+        self.client.get(reverse('shopapp:products_list'))
+        with registry.discarded():
+            self.client.get(reverse('shopapp:products_list'))
+            self.client.get(reverse('shopapp:products_list'))
+        self.assertEqual(registry.directory(), Path(self.tmp_dir.name))
+        self.assertEqual(registry.collect()[labels]['requests'], 1)
+
+    def test_nested_stats_are_merged(self):
+        with collect_request_stats() as outer:
+            with collect_request_stats() as inner:
+                list(Product.objects.all())
+            list(Product.objects.all())
+        self.assertEqual(inner.queries, 1)
+        self.assertEqual(outer.queries, 2)
+
+    def test_staff_or_token_required(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer ')
+        self.assertEqual(response.status_code, 401)
+        with override_settings(METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+            response = self.client.get(
+                reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret',
+            )
+            self.assertEqual(response.status_code, 200)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+
+class ProfilerTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username='staff', password='pass', is_staff=True)
+        cls.user = User.objects.create_user(username='user', password='pass')
+        Product.objects.create(name='Product')
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        settings_override = override_settings(
+            PROFILER_DIR=self.tmp_dir.name, PROFILER_SAMPLE_RATE=0, PROFILER_KEEP=3,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_staff_header_profiles_request(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('shopapp:products_list'), HTTP_X_PROFILE='1')
+        profile_id = response.headers['X-Profile-Id']
+        [profile] = load_profiles()
+        self.assertEqual(profile['id'], profile_id)
+        self.assertEqual(profile['view'], 'shopapp:products_list')
+        self.assertEqual(profile['queries'], len(profile['statements']))
+        self.assertTrue(any('shopapp_product' in item['sql'] for item in profile['statements']))
+
+        response = self.client.get(reverse('profile_list'))
+        self.assertContains(response, profile_id)
+        response = self.client.get(reverse('profile_detail', kwargs={'profile_id': profile_id}))
+        self.assertContains(response, 'shopapp_product')
+        response = self.client.get(reverse('profile_download', kwargs={'profile_id': profile_id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content))
+
+    def test_header_ignored_for_non_staff(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('shopapp:products_list'), HTTP_X_PROFILE='1')
+        self.assertNotIn('X-Profile-Id', response.headers)
+        self.assertEqual(load_profiles(), [])
+        response = self.client.get(reverse('profile_list'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_sampling_keeps_newest_profiles(self):
+        with override_settings(PROFILER_SAMPLE_RATE=1):
+            ids = [
+                self.client.get(reverse('shopapp:index')).headers['X-Profile-Id']
+                for _ in range(5)
+            ]
+        self.assertEqual(sorted(item['id'] for item in load_profiles()), ids[-3:])
+        self.assertEqual(len(list(Path(self.tmp_dir.name).glob('*.prof'))), 3)
+
+
+@override_settings(SERVER_TIMING=True, SLOW_REQUEST_THRESHOLD=0)
+class ServerTimingTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.create(name='Product')
+
+    @staticmethod
+    def metrics(response) -> dict[str, str]:
+        return {
+            metric.split(';')[0]: metric
+            for metric in response.headers['Server-Timing'].split(', ')
+        }
+
+    def test_template_view_phases(self):
+        response = self.client.get(reverse('shopapp:products_list'))
+        metrics = self.metrics(response)
+        for name in ('total', 'middleware', 'view', 'sql', 'template'):
+            self.assertIn(name, metrics)
+        self.assertRegex(metrics['sql'], r'desc="[1-9]\d* queries"')
+
+    def test_api_phases(self):
+        response = self.client.get('/shop/api/product/', HTTP_ACCEPT='application/json')
+        metrics = self.metrics(response)
+        self.assertIn('serializer', metrics)
+        self.assertIn('json', metrics)
+        self.assertNotIn('template', metrics)
+
+    def test_slow_request_logged(self):
+        with override_settings(SERVER_TIMING=False, SLOW_REQUEST_THRESHOLD=0.001):
+            with self.assertLogs('mysite.slow_requests', 'WARNING') as logs:
+                response = self.client.get(reverse('shopapp:products_list'))
+        self.assertNotIn('Server-Timing', response.headers)
+        self.assertIn('Slow request GET /shop/products/ 200: total;dur=', logs.output[0])
+
+    def test_disabled(self):
+        with override_settings(SERVER_TIMING=False, SLOW_REQUEST_THRESHOLD=0):
+            response = self.client.get(reverse('shopapp:products_list'))
+        self.assertNotIn('Server-Timing', response.headers)
@@ -0,0 +1,161 @@
+"""
+`Server-Timing` header and the slow request log.
+
+`ServerTimingMiddleware` (right after `MetricsMiddleware`) collects the
+request stats and breaks the server time down into phases:
+
+- `middleware`: everything outside of the view;
+- `view`: resolving the view, running it and rendering its response;
+- `sql`: queries, with their count;
+- `cache`: cache backend calls, with hits and misses;
+- `serializer`: DRF serializers (see `TimedSerializerMixin`);
+- `template`: rendering of `TemplateResponse` (class-based views);
+- `json`: JSON encoding of API responses (`TimedJSONRenderer`).
+
+Phases overlap, e.g. "sql" and "template" are both part of "view".
+`ViewTimingMiddleware` must be the last middleware to measure the view.
+
+The header is sent when `SERVER_TIMING` is on. Requests slower than
+`SLOW_REQUEST_THRESHOLD` milliseconds are logged to "mysite.slow_requests"
+with the same breakdown. With both off the middlewares are not loaded.
+Both run natively under WSGI and ASGI.
+"""
+import logging
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpRequest
+from django.template.response import TemplateResponse
+from rest_framework.renderers import JSONRenderer
+
+from .instrumentation import (
+    RequestStats,
+    collect_request_stats,
+    current_stats,
+    timed,
+    timed_call,
+)
+
+log = logging.getLogger('mysite.slow_requests')
+
+PHASES = ('view', 'cache', 'serializer', 'template', 'json')
+
+
+def _enabled() -> bool:
+    return settings.SERVER_TIMING or settings.SLOW_REQUEST_THRESHOLD > 0
+
+
+def _metric(name: str, seconds: float, description: str = '') -> str:
+    metric = f'{name};dur={seconds * 1000:.1f}'
+    if description:
+        metric += f';desc="{description}"'
+    return metric
+
+
+def server_timing(total: float, stats: RequestStats) -> str:
+    """Value of the `Server-Timing` header."""
+    phases = stats.phases
+    metrics = [
+        _metric('total', total),
+        _metric('middleware', max(total - phases.get('view', 0.0), 0.0)),
+        _metric('sql', stats.sql_time, f'{stats.queries} queries'),
+    ]
+    for name in PHASES:
+        if name not in phases:
+            continue
+        description = ''
+        if name == 'cache':
+            description = f'{stats.cache_hits} hits, {stats.cache_misses} misses'
+        metrics.append(_metric(name, phases[name], description))
+    return ', '.join(metrics)
+
+
+class ServerTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not _enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request: HttpRequest):
+        if self.async_mode:
+            return self.__acall__(request)
+        started = perf_counter()
+        with collect_request_stats() as stats:
+            response = self.get_response(request)
+        return self.finish(request, response, perf_counter() - started, stats)
+
+    async def __acall__(self, request: HttpRequest):
+        started = perf_counter()
+        with collect_request_stats() as stats:
+            response = await self.get_response(request)
+        return self.finish(request, response, perf_counter() - started, stats)
+
+    @staticmethod
+    def finish(request: HttpRequest, response, total: float, stats: RequestStats):
+        header = server_timing(total, stats)
+        if settings.SERVER_TIMING:
+            response.headers['Server-Timing'] = header
+        threshold = settings.SLOW_REQUEST_THRESHOLD
+        if threshold > 0 and total * 1000 >= threshold:
+            log.warning(
+                'Slow request %s %s %s: %s',
+                request.method, request.get_full_path(), response.status_code, header,
+            )
+        return response
+
+
+class ViewTimingMiddleware:
+    """Times the view and template rendering. Must be the last middleware."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not _enabled():
+            raise MiddlewareNotUsed
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            self.get_response = get_response
+            markcoroutinefunction(self)
+        else:
+            self.get_response = timed_call('view')(get_response)
+
+    def __call__(self, request: HttpRequest):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request: HttpRequest):
+        with timed('view'):
+            return await self.get_response(request)
+
+    def process_template_response(self, request: HttpRequest, response):
+        # DRF responses are "template responses" too, but they are
+        # rendered by `TimedJSONRenderer` and friends.
+        if not isinstance(response, TemplateResponse):
+            return response
+        # Rendering starts right after this hook and ends with the
+        # post-render callbacks.
+        started = perf_counter()
+        stats = current_stats()
+
+        def rendered(response):
+            if stats is not None:
+                stats.add_phase('template', perf_counter() - started)
+
+        response.add_post_render_callback(rendered)
+        return response
+
+
+class TimedJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with timed('json'):
+            return super().render(data, accepted_media_type, renderer_context)
@@ -13,19 +13,18 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-import django.contrib.sitemaps.views
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.contrib.sitemaps.views import sitemap
-from django.urls import path, include
+from django.urls import path, include, re_path
 from drf_spectacular.views import (
     SpectacularAPIView,
     SpectacularRedocView,
     SpectacularSwaggerView,
 )
 
-from .sitemaps import sitemaps
+from . import profiling, sitemaps
+from .metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -43,11 +42,19 @@ urlpatterns = [
         SpectacularRedocView.as_view(url_name='schema'),
         name='redoc',
     ),
+    path('metrics', metrics_view, name='metrics'),
+    path('profiles/', profiling.profile_list, name='profile_list'),
+    path('profiles/<str:profile_id>/', profiling.profile_detail, name='profile_detail'),
     path(
-        'sitemap.xml',
-        sitemap,
-        {'sitemaps': sitemaps},
-         name='django.contrib.sitemaps.views.sitemap',
+        'profiles/<str:profile_id>/download/',
+        profiling.profile_download,
+        name='profile_download',
+    ),
+    path('sitemap.xml', sitemaps.index, name='sitemap'),
+    re_path(
+        r'^(?P<filename>sitemap-\w+-\d+\.xml)$',
+        sitemaps.section,
+        name='sitemap_section',
     ),
 ]
 
@@ -1,39 +1,43 @@
-import csv
-import io
-
-from django.contrib import admin
-from django.contrib.auth.models import User
-from django.db import transaction
+from django.conf import settings
+from django.contrib import admin, messages
 from django.db.models import QuerySet
 from django.http import HttpRequest, HttpResponse
+from django.utils import timezone
 from django.urls import path
 from django.shortcuts import render, redirect
 
-from .forms import ImportCSVForm
-from .models import Product, Order
-from .admin_mixins import ExportAsCSVMixin
+from .forms import ImportCSVForm, OrderItemForm
+from .models import Product, Order, OrderItem
+from .admin_mixins import ExportAsCSVMixin, FullTextSearchMixin
+from .cache import invalidate_catalog
+from .importers import ImportStats, import_orders_csv
+from .search import PRODUCT_INDEX
 
 
 class OrderInline(admin.TabularInline):
-    model = Product.orders.through
+    model = OrderItem
+    form = OrderItemForm
+    readonly_fields = "unit_price", "discount"
 
 
 @admin.action(description="Archive products")
 def mark_archived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
-    queryset.update(archived=True)
+    queryset.update(archived=True, updated_at=timezone.now())
+    invalidate_catalog()
 
 
 @admin.action(description="Unarchive products")
 def mark_unarchived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
-    queryset.update(archived=False)
+    queryset.update(archived=False, updated_at=timezone.now())
+    invalidate_catalog()
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
+class ProductAdmin(FullTextSearchMixin, admin.ModelAdmin, ExportAsCSVMixin):
     actions = [
         mark_archived,
         mark_unarchived,
-        "export_csv",
+        "export_as_csv",
     ]
     inlines = [
         OrderInline,
@@ -43,6 +47,7 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
     list_display_links = "pk", "name"
     ordering = "-name", "pk"
     search_fields = "name", "description"
+    search_index = PRODUCT_INDEX
     fieldsets = [
         (None, {
            "fields": ("name", "description"),
@@ -69,16 +74,23 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
 
 # class ProductInline(admin.TabularInline):
 class ProductInline(admin.StackedInline):
-    model = Order.products.through
+    model = OrderItem
+    form = OrderItemForm
+    readonly_fields = "unit_price", "discount"
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(admin.ModelAdmin, ExportAsCSVMixin):
+    actions = [
+        "export_as_csv",
+    ]
     inlines = [
         ProductInline,
     ]
-    list_display = "delivery_address", "promocode", "created_at", "user_verbose"
+    list_display = "delivery_address", "promocode", "created_at", "user_verbose", "total"
+    readonly_fields = "total", "items_count"
     change_list_template = 'shopapp/orders_changelist.html'
+    import_errors_shown = 10
 
     def get_queryset(self, request):
         return Order.objects.select_related("user").prefetch_related("products")
@@ -103,25 +115,29 @@ class OrderAdmin(admin.ModelAdmin):
             context = {'form': form}
             return render(request, 'admin/csv_form.html',
                           context=context, status=400)
-        self.save_csv_orders(
+        stats = self.save_csv_orders(
             form.files['csv_file'].file,
-            encoding=request.encoding,
+            encoding=request.encoding or settings.DEFAULT_CHARSET,
+        )
+        self.message_user(
+            request,
+            f'Imported {stats.imported} orders from CSV-file '
+            f'in {stats.elapsed:.2f}s ({stats.rows_per_second:.0f} rows/sec)',
         )
-        self.message_user(request, 'Orders imported from CSV-file successfully')
+        if stats.rejected:
+            shown = '; '.join(
+                f'line {line}: {reason}'
+                for line, reason in stats.rejected[:self.import_errors_shown]
+            )
+            hidden = len(stats.rejected) - self.import_errors_shown
+            if hidden > 0:
+                shown += f'; and {hidden} more'
+            self.message_user(
+                request,
+                f'Rejected {len(stats.rejected)} rows: {shown}',
+                level=messages.WARNING,
+            )
         return redirect('..')
 
-    def save_csv_orders(self, file, encoding):
-        csv_file = io.TextIOWrapper(file, encoding)
-        reader = csv.DictReader(csv_file)
-        with transaction.atomic():
-            for row in reader:
-                order = Order(
-                    delivery_address=row.get('delivery_address'),
-                    promocode=row.get('promocode'),
-                    user=User.objects.get(pk=int(row.get('user')))
-                )
-                order.save()
-                products = Product.objects.filter(
-                    pk__in=list(map(int, row.get('products').split(',')))
-                )
-                order.products.add(*products)
+    def save_csv_orders(self, file, encoding) -> ImportStats:
+        return import_orders_csv(file, encoding)
@@ -1,23 +1,35 @@
-import csv
-
 from django.db.models import QuerySet
 from django.db.models.options import Options
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest, StreamingHttpResponse
+
+from .exporters import EXPORT_CHUNK_SIZE, iter_csv
 
 
 class ExportAsCSVMixin:
+    export_fields = None
+    export_chunk_size = EXPORT_CHUNK_SIZE
+
     def export_as_csv(self, request: HttpRequest, queryset: QuerySet):
         meta: Options = self.model._meta
-        field_names = [field.name for field in meta.fields]
 
-        response = HttpResponse(content_type="text/csv")
+        response = StreamingHttpResponse(
+            iter_csv(queryset, self.export_fields, self.export_chunk_size),
+            content_type="text/csv",
+        )
         response["Content-Disposition"] = f"attachment; filename={meta}-export.csv"
-        writer = csv.writer(response)
-
-        writer.writerow(field_names)
-        for obj in queryset:
-            writer.writerow([getattr(obj, field) for field in field_names])
-
         return response
 
     export_as_csv.short_description = "Export as CSV"
+
+
+class FullTextSearchMixin:
+    """Поиск в админке через полнотекстовый индекс `search_index`."""
+
+    search_index = None
+
+    def get_search_results(self, request: HttpRequest, queryset: QuerySet,
+                           search_term: str):
+        index = self.search_index
+        if not search_term or index is None or not index.is_available(queryset.db):
+            return super().get_search_results(request, queryset, search_term)
+        return index.search(queryset, search_term.split()), False
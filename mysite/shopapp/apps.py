@@ -4,3 +4,20 @@ from django.apps import AppConfig
 class ShopappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shopapp'
+
+    def ready(self):
+        from django.conf import settings
+        from django.core.signals import request_started
+        from django.db.models.signals import post_migrate
+
+        from . import signals  # noqa: F401
+        from .rollups import start_rollup_job
+        from .search import PRODUCT_INDEX
+
+        post_migrate.connect(
+            PRODUCT_INDEX.post_migrate,
+            sender=self,
+            dispatch_uid='shopapp_product_fts',
+        )
+        if settings.SALES_ROLLUP_INTERVAL > 0:
+            request_started.connect(start_rollup_job, dispatch_uid='shopapp_rollup_job')
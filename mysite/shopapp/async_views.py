@@ -0,0 +1,147 @@
+"""
+Асинхронные варианты горячих эндпоинтов чтения для работы под ASGI.
+
+Выгрузки и API товаров и заказов только на чтение. Запросы к базе идут
+через асинхронный ORM (`aiterator`, `aget`), кэш — через асинхронный API,
+поэтому, пока ждётся база или кэш, воркер обслуживает другие соединения.
+Ответы совпадают с синхронными вариантами (`ProductsDataExportView`,
+`UserOrdersExportView`, `ProductViewSet`, `OrderViewSet`), но API
+поддерживает только keyset-пагинацию в порядке по умолчанию, без поиска,
+фильтров и `?ordering=`.
+
+Под WSGI эти представления тоже работают, но каждый запрос запускает
+свой цикл событий, так что смысл они имеют только под ASGI.
+"""
+import json
+import logging
+
+from django.contrib.auth.models import User
+from django.contrib.auth.views import redirect_to_login
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import QuerySet
+from django.http import Http404, HttpRequest, HttpResponse, JsonResponse
+from django.shortcuts import aget_object_or_404
+from django.views import View
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from mysite.instrumentation import timed
+
+from .cache import (
+    CATALOG_TIMEOUT,
+    USER_ORDERS_TIMEOUT,
+    aget_catalog_version,
+    auser_orders_cache_key,
+)
+from .exporters import aiter_json_object, aiter_ndjson, aiter_rows
+from .models import Order, Product
+from .pagination import InvalidCursor, apaginate_keyset
+from .responses import acached_response
+from .serializers import OrderSerializer, ProductSerializer
+from .views import ProductsDataExportView
+
+logger = logging.getLogger(__name__)
+
+
+class ProductsDataExportAsyncView(View):
+    """Асинхронный вариант `ProductsDataExportView`."""
+
+    export_fields = ProductsDataExportView.export_fields
+
+    async def get(self, request: HttpRequest) -> HttpResponse:
+        ndjson = request.GET.get("format") == "ndjson"
+        version = await aget_catalog_version()
+        return await acached_response(
+            request,
+            f"products_export_{'ndjson' if ndjson else 'json'}_v{version}",
+            lambda: self.render_products(ndjson),
+            "application/x-ndjson" if ndjson else "application/json",
+            CATALOG_TIMEOUT,
+        )
+
+    def render_products(self, ndjson: bool):
+        rows = aiter_rows(Product.objects.order_by("pk"), self.export_fields)
+        if ndjson:
+            return aiter_ndjson(rows)
+        return aiter_json_object("products", rows)
+
+
+class UserOrdersExportAsyncView(View):
+    """Асинхронный вариант `UserOrdersExportView`."""
+
+    async def get(self, request: HttpRequest, user_id) -> HttpResponse:
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await acached_response(
+            request,
+            await auser_orders_cache_key(user_id),
+            lambda: self.render_orders(user_id),
+            'application/json',
+            USER_ORDERS_TIMEOUT,
+        )
+
+    async def render_orders(self, user_id):
+        logger.info('Cache miss, set data in the cache!')
+        owner = await aget_object_or_404(User, pk=user_id)
+        orders = Order.objects.filter(user=owner).order_by('-created_at')
+        serializer = OrderSerializer()
+        rows = [row async for row in serializer.values_queryset(orders)]
+        data = await serializer.aserialize_rows(rows)
+        with timed('json'):
+            yield json.dumps(data, cls=DjangoJSONEncoder).encode()
+
+
+class ModelApiAsyncView(View):
+    """
+    Список (`?cursor=`, как у `KeysetPagination`) и отдельный объект
+    в том же JSON, что отдаёт соответствующий ModelViewSet.
+    """
+
+    serializer_class = None
+    queryset: QuerySet = None
+    page_size = api_settings.PAGE_SIZE
+
+    def render(self, data) -> HttpResponse:
+        with timed('json'):
+            content = JSONRenderer().render(data)
+        return HttpResponse(content, content_type='application/json')
+
+    async def get(self, request: HttpRequest, pk=None) -> HttpResponse:
+        serializer = self.serializer_class()
+        rows = serializer.values_queryset(self.queryset)
+        if pk is not None:
+            try:
+                row = await rows.aget(pk=pk)
+            except self.queryset.model.DoesNotExist:
+                raise Http404
+            [item] = await serializer.aserialize_rows([row])
+            return self.render(item)
+
+        cursor = request.GET.get('cursor')
+        try:
+            page = await apaginate_keyset(rows, self.page_size, cursor)
+        except InvalidCursor as exc:
+            return JsonResponse({'detail': str(exc)}, status=404)
+        return self.render({
+            'next': self.get_page_link(request, page.next_cursor),
+            'previous': self.get_page_link(request, page.previous_cursor),
+            'results': await serializer.aserialize_rows(page.object_list),
+        })
+
+    @staticmethod
+    def get_page_link(request: HttpRequest, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(request.build_absolute_uri(), 'cursor', cursor)
+
+
+class ProductApiAsyncView(ModelApiAsyncView):
+    serializer_class = ProductSerializer
+    queryset = Product.objects.all()
+
+
+class OrderApiAsyncView(ModelApiAsyncView):
+    serializer_class = OrderSerializer
+    queryset = Order.objects.order_by('pk')
@@ -0,0 +1,218 @@
+"""
+Кэширование в магазине.
+
+Для каждого пользователя в кэше хранится счётчик поколения его заказов,
+а для каталога товаров — общий счётчик поколения каталога. Счётчик входит
+в ключи закэшированных данных, поэтому для инвалидации достаточно его
+увеличить: старые записи просто перестают читаться и со временем
+вытесняются.
+
+Дорогие вычисления кэшируются через `get_or_compute`: пересчитывает
+значение только тот, кто взял блокировку, остальные получают устаревшее
+значение, пока оно не вышло за пределы окна `grace`.
+
+Функции с префиксом `a` — то же самое через асинхронный API кэша,
+для async-представлений.
+"""
+import asyncio
+import logging
+import math
+import random
+import time
+import uuid
+from typing import Awaitable, Callable, Iterable, Optional, TypeVar
+
+from django.core.cache import cache
+
+T = TypeVar('T')
+
+logger = logging.getLogger(__name__)
+
+USER_ORDERS_TIMEOUT = 60 * 60 * 6
+CATALOG_TIMEOUT = 60 * 60 * 6
+CATALOG_VERSION_KEY = 'catalog_gen'
+CATALOG_CHANGED_AT_KEY = 'catalog_changed_at'
+STALE_GRACE = 60
+LOCK_TIMEOUT = 30
+LOCK_POLL_INTERVAL = 0.05
+
+
+def _generation_key(user_id) -> str:
+    return f'user_orders_gen_{user_id}'
+
+
+def _get_generation(key: str) -> int:
+    # Начальное значение берётся от часов, а не с нуля: если счётчик
+    # вытеснят из кэша, новое поколение не совпадёт со старыми записями.
+    return cache.get_or_set(key, time.time_ns, timeout=None)
+
+
+async def _aget_generation(key: str) -> int:
+    return await cache.aget_or_set(key, time.time_ns, timeout=None)
+
+
+def _bump_generation(key: str) -> None:
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def get_user_orders_version(user_id) -> int:
+    """Текущее поколение заказов пользователя."""
+    return _get_generation(_generation_key(user_id))
+
+
+def user_orders_cache_key(user_id) -> str:
+    return f'user_orders_{user_id}_v{get_user_orders_version(user_id)}'
+
+
+async def auser_orders_cache_key(user_id) -> str:
+    version = await _aget_generation(_generation_key(user_id))
+    return f'user_orders_{user_id}_v{version}'
+
+
+def invalidate_user_orders(user_ids: Iterable) -> None:
+    """Сдвигает поколение заказов у каждого из пользователей."""
+    for user_id in set(user_ids):
+        _bump_generation(_generation_key(user_id))
+
+
+def get_catalog_version() -> int:
+    """Текущее поколение каталога товаров."""
+    return _get_generation(CATALOG_VERSION_KEY)
+
+
+async def aget_catalog_version() -> int:
+    return await _aget_generation(CATALOG_VERSION_KEY)
+
+
+def get_catalog_changed_at() -> float:
+    """Время (Unix) последнего сдвига поколения каталога."""
+    # Если метку вытеснили из кэша, изменение считается только что
+    # случившимся: клиенты лишний раз получат ответ, но не устаревший.
+    return cache.get_or_set(CATALOG_CHANGED_AT_KEY, time.time, timeout=None)
+
+
+def invalidate_catalog() -> None:
+    """Сдвигает поколение каталога после создания, изменения или удаления товаров."""
+    cache.set(CATALOG_CHANGED_AT_KEY, time.time(), timeout=None)
+    _bump_generation(CATALOG_VERSION_KEY)
+
+
+def _acquire_lock(lock_key: str, timeout: int) -> Optional[str]:
+    """Берёт блокировку в кэше; возвращает токен владельца или None."""
+    token = uuid.uuid4().hex
+    return token if cache.add(lock_key, token, timeout) else None
+
+
+def _release_lock(lock_key: str, token: str) -> None:
+    # Блокировка могла истечь и достаться другому: чужую не удаляем.
+    if cache.get(lock_key) == token:
+        cache.delete(lock_key)
+
+
+async def _aacquire_lock(lock_key: str, timeout: int) -> Optional[str]:
+    token = uuid.uuid4().hex
+    return token if await cache.aadd(lock_key, token, timeout) else None
+
+
+async def _arelease_lock(lock_key: str, token: str) -> None:
+    if await cache.aget(lock_key) == token:
+        await cache.adelete(lock_key)
+
+
+def _is_fresh(envelope, now: float, beta: float) -> bool:
+    if envelope is None:
+        return False
+    _, expires_at, delta = envelope
+    early = delta * beta * math.log(1 - random.random())
+    return now - early < expires_at
+
+
+def _envelope(value, started_at: float, timeout: int) -> tuple:
+    finished_at = time.time()
+    return value, finished_at + timeout, finished_at - started_at
+
+
+def get_or_compute(key: str, compute: Callable[[], T], timeout: int,
+                   grace: int = STALE_GRACE, beta: float = 1.0,
+                   lock_timeout: int = LOCK_TIMEOUT) -> T:
+    """
+    Берёт значение из кэша или вычисляет его, защищая от «давки».
+
+    Значение хранится вместе со временем устаревания и длительностью
+    последнего вычисления. Незадолго до устаревания запрос с некоторой
+    вероятностью пересчитывает его заранее (тем раньше, чем дороже
+    вычисление и больше `beta`). Пересчитывает только тот, кто взял
+    блокировку; остальные в течение `grace` секунд после устаревания
+    получают старое значение, а при пустом кэше ждут результат.
+    """
+    now = time.time()
+    envelope = cache.get(key)
+    if _is_fresh(envelope, now, beta):
+        return envelope[0]
+
+    lock_key = f'{key}:lock'
+    token = _acquire_lock(lock_key, lock_timeout)
+    if token is not None:
+        try:
+            started_at = time.time()
+            value = compute()
+            cache.set(key, _envelope(value, started_at, timeout), timeout + grace)
+            return value
+        finally:
+            _release_lock(lock_key, token)
+
+    if envelope is not None:
+        logger.debug('Serving stale value for %s while it is recomputed', key)
+        return envelope[0]
+
+    deadline = now + lock_timeout
+    while time.time() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        envelope = cache.get(key)
+        if envelope is not None:
+            return envelope[0]
+        if cache.get(lock_key) is None:
+            break
+    return compute()
+
+
+async def aget_or_compute(key: str, compute: Callable[[], Awaitable[T]], timeout: int,
+                          grace: int = STALE_GRACE, beta: float = 1.0,
+                          lock_timeout: int = LOCK_TIMEOUT) -> T:
+    """
+    Асинхронный вариант `get_or_compute`: `compute` — корутинная функция,
+    ожидание чужого пересчёта не занимает поток.
+    """
+    now = time.time()
+    envelope = await cache.aget(key)
+    if _is_fresh(envelope, now, beta):
+        return envelope[0]
+
+    lock_key = f'{key}:lock'
+    token = await _aacquire_lock(lock_key, lock_timeout)
+    if token is not None:
+        try:
+            started_at = time.time()
+            value = await compute()
+            await cache.aset(key, _envelope(value, started_at, timeout), timeout + grace)
+            return value
+        finally:
+            await _arelease_lock(lock_key, token)
+
+    if envelope is not None:
+        logger.debug('Serving stale value for %s while it is recomputed', key)
+        return envelope[0]
+
+    deadline = now + lock_timeout
+    while time.time() < deadline:
+        await asyncio.sleep(LOCK_POLL_INTERVAL)
+        envelope = await cache.aget(key)
+        if envelope is not None:
+            return envelope[0]
+        if await cache.aget(lock_key) is None:
+            break
+    return await compute()
+
@@ -0,0 +1,141 @@
+"""
+Лента изменений для синхронизации внешних систем (склад, ERP).
+
+`GET <api>/changes/?cursor=...` отдаёт в NDJSON строки, созданные или
+изменённые после курсора, в порядке (`updated_at`, pk) и не больше
+`?limit=` за запрос — в том же виде, что и API списка. Курсор для
+следующего запроса приходит в заголовке `X-Next-Cursor`, а
+`X-Has-More: true` значит, что за ним есть ещё строки. Без курсора
+лента начинается с самой старой строки — это первая полная выгрузка.
+Объём синхронизации зависит от числа изменений, а не от размера таблицы.
+
+Строки моложе `CHANGES_SAFETY_LAG` не отдаются: их транзакции могли ещё
+не зафиксироваться, и строка с меньшим `updated_at` оказалась бы позади
+уже выданного курсора.
+
+Удаление строк в ленту не попадает. Товары из каталога убираются
+архивированием (`archived`), и оно приходит как обычное изменение.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Iterator, Optional
+
+from django.db.models import Q, QuerySet
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
+from rest_framework.negotiation import BaseContentNegotiation
+from rest_framework.renderers import BaseRenderer
+from rest_framework.request import Request
+
+from .exporters import EXPORT_CHUNK_SIZE, buffered, iter_ndjson
+from .pagination import InvalidCursor, decode_cursor, encode_cursor, get_ordering, seek
+
+CHANGES_SAFETY_LAG = timedelta(seconds=5)
+CHANGES_LIMIT = 1000
+CHANGES_MAX_LIMIT = 10000
+
+
+@dataclass
+class ChangesPage:
+    queryset: QuerySet
+    next_cursor: Optional[str]
+    has_more: bool
+
+
+def changes_page(queryset: QuerySet, cursor: Optional[str] = None,
+                 limit: int = CHANGES_LIMIT,
+                 until: Optional[datetime] = None) -> ChangesPage:
+    """
+    Строки queryset, изменённые после `cursor` и раньше `until` (по
+    умолчанию — сейчас минус `CHANGES_SAFETY_LAG`), не больше `limit`.
+
+    Последняя строка страницы находится заранее запросом только по
+    индексу `updated_at`, поэтому курсор известен до того, как строки
+    начнут отдаваться потоком.
+    """
+    until = until or timezone.now() - CHANGES_SAFETY_LAG
+    queryset = queryset.filter(updated_at__lt=until).order_by('updated_at', 'pk')
+    ordering = get_ordering(queryset)
+    if cursor is not None:
+        values, _ = decode_cursor(ordering, cursor)
+        queryset = seek(queryset, ordering, values)
+
+    keys = queryset.values('updated_at', 'pk')
+    bounds = list(keys[limit - 1:limit + 1])
+    last = bounds[0] if bounds else keys.reverse().first()
+    if last is None:
+        return ChangesPage(queryset.none(), cursor, False)
+    queryset = queryset.filter(
+        Q(updated_at__lt=last['updated_at'])
+        | Q(updated_at=last['updated_at'], pk__lte=last['pk'])
+    )
+    return ChangesPage(
+        queryset,
+        encode_cursor(ordering, last, reverse=False),
+        len(bounds) > 1,
+    )
+
+
+def iter_changes(serializer, queryset: QuerySet,
+                 chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    """Строки queryset в NDJSON через `ValuesSerializerMixin` сериализатора."""
+    rows = serializer.values_queryset(queryset).iterator(chunk_size=chunk_size)
+    while chunk := list(islice(rows, chunk_size)):
+        yield from iter_ndjson(serializer.serialize_rows(chunk))
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Ответы `changes` (в том числе ошибки) — объекты JSON построчно."""
+
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return b''.join(iter_ndjson([data]))
+
+
+class NDJSONNegotiation(BaseContentNegotiation):
+    """
+    Лента отдаётся только в NDJSON, поэтому `Accept` клиента не
+    проверяется: `Accept: application/json` не должен давать 406.
+    """
+
+    def select_parser(self, request, parsers):
+        return parsers[0] if parsers else None
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class ChangeFeedMixin:
+    """Действие `changes` для ModelViewSet: лента изменений в NDJSON."""
+
+    @action(detail=False, renderer_classes=[NDJSONRenderer],
+            content_negotiation_class=NDJSONNegotiation)
+    def changes(self, request: Request):
+        try:
+            limit = int(request.query_params.get('limit', CHANGES_LIMIT))
+        except ValueError:
+            limit = CHANGES_LIMIT
+        limit = min(max(limit, 1), CHANGES_MAX_LIMIT)
+        try:
+            page = changes_page(
+                self.get_queryset(),
+                request.query_params.get('cursor'),
+                limit,
+            )
+        except InvalidCursor as exc:
+            raise NotFound(str(exc))
+
+        response = StreamingHttpResponse(
+            buffered(iter_changes(self.get_serializer(), page.queryset)),
+            content_type=NDJSONRenderer.media_type,
+        )
+        if page.next_cursor is not None:
+            response['X-Next-Cursor'] = page.next_cursor
+        response['X-Has-More'] = 'true' if page.has_more else 'false'
+        return response
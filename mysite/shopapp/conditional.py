@@ -0,0 +1,129 @@
+"""
+Условные GET-запросы (`ETag` / `Last-Modified`).
+
+Валидаторы считаются до сериализации или рендеринга шаблона: по счётчику
+версий данных, если он есть (`version_validators`, без запросов к базе),
+иначе одним агрегатным запросом по полю `updated_at` (`get_validators`).
+Если клиент прислал совпадающий `If-None-Match` или `If-Modified-Since`,
+он получает 304 без тела, и тяжёлая часть view не выполняется.
+"""
+import hashlib
+from datetime import datetime, timezone
+from functools import partial
+from typing import Callable, Optional
+
+from django.db.models import Count, Max, QuerySet
+from django.http import HttpRequest, HttpResponseBase
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def get_validators(queryset: QuerySet, key: str = '',
+                   field: str = 'updated_at') -> tuple[str, Optional[datetime]]:
+    """
+    `ETag` и `Last-Modified` для содержимого queryset.
+
+    Удаление строки не меняет максимум, но меняет количество, поэтому
+    оба значения входят в `ETag`. `key` отличает разные представления
+    одних и тех же данных (адрес с параметрами, формат ответа).
+    """
+    stats = queryset.order_by().aggregate(last_modified=Max(field), count=Count('pk'))
+    last_modified = stats['last_modified']
+    stamp = last_modified.isoformat() if last_modified else ''
+    digest = hashlib.sha1(f'{key}|{stats["count"]}|{stamp}'.encode()).hexdigest()
+    return quote_etag(digest), last_modified
+
+
+def version_validators(version, changed_at: float,
+                       key: str = '') -> tuple[str, Optional[datetime]]:
+    """
+    `ETag` и `Last-Modified` по счётчику версий данных и времени его
+    последнего сдвига. Счётчик сдвигается при любом изменении, в том
+    числе удалении, поэтому и `If-Modified-Since` видит удаление строк.
+    """
+    digest = hashlib.sha1(f'{key}|{version}'.encode()).hexdigest()
+    return quote_etag(digest), datetime.fromtimestamp(changed_at, tz=timezone.utc)
+
+
+def conditional_response(request: HttpRequest, queryset: QuerySet,
+                         respond: Callable[[], HttpResponseBase],
+                         field: str = 'updated_at') -> HttpResponseBase:
+    """
+    Отвечает 304, если данные queryset не изменились с прошлого запроса
+    клиента, иначе вызывает `respond` и добавляет валидаторы к ответу.
+    """
+    return validated_response(
+        request, partial(get_validators, queryset, field=field), respond,
+    )
+
+
+def validated_response(request: HttpRequest,
+                       validators: Callable[[str], tuple[str, Optional[datetime]]],
+                       respond: Callable[[], HttpResponseBase]) -> HttpResponseBase:
+    """
+    То же, что `conditional_response`, но валидаторы даёт `validators`:
+    функция от ключа представления (адрес с параметрами и `Accept`).
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return respond()
+    key = f'{request.get_full_path()}|{request.headers.get("Accept", "")}'
+    etag, last_modified = validators(key)
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = respond()
+        if response.status_code != 200:
+            return response
+    response.headers['ETag'] = etag
+    if timestamp is not None:
+        response.headers['Last-Modified'] = http_date(timestamp)
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    Условные GET-запросы для `list` и `retrieve` ModelViewSet.
+
+    Валидаторы `list` берутся из `get_list_version`, если у данных есть
+    счётчик версий, иначе считаются по отфильтрованному queryset;
+    валидаторы `retrieve` — по одной строке.
+    """
+
+    last_modified_field = 'updated_at'
+
+    def get_list_version(self) -> Optional[tuple]:
+        """
+        Версия данных списка и время (Unix) её изменения. Агрегат по
+        всей отфильтрованной таблице на каждый запрос списка дорог, поэтому
+        наборы с таким счётчиком (например, поколением каталога) его
+        переопределяют.
+        """
+        return None
+
+    def list(self, request, *args, **kwargs):
+        version = self.get_list_version()
+        if version is not None:
+            validators = partial(version_validators, *version)
+        else:
+            validators = partial(
+                get_validators,
+                self.filter_queryset(self.get_queryset()),
+                field=self.last_modified_field,
+            )
+        return validated_response(
+            request,
+            validators,
+            lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.get_queryset().filter(
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        )
+        return conditional_response(
+            request,
+            queryset,
+            lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs),
+            self.last_modified_field,
+        )
@@ -0,0 +1,192 @@
+"""
+Потоковая выгрузка данных магазина.
+
+Строки читаются из базы порциями только по нужным колонкам и сразу
+кодируются, поэтому расход памяти воркера не зависит от размера таблицы.
+Функции с префиксом `a` — асинхронные варианты для async-представлений.
+"""
+import csv
+import io
+from collections import defaultdict
+from itertools import islice
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, Optional, Sequence
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Field, QuerySet
+
+EXPORT_CHUNK_SIZE = 2000
+STREAM_BUFFER_SIZE = 64 * 1024
+
+_encoder = DjangoJSONEncoder()
+
+
+def iter_rows(queryset: QuerySet, fields: Sequence[str],
+              chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[dict]:
+    """Построчно отдаёт словари только с колонками `fields`."""
+    rows = queryset.values_list(*fields).iterator(chunk_size=chunk_size)
+    for row in rows:
+        yield dict(zip(fields, row))
+
+
+async def aiter_rows(queryset: QuerySet, fields: Sequence[str],
+                     chunk_size: int = EXPORT_CHUNK_SIZE) -> AsyncIterator[dict]:
+    """Асинхронный вариант `iter_rows`."""
+    # `values()`, а не `values_list()`: в Django 5.2 `aiterator()` по
+    # `values_list()` выполняет запрос прямо в цикле событий.
+    async for row in queryset.values(*fields).aiterator(chunk_size=chunk_size):
+        yield row
+
+
+def iter_json_object(key: str, rows: Iterable[dict]) -> Iterator[bytes]:
+    """Кодирует строки как `{"<key>": [...]}` по одному элементу за раз."""
+    yield ('{%s: [' % _encoder.encode(key)).encode()
+    separator = b''
+    for row in rows:
+        yield separator + _encoder.encode(row).encode()
+        separator = b', '
+    yield b']}'
+
+
+def iter_ndjson(rows: Iterable[dict]) -> Iterator[bytes]:
+    """Кодирует строки в NDJSON: один JSON-объект на строку."""
+    for row in rows:
+        yield _encoder.encode(row).encode() + b'\n'
+
+
+async def aiter_json_object(key: str, rows: AsyncIterable[dict]) -> AsyncIterator[bytes]:
+    yield ('{%s: [' % _encoder.encode(key)).encode()
+    separator = b''
+    async for row in rows:
+        yield separator + _encoder.encode(row).encode()
+        separator = b', '
+    yield b']}'
+
+
+async def aiter_ndjson(rows: AsyncIterable[dict]) -> AsyncIterator[bytes]:
+    async for row in rows:
+        yield _encoder.encode(row).encode() + b'\n'
+
+
+def buffered(chunks: Iterable[bytes],
+             size: int = STREAM_BUFFER_SIZE) -> Iterator[bytes]:
+    """Склеивает мелкие куски в блоки около `size` байт перед отправкой."""
+    buffer = []
+    buffered_size = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered_size += len(chunk)
+        if buffered_size >= size:
+            yield b''.join(buffer)
+            buffer.clear()
+            buffered_size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+async def abuffered(chunks: AsyncIterable[bytes],
+                    size: int = STREAM_BUFFER_SIZE) -> AsyncIterator[bytes]:
+    """Асинхронный вариант `buffered`."""
+    buffer = []
+    buffered_size = 0
+    async for chunk in chunks:
+        buffer.append(chunk)
+        buffered_size += len(chunk)
+        if buffered_size >= size:
+            yield b''.join(buffer)
+            buffer.clear()
+            buffered_size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def get_export_fields(queryset: QuerySet,
+                      names: Optional[Sequence[str]] = None) -> list[Field]:
+    """Поля модели для выгрузки: все обычные и many-to-many по умолчанию."""
+    meta = queryset.model._meta
+    if names is None:
+        return [*meta.fields, *meta.many_to_many]
+    return [meta.get_field(name) for name in names]
+
+
+def m2m_values(field: Field, pks: list,
+               related_ordering: bool = False) -> dict[object, list]:
+    """
+    pk связанных объектов для каждой строки из `pks`: один запрос
+    к промежуточной таблице на всю порцию строк.
+
+    С `related_ordering` связанные pk идут в порядке `Meta.ordering`
+    связанной модели, как их отдаёт `instance.<field>.all()`.
+    """
+    related = defaultdict(list)
+    for source_pk, target_pk in _m2m_pairs(field, pks, related_ordering):
+        related[source_pk].append(target_pk)
+    return related
+
+
+async def am2m_values(field: Field, pks: list,
+                      related_ordering: bool = False) -> dict[object, list]:
+    """Асинхронный вариант `m2m_values`."""
+    related = defaultdict(list)
+    async for source_pk, target_pk in _m2m_pairs(field, pks, related_ordering):
+        related[source_pk].append(target_pk)
+    return related
+
+
+def _m2m_pairs(field: Field, pks: list, related_ordering: bool) -> QuerySet:
+    through = field.remote_field.through
+    source = field.m2m_field_name()
+    target = field.m2m_reverse_field_name()
+    ordering = [f"{source}_id"]
+    if related_ordering:
+        ordering += [
+            f"-{target}__{name[1:]}" if name.startswith("-") else f"{target}__{name}"
+            for name in field.related_model._meta.ordering
+            if isinstance(name, str)
+        ]
+    return (
+        through.objects
+        .filter(**{f"{source}__in": pks})
+        .order_by(*ordering, f"{target}_id")
+        .values_list(f"{source}_id", f"{target}_id")
+    )
+
+
+def iter_csv(queryset: QuerySet,
+             names: Optional[Sequence[str]] = None,
+             chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Потоково кодирует queryset в CSV.
+
+    Внешние ключи выгружаются как pk связанного объекта, many-to-many —
+    списком pk через запятую, как их ожидает импорт заказов.
+    На каждую порцию строк приходится по одному запросу на m2m-поле.
+    """
+    fields = get_export_fields(queryset, names)
+    columns = [field.attname for field in fields if not field.many_to_many]
+    m2m_fields = [field for field in fields if field.many_to_many]
+    pk_name = queryset.model._meta.pk.attname
+
+    queryset = queryset.select_related(None).prefetch_related(None)
+    rows = queryset.values_list(pk_name, *columns).iterator(chunk_size=chunk_size)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([field.name for field in fields])
+    yield buffer.getvalue().encode()
+
+    while chunk := list(islice(rows, chunk_size)):
+        pks = [row[0] for row in chunk]
+        related = {
+            field.name: m2m_values(field, pks)
+            for field in m2m_fields
+        }
+        buffer.seek(0)
+        buffer.truncate()
+        for pk, *values in chunk:
+            values = iter(values)
+            writer.writerow([
+                ",".join(map(str, related[field.name].get(pk, ())))
+                if field.many_to_many else next(values)
+                for field in fields
+            ])
+        yield buffer.getvalue().encode()
@@ -1,4 +1,23 @@
-from django.forms import Form, FileField
+from django.forms import Form, FileField, ModelForm
+
+from .models import OrderItem
+
 
 class ImportCSVForm(Form):
     csv_file = FileField()
+
+
+class OrderItemForm(ModelForm):
+    """
+    Позиция заказа для inline-форм админки: цена и скидка берутся
+    из товара при его выборе, поле родителя формы inline убирают сами.
+    """
+
+    class Meta:
+        model = OrderItem
+        fields = "order", "product", "quantity"
+
+    def save(self, commit=True):
+        if self.instance._state.adding or "product" in self.changed_data:
+            self.instance.take_price_snapshot()
+        return super().save(commit)
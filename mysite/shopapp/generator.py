@@ -0,0 +1,337 @@
+"""
+Генерация больших наборов данных для нагрузочных тестов и бенчмарков.
+
+Пользователи с профилями, товары, заказы с позициями и статьи блога
+с тегами создаются через `bulk_create` порциями, строки промежуточных
+таблиц many-to-many пишутся напрямую. Итоги заказов считаются до вставки.
+Каждая порция — отдельная транзакция.
+
+Данные правдоподобны: число товаров в заказе распределено по степенному
+закону (в большинстве заказов один-два товара, в немногих — десятки;
+так же распределено количество товара в позиции),
+популярность товаров, пользователей, промокодов и тегов — по закону Ципфа,
+даты создания равномерно покрывают `days` дней до `end` и растут вместе
+с pk. При одинаковых `seed`, `end` и состоянии базы результат один и тот же,
+поэтому `end` по умолчанию — фиксированный момент `GENERATE_END`, а не «сейчас».
+"""
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from itertools import accumulate
+from timeit import default_timer
+from typing import Callable, Optional, Sequence
+
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.contrib.auth.models import User
+from django.db import models, transaction
+
+from blogapp.models import Article, Author, Category, Tag
+from myauth.models import Profile
+
+from .bulk import update_rows
+from .cache import invalidate_catalog, invalidate_user_orders
+from .models import Order, OrderItem, Product, order_totals
+
+GENERATE_BATCH_SIZE = 5000
+GENERATE_END = datetime(2025, 1, 1, tzinfo=timezone.utc)
+# Распределение количества одного товара в позиции заказа.
+QUANTITY_ALPHA = 2.5
+MAX_QUANTITY = 10
+
+PRODUCT_ADJECTIVES = (
+    'Compact', 'Classic', 'Wireless', 'Portable', 'Smart', 'Ergonomic',
+    'Premium', 'Rugged', 'Silent', 'Modular', 'Vintage', 'Ultra',
+)
+PRODUCT_NOUNS = (
+    'Laptop', 'Desktop', 'Smartphone', 'Monitor', 'Keyboard', 'Mouse',
+    'Headphones', 'Speaker', 'Camera', 'Tablet', 'Router', 'Printer',
+)
+STREETS = ('Lenina', 'Pushkina', 'Sadovaya', 'Mira', 'Gagarina', 'Sovetskaya')
+PROMOCODES = ('SALE10', 'SALE20', 'WELCOME', 'BLACKFRIDAY', 'SUMMER', 'VIP')
+CATEGORIES = ('News', 'Reviews', 'Guides', 'Deals', 'Stories', 'Releases')
+
+# Progress callback: этап, готово, всего, секунд с начала этапа.
+Progress = Callable[[str, int, int, float], None]
+
+
+@dataclass
+class Volumes:
+    """Сколько объектов создать. Ноль — использовать уже имеющиеся."""
+
+    users: int = 1000
+    products: int = 10_000
+    orders: int = 50_000
+    articles: int = 1000
+    tags: int = 100
+
+
+@dataclass
+class GenerateStats:
+    created: dict[str, int] = field(default_factory=dict)
+    elapsed: float = 0.0
+
+
+class ZipfSampler:
+    """
+    Выбор из `items` с вероятностью, обратной рангу в степени `s`.
+    Ранги назначаются в случайном порядке, чтобы популярными
+    не оказывались просто первые по pk объекты.
+    """
+
+    def __init__(self, items: Sequence, s: float, rng: random.Random):
+        self.items = list(items)
+        rng.shuffle(self.items)
+        self.cum_weights = list(accumulate(
+            1 / rank ** s for rank in range(1, len(self.items) + 1)
+        ))
+        self.rng = rng
+
+    def sample(self, k: int = 1) -> list:
+        return self.rng.choices(self.items, cum_weights=self.cum_weights, k=k)
+
+    def sample_distinct(self, k: int) -> list:
+        k = min(k, len(self.items))
+        if k * 2 > len(self.items):
+            return self.rng.sample(self.items, k)
+        chosen = {}
+        while len(chosen) < k:
+            chosen.update(dict.fromkeys(self.sample(k - len(chosen))))
+        return list(chosen)
+
+
+def power_law_count(rng: random.Random, alpha: float, maximum: int) -> int:
+    """Целое от 1 до `maximum` с хвостом распределения Парето."""
+    return min(int(rng.paretovariate(alpha)), maximum)
+
+
+class DataGenerator:
+    def __init__(self, seed: int = 0, batch_size: int = GENERATE_BATCH_SIZE,
+                 days: int = 365, max_items: int = 50, items_alpha: float = 1.6,
+                 end: Optional[datetime] = None,
+                 progress: Optional[Progress] = None):
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.max_items = max_items
+        self.items_alpha = items_alpha
+        self.progress = progress
+        self.end = end or GENERATE_END
+        self.start = self.end - timedelta(days=days)
+
+    def generate(self, volumes: Volumes) -> GenerateStats:
+        stats = GenerateStats()
+        started_at = default_timer()
+
+        user_pks = self.users(volumes.users, stats)
+        existing_users = not user_pks
+        if existing_users:
+            user_pks = list(User.objects.values_list('pk', flat=True))
+        product_pks = self.products(volumes.products, stats)
+        if not product_pks:
+            product_pks = list(
+                Product.objects.filter(archived=False).values_list('pk', flat=True)
+            )
+        if volumes.orders:
+            if not user_pks or not product_pks:
+                raise ValueError('Orders need users and active products.')
+            ordered_by = self.orders(volumes.orders, user_pks, product_pks, stats)
+            if existing_users:
+                invalidate_user_orders(ordered_by)
+        self.articles(volumes.articles, volumes.tags, stats)
+
+        # bulk_create не отправляет сигналы, поэтому кэш сбрасываем сами.
+        # У новых пользователей закэшированных заказов ещё нет.
+        if volumes.products:
+            invalidate_catalog()
+        stats.elapsed = default_timer() - started_at
+        return stats
+
+    # Helpers
+
+    def _moments(self, start: int, count: int, total: int) -> list[datetime]:
+        """Возрастающие моменты для объектов с номерами `start..start+count`."""
+        span = self.end - self.start
+        return [
+            self.start + span * ((i + self.rng.random()) / total)
+            for i in range(start, start + count)
+        ]
+
+    def _batches(self, label: str, total: int):
+        started_at = default_timer()
+        for start in range(0, total, self.batch_size):
+            count = min(self.batch_size, total - start)
+            yield start, count
+            if self.progress:
+                self.progress(label, start + count, total, default_timer() - started_at)
+
+    @staticmethod
+    def _next_number(model) -> int:
+        # Имена продолжают нумерацию, чтобы повторный запуск
+        # не нарушал уникальность.
+        last = model.objects.aggregate(last=models.Max('pk'))['last']
+        return (last or 0) + 1
+
+    # Stages
+
+    def users(self, count: int, stats: GenerateStats) -> list[int]:
+        first = self._next_number(User)
+        pks = []
+        for start, size in self._batches('users', count):
+            joined = self._moments(start, size, count)
+            with transaction.atomic():
+                users = User.objects.bulk_create(
+                    User(
+                        username=f'user{first + i}',
+                        email=f'user{first + i}@example.com',
+                        password=UNUSABLE_PASSWORD_PREFIX,
+                        date_joined=joined[i - start],
+                    )
+                    for i in range(start, start + size)
+                )
+                Profile.objects.bulk_create(
+                    Profile(user=user, agreement_accepted=self.rng.random() < 0.8)
+                    for user in users
+                )
+            pks += [user.pk for user in users]
+        stats.created['users'] = stats.created['profiles'] = len(pks)
+        return pks
+
+    def products(self, count: int, stats: GenerateStats) -> list[int]:
+        """Создаёт товары; возвращает pk тех из них, что не в архиве."""
+        first = self._next_number(Product)
+        active = []
+        for start, size in self._batches('products', count):
+            products = []
+            for i in range(start, start + size):
+                adjective = self.rng.choice(PRODUCT_ADJECTIVES)
+                noun = self.rng.choice(PRODUCT_NOUNS)
+                price = min(self.rng.lognormvariate(4, 1.2), 999_999)
+                discount = 0
+                if self.rng.random() < 0.2:
+                    discount = self.rng.choice((5, 10, 15, 25, 50))
+                products.append(Product(
+                    name=f'{adjective} {noun} {first + i}',
+                    description=f'{adjective} {noun.lower()} for everyday use.',
+                    price=Decimal(f'{price:.2f}'),
+                    discount=discount,
+                    archived=self.rng.random() < 0.03,
+                ))
+            created = self._moments(start, size, count)
+            with transaction.atomic():
+                Product.objects.bulk_create(products)
+                update_rows(Product, [
+                    (moment, moment, product.pk)
+                    for moment, product in zip(created, products)
+                ], 'created_at', 'updated_at')
+            active += [product.pk for product in products if not product.archived]
+        stats.created['products'] = count
+        return active
+
+    def orders(self, count: int, user_pks: list[int], product_pks: list[int],
+               stats: GenerateStats) -> set[int]:
+        """Создаёт заказы с позициями; возвращает pk их покупателей."""
+        users = ZipfSampler(user_pks, 1.1, self.rng)
+        products = ZipfSampler(product_pks, 1.0, self.rng)
+        promocodes = ZipfSampler(PROMOCODES, 1.0, self.rng)
+        prices = {
+            pk: (price, discount)
+            for pk, price, discount in
+            Product.objects.values_list('pk', 'price', 'discount').iterator()
+        }
+        ordered_by = set()
+        items = 0
+        for start, size in self._batches('orders', count):
+            orders = []
+            rows = []
+            for index, user_pk in enumerate(users.sample(size)):
+                order = Order(
+                    delivery_address=f'ul. {self.rng.choice(STREETS)}, '
+                                     f'd. {self.rng.randint(1, 200)}',
+                    promocode=promocodes.sample()[0] if self.rng.random() < 0.3 else '',
+                    user_id=user_pk,
+                )
+                orders.append(order)
+                rows += [
+                    (index, OrderItem(
+                        order=order,
+                        product_id=product_pk,
+                        quantity=power_law_count(self.rng, QUANTITY_ALPHA, MAX_QUANTITY),
+                        unit_price=prices[product_pk][0],
+                        discount=prices[product_pk][1],
+                    ))
+                    for product_pk in products.sample_distinct(
+                        power_law_count(self.rng, self.items_alpha, self.max_items)
+                    )
+                ]
+            totals = order_totals(
+                (index, row.quantity, row.unit_price, row.discount)
+                for index, row in rows
+            )
+            for index, order in enumerate(orders):
+                order.total, order.items_count = totals[index]
+            created = self._moments(start, size, count)
+            with transaction.atomic():
+                Order.objects.bulk_create(orders)
+                update_rows(Order, [
+                    (moment, moment, order.pk)
+                    for moment, order in zip(created, orders)
+                ], 'created_at', 'updated_at')
+                # order_id позиций берётся из только что сохранённых заказов.
+                OrderItem.objects.bulk_create(
+                    [row for _, row in rows], batch_size=self.batch_size,
+                )
+            items += len(rows)
+            ordered_by.update(order.user_id for order in orders)
+        stats.created['orders'] = count
+        stats.created['order_items'] = items
+        return ordered_by
+
+    def articles(self, count: int, tags_count: int, stats: GenerateStats) -> None:
+        if not count:
+            return
+        Category.objects.bulk_create(
+            [Category(name=name) for name in CATEGORIES], ignore_conflicts=True,
+        )
+        categories = list(
+            Category.objects.filter(name__in=CATEGORIES).values_list('pk', flat=True)
+        )
+        tag_names = [f'tag{i}' for i in range(1, tags_count + 1)]
+        Tag.objects.bulk_create([Tag(name=name) for name in tag_names], ignore_conflicts=True)
+        tags = ZipfSampler(
+            Tag.objects.filter(name__in=tag_names).values_list('pk', flat=True),
+            1.0, self.rng,
+        )
+        first_author = self._next_number(Author)
+        authors = Author.objects.bulk_create(
+            Author(name=f'Author {first_author + i}') for i in range(max(count // 50, 1))
+        )
+        through = Article.tags.through
+        items = 0
+        for start, size in self._batches('articles', count):
+            articles = [
+                Article(
+                    title=f'{self.rng.choice(PRODUCT_ADJECTIVES)} '
+                          f'{self.rng.choice(PRODUCT_NOUNS).lower()} review',
+                    content='Generated article content.',
+                    author=self.rng.choice(authors),
+                    category_id=self.rng.choice(categories),
+                )
+                for _ in range(size)
+            ]
+            published = self._moments(start, size, count)
+            with transaction.atomic():
+                Article.objects.bulk_create(articles)
+                update_rows(Article, [
+                    (moment, moment, article.pk)
+                    for moment, article in zip(published, articles)
+                ], 'pub_date', 'updated_at')
+                rows = [
+                    through(article_id=article.pk, tag_id=tag_pk)
+                    for article in articles
+                    for tag_pk in tags.sample_distinct(self.rng.randint(1, 5))
+                ]
+                through.objects.bulk_create(rows, batch_size=self.batch_size)
+            items += len(rows)
+        stats.created['authors'] = len(authors)
+        stats.created['articles'] = count
+        stats.created['article_tags'] = items
@@ -0,0 +1,193 @@
+import hashlib
+import json
+import re
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from blogapp.models import Article, Author, Category, Tag
+from mysite.metrics import registry
+from myauth.models import Profile
+from shopapp.management.endpoints import iter_endpoints, test_database
+from shopapp.models import Order, Product
+from shopapp.rollups import refresh_rollups
+
+DEFAULT_BASELINE = Path(__file__).resolve().parents[2] / 'query_plans_baseline.json'
+
+# Полный проход по таблице без индекса и сортировка во временном B-дереве.
+FULL_SCAN = re.compile(r'^SCAN (?!CONSTANT ROW)\S+$')
+TEMP_SORT = re.compile(r'^USE TEMP B-TREE FOR (ORDER|GROUP) BY')
+
+# Значения в тексте запроса, которые зависят от данных, а не от кода.
+SQL_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+SQL_IN_LIST = re.compile(r'IN \(\?(?:, \?)*\)')
+
+
+def fingerprint(sql: str) -> str:
+    """
+    Короткий отпечаток запроса: литералы заменены на `?`, списки `IN` — на
+    один элемент. Разные запросы одного view с одинаковым планом различаются,
+    а смена данных отпечаток не меняет.
+    """
+    normalized = SQL_LITERAL.sub('?', sql)
+    normalized = SQL_IN_LIST.sub('IN (?)', normalized)
+    normalized = ' '.join(normalized.split())
+    return hashlib.sha1(normalized.encode()).hexdigest()[:10]
+
+
+class Command(BaseCommand):
+    """
+    Runs EXPLAIN QUERY PLAN for every query made by the shop, blog and auth
+    views and reports full table scans and temp B-tree sorts that are not
+    listed in the baseline. Findings are keyed by endpoint, query
+    fingerprint and plan step. Data is seeded into a separate test database
+    unless --current-db is given
+    """
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seed', type=int, default=200,
+            help='Products to create (with users, orders and articles) '
+                 'before the audit.',
+        )
+        parser.add_argument(
+            '--current-db', action='store_true',
+            help='Seed the current database inside a transaction that is '
+                 'rolled back afterwards, instead of a separate test database.',
+        )
+        parser.add_argument('--baseline', type=Path, default=DEFAULT_BASELINE)
+        parser.add_argument(
+            '--update-baseline', action='store_true',
+            help='Accept all current findings as the new baseline.',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('The audit understands SQLite query plans only.')
+
+        if options['current_db']:
+            with transaction.atomic():
+                findings = self.run(options)
+                transaction.set_rollback(True)
+        else:
+            with test_database():
+                findings = self.run(options)
+
+        baseline_path: Path = options['baseline']
+        if options['update_baseline']:
+            baseline_path.write_text(json.dumps(sorted(findings), indent=2) + '\n')
+            self.stdout.write(self.style.SUCCESS(
+                f'Baseline with {len(findings)} findings written to {baseline_path}'
+            ))
+            return
+
+        baseline = set()
+        if baseline_path.exists():
+            baseline = set(json.loads(baseline_path.read_text()))
+        regressions = sorted(set(findings) - baseline)
+        fixed = sorted(baseline - set(findings))
+        for finding in fixed:
+            self.stdout.write(self.style.SUCCESS(f'fixed: {finding}'))
+        for finding in regressions:
+            self.stdout.write(self.style.ERROR(f'new: {finding}'))
+            self.stdout.write(f'    {findings[finding]}')
+        if regressions:
+            raise CommandError(f'{len(regressions)} query plan regressions found.')
+        self.stdout.write(self.style.SUCCESS(
+            f'No query plan regressions ({len(findings)} accepted findings).'
+        ))
+
+    def run(self, options) -> dict[str, str]:
+        if options['seed']:
+            self.seed(options['seed'])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        return self.audit()
+
+    def seed(self, count: int):
+        users = User.objects.bulk_create(
+            User(username=f'audit_user_{i}') for i in range(max(count // 10, 2))
+        )
+        Profile.objects.bulk_create(Profile(user=user) for user in users)
+        products = Product.objects.bulk_create(
+            Product(
+                name=f'Audit product {i}',
+                description='Audit product description',
+                price=Decimal(i % 100),
+                archived=i % 10 == 0,
+            )
+            for i in range(count)
+        )
+        orders = Order.objects.bulk_create(
+            Order(
+                delivery_address=f'Audit street {i % 20}',
+                promocode=f'PROMO{i % 5}',
+                user=users[i % len(users)],
+            )
+            for i in range(count * 2)
+        )
+        Order.products.through.objects.bulk_create(
+            Order.products.through(order_id=order.pk, product_id=product.pk)
+            for i, order in enumerate(orders)
+            for product in products[i % count:i % count + 3]
+        )
+        refresh_rollups(until=timezone.now())
+        author = Author.objects.create(name='Audit author')
+        category = Category.objects.create(name='Audit category')
+        tags = Tag.objects.bulk_create(Tag(name=f'audit_tag_{i}') for i in range(5))
+        articles = Article.objects.bulk_create(
+            Article(title=f'Audit article {i}', author=author, category=category)
+            for i in range(count // 2)
+        )
+        Article.tags.through.objects.bulk_create(
+            Article.tags.through(article_id=article.pk, tag_id=tag.pk)
+            for article in articles
+            for tag in tags[:2]
+        )
+
+    def audit(self) -> dict[str, str]:
+        superuser = User(username='audit_superuser', is_staff=True, is_superuser=True)
+        superuser.save()
+        Profile.objects.create(user=superuser)
+        client = Client(
+            raise_request_exception=False,
+            HTTP_HOST=(settings.ALLOWED_HOSTS or ['127.0.0.1'])[0],
+            REMOTE_ADDR='192.0.2.1',
+        )
+        findings = {}
+        caches = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        with registry.discarded(), override_settings(CACHES=caches):
+            for endpoint in iter_endpoints(search='audit'):
+                url = reverse(endpoint.name, kwargs=endpoint.kwargs)
+                client.force_login(superuser)
+                with CaptureQueriesContext(connection) as queries:
+                    response = client.get(url, endpoint.query)
+                    if getattr(response, 'streaming', False):
+                        for _ in response.streaming_content:
+                            pass
+                self.stdout.write(f'{response.status_code} {endpoint.label}')
+                for query in queries.captured_queries:
+                    sql = query['sql']
+                    if not sql.lstrip().upper().startswith('SELECT'):
+                        continue
+                    for detail in self.explain(sql):
+                        if FULL_SCAN.match(detail) or TEMP_SORT.match(detail):
+                            key = f'{endpoint.label} | {fingerprint(sql)} | {detail}'
+                            findings.setdefault(key, sql)
+        return findings
+
+    @staticmethod
+    def explain(sql: str) -> list[str]:
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [row[3] for row in cursor.fetchall()]
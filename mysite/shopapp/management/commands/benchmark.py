@@ -0,0 +1,253 @@
+import json
+import math
+import platform
+import tracemalloc
+from pathlib import Path
+from statistics import mean
+from time import perf_counter
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from blogapp.models import Article
+from mysite.instrumentation import collect_request_stats
+from mysite.metrics import registry
+from myauth.models import Profile
+from shopapp.generator import PRODUCT_NOUNS, DataGenerator, Volumes
+from shopapp.management.endpoints import iter_endpoints, test_database
+from shopapp.models import Order, Product
+
+SEARCH_TERM = PRODUCT_NOUNS[0].lower()
+# Время ответа считается ухудшением, только если выросло и в разах,
+# и в миллисекундах: короткие запросы слишком шумные.
+DEFAULT_TOLERANCE = 0.25
+MIN_REGRESSION_MS = 5.0
+
+CACHES = {
+    'none': {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+    'locmem': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+}
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Значение, не меньше которого `percent` процентов измерений (nearest-rank)."""
+    ordered = sorted(values)
+    rank = max(math.ceil(len(ordered) * percent / 100), 1)
+    return ordered[rank - 1]
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Ухудшения относительно baseline: больше запросов или выше p95."""
+    regressions = []
+    for label, result in sorted(results.items()):
+        expected = baseline.get(label)
+        if expected is None:
+            continue
+        if result['queries'] > expected['queries']:
+            regressions.append(
+                f'{label}: {expected["queries"]} -> {result["queries"]} queries'
+            )
+        limit = max(expected['p95_ms'] * (1 + tolerance),
+                    expected['p95_ms'] + MIN_REGRESSION_MS)
+        if result['p95_ms'] > limit:
+            regressions.append(
+                f'{label}: p95 {expected["p95_ms"]:.1f} -> {result["p95_ms"]:.1f} ms'
+            )
+    return regressions
+
+
+class Command(BaseCommand):
+    """
+    Seeds products, orders, users and articles (see `generate_data`) and
+    measures every GET endpoint of the shop, blog and auth apps (including
+    the API): p50/p95 latency, SQL queries per request and peak Python memory.
+    Results can be written as JSON and compared with a baseline
+    """
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--orders', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--articles', type=int, default=1000)
+        parser.add_argument('--tags', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Measured requests per endpoint.')
+        parser.add_argument('--warmup', type=int, default=2,
+                            help='Unmeasured requests per endpoint.')
+        parser.add_argument(
+            '--cache', choices=sorted(CACHES), default='none',
+            help='Cache backend during the run: none measures the views '
+                 'themselves, locmem measures warm caches.',
+        )
+        parser.add_argument(
+            '--filter', default='',
+            help='Measure only endpoints whose label contains this text.',
+        )
+        parser.add_argument(
+            '--current-db', action='store_true',
+            help='Seed the current database inside a transaction that is '
+                 'rolled back afterwards, instead of a separate test database.',
+        )
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Keep the seeded test database for the next run; '
+                 'it is seeded only when empty.',
+        )
+        parser.add_argument('--output', type=Path, help='Write results as JSON.')
+        parser.add_argument('--baseline', type=Path,
+                            help='Compare results with this file.')
+        parser.add_argument(
+            '--update-baseline', action='store_true',
+            help='Write results to --baseline instead of comparing.',
+        )
+        parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                            help='Allowed relative p95 growth.')
+
+    def handle(self, *args, **options):
+        if options['update_baseline'] and not options['baseline']:
+            raise CommandError('--update-baseline requires --baseline.')
+        if options['current_db']:
+            with transaction.atomic():
+                report = self.run(options)
+                transaction.set_rollback(True)
+        else:
+            report = self.run_in_test_db(options)
+
+        output = json.dumps(report, indent=2) + '\n'
+        if options['output']:
+            options['output'].write_text(output)
+        if options['update_baseline']:
+            options['baseline'].write_text(output)
+            self.stdout.write(self.style.SUCCESS(
+                f'Baseline written to {options["baseline"]}'
+            ))
+            return
+        if options['baseline']:
+            if not options['baseline'].exists():
+                raise CommandError(f'No baseline at {options["baseline"]}.')
+            baseline = json.loads(options['baseline'].read_text())
+            regressions = compare(report['results'], baseline['results'],
+                                  options['tolerance'])
+            for regression in regressions:
+                self.stdout.write(self.style.ERROR(f'regression: {regression}'))
+            if regressions:
+                raise CommandError(f'{len(regressions)} performance regressions found.')
+            self.stdout.write(self.style.SUCCESS('No performance regressions.'))
+
+    def run_in_test_db(self, options) -> dict:
+        # Отдельный файл, чтобы --keepdb мог переиспользовать данные.
+        name = str(settings.DATABASE_DIR / 'benchmark.sqlite3')
+        with test_database(name, keepdb=options['keepdb']):
+            return self.run(options)
+
+    def run(self, options) -> dict:
+        if not options['keepdb'] or not Product.objects.exists():
+            started = perf_counter()
+            self.seed(options)
+            self.stdout.write(f'Seeded in {perf_counter() - started:.1f}s')
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        superuser = User.objects.create(
+            username='benchmark_superuser', is_staff=True, is_superuser=True,
+        )
+        Profile.objects.create(user=superuser)
+        try:
+            results = self.measure(superuser, options)
+        finally:
+            superuser.delete()
+        return {
+            'meta': {
+                'created_at': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'cache': options['cache'],
+                'repeat': options['repeat'],
+                'volumes': {
+                    'products': Product.objects.count(),
+                    'orders': Order.objects.count(),
+                    'users': User.objects.count(),
+                    'articles': Article.objects.count(),
+                },
+            },
+            'results': results,
+        }
+
+    def seed(self, options):
+        generator = DataGenerator(seed=options['seed'])
+        generator.generate(Volumes(
+            users=options['users'],
+            products=options['products'],
+            orders=options['orders'],
+            articles=options['articles'],
+            tags=options['tags'],
+        ))
+
+    def measure(self, superuser, options) -> dict:
+        client = Client(
+            raise_request_exception=False,
+            HTTP_HOST=(settings.ALLOWED_HOSTS or ['127.0.0.1'])[0],
+            REMOTE_ADDR='192.0.2.1',
+        )
+        client.force_login(superuser)
+        results = {}
+        with registry.discarded(), override_settings(
+            CACHES=CACHES[options['cache']],
+            PROFILER_SAMPLE_RATE=0,
+        ):
+            for endpoint in iter_endpoints(search=SEARCH_TERM):
+                if options['filter'] not in endpoint.label:
+                    continue
+                url = reverse(endpoint.name, kwargs=endpoint.kwargs)
+
+                def request():
+                    response = client.get(url, endpoint.query)
+                    if response.streaming:
+                        for _ in response.streaming_content:
+                            pass
+                    return response
+
+                for _ in range(options['warmup']):
+                    request()
+                timings = []
+                queries = []
+                for _ in range(options['repeat']):
+                    started = perf_counter()
+                    with collect_request_stats() as stats:
+                        response = request()
+                    timings.append((perf_counter() - started) * 1000)
+                    queries.append(stats.queries)
+                # tracemalloc замедляет код, поэтому память меряется
+                # отдельным запросом.
+                tracemalloc.start()
+                try:
+                    request()
+                    _, peak = tracemalloc.get_traced_memory()
+                finally:
+                    tracemalloc.stop()
+
+                result = {
+                    'status': response.status_code,
+                    'p50_ms': round(percentile(timings, 50), 2),
+                    'p95_ms': round(percentile(timings, 95), 2),
+                    'mean_ms': round(mean(timings), 2),
+                    'queries': max(queries),
+                    'peak_kb': round(peak / 1024, 1),
+                }
+                results[endpoint.label] = result
+                self.stdout.write(
+                    f'{result["status"]} {endpoint.label}: '
+                    f'p50 {result["p50_ms"]:.1f} ms, p95 {result["p95_ms"]:.1f} ms, '
+                    f'{result["queries"]} queries, peak {result["peak_kb"]:.0f} KiB'
+                )
+        return results
@@ -0,0 +1,24 @@
+from django.core.management import BaseCommand
+
+from mysite.sitemaps import build_sitemaps, sitemap_root
+
+
+class Command(BaseCommand):
+    """
+    Pre-renders sitemap sections whose products changed and the sitemap index
+    """
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Render every section even if its content did not change.',
+        )
+
+    def handle(self, *args, **options):
+        built, unchanged = build_sitemaps(force=options['force'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Sitemaps in {sitemap_root()}: {built} sections rebuilt, '
+            f'{unchanged} unchanged'
+        ))
@@ -0,0 +1,71 @@
+from datetime import datetime, timezone
+
+from django.core.management import BaseCommand, CommandError
+
+from shopapp.generator import GENERATE_BATCH_SIZE, GENERATE_END, DataGenerator, Volumes
+
+PROGRESS_INTERVAL = 1.0
+
+
+class Command(BaseCommand):
+    """
+    Generates users with profiles, products, orders with line items and
+    blog articles with tags in bulk. The same seed gives the same data
+    """
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        defaults = Volumes()
+        parser.add_argument('--users', type=int, default=defaults.users)
+        parser.add_argument('--products', type=int, default=defaults.products)
+        parser.add_argument('--orders', type=int, default=defaults.orders)
+        parser.add_argument('--articles', type=int, default=defaults.articles)
+        parser.add_argument('--tags', type=int, default=defaults.tags)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=GENERATE_BATCH_SIZE)
+        parser.add_argument('--days', type=int, default=365,
+                            help='Spread creation dates over this many days before --end.')
+        parser.add_argument('--end', type=datetime.fromisoformat, default=GENERATE_END,
+                            help='Latest creation date (YYYY-MM-DD, UTC); fixed by default '
+                                 'so that the same seed gives the same dates.')
+        parser.add_argument('--max-items', type=int, default=50,
+                            help='Most products in one order.')
+
+    def handle(self, *args, **options):
+        self._reported_at = {}
+        end = options['end']
+        if end.tzinfo is None:
+            end = end.replace(tzinfo=timezone.utc)
+        generator = DataGenerator(
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            days=options['days'],
+            max_items=options['max_items'],
+            end=end,
+            progress=self.report,
+        )
+        volumes = Volumes(
+            users=options['users'],
+            products=options['products'],
+            orders=options['orders'],
+            articles=options['articles'],
+            tags=options['tags'],
+        )
+        try:
+            stats = generator.generate(volumes)
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        created = ', '.join(f'{count} {name}' for name, count in stats.created.items())
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {created} in {stats.elapsed:.1f}s'
+        ))
+
+    def report(self, label: str, done: int, total: int, elapsed: float):
+        # Не чаще раза в PROGRESS_INTERVAL секунд на этап, плюс итог этапа.
+        if done < total and elapsed - self._reported_at.get(label, 0.0) < PROGRESS_INTERVAL:
+            return
+        self._reported_at[label] = elapsed
+        rate = done / elapsed if elapsed else 0.0
+        self.stdout.write(f'{label}: {done}/{total} ({rate:.0f}/s)')
@@ -0,0 +1,24 @@
+from django.core.management import BaseCommand
+
+from shopapp.search import INDEXES
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds full-text search indexes
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        for index in INDEXES:
+            if not index.is_available(using):
+                self.stdout.write(f"Skip {index.table}: full-text search needs SQLite")
+                continue
+            index.ensure(using)
+            index.rebuild(using)
+            self.stdout.write(f"Rebuilt {index.table}")
+
+        self.stdout.write(self.style.SUCCESS("Search indexes rebuilt"))
@@ -0,0 +1,39 @@
+from datetime import datetime, timezone
+
+from django.core.management import BaseCommand, CommandError
+
+from shopapp.rollups import RollupBusy, refresh_rollups
+
+
+class Command(BaseCommand):
+    """
+    Refreshes the hourly and daily sales rollups with orders created since
+    the last refresh (see shopapp/rollups.py)
+    """
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since', type=datetime.fromisoformat,
+            help='Also recompute days from this date (YYYY-MM-DD, UTC), '
+                 'e.g. after orders were changed or imported with past dates.',
+        )
+        parser.add_argument(
+            '--rebuild', action='store_true',
+            help='Drop the rollups and build them again from the first order.',
+        )
+
+    def handle(self, *args, **options):
+        since = options['since']
+        if since is not None and since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        try:
+            stats = refresh_rollups(since=since, rebuild=options['rebuild'])
+        except RollupBusy:
+            raise CommandError('Rollups are being refreshed by another process.')
+        watermark = stats.watermark.isoformat() if stats.watermark else 'none'
+        self.stdout.write(self.style.SUCCESS(
+            f'Refreshed {stats.days} days ({stats.rows} rows) in {stats.elapsed:.1f}s, '
+            f'watermark {watermark}'
+        ))
@@ -0,0 +1,111 @@
+"""
+Обход GET-адресов приложений и отдельная тестовая база для команд,
+которые проверяют все view (`audit_query_plans`, `benchmark`).
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.urls import URLPattern, URLResolver, get_resolver
+
+CHECKED_NAMESPACES = ('shopapp', 'blogapp', 'myauth')
+
+
+@dataclass(frozen=True)
+class Endpoint:
+    name: str
+    kwargs: dict
+    query: dict
+
+    @property
+    def label(self) -> str:
+        params = '&'.join(f'{key}={value}' for key, value in self.query.items())
+        return f'{self.name}?{params}' if params else self.name
+
+
+def iter_patterns(patterns, namespace=''):
+    """Имена URL вместе с параметрами маршрута и view."""
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            ns = namespace
+            if pattern.namespace:
+                ns = f'{namespace}:{pattern.namespace}' if namespace else pattern.namespace
+            yield from iter_patterns(pattern.url_patterns, ns)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            params = list(pattern.pattern.regex.groupindex)
+            yield f'{namespace}:{pattern.name}', params, pattern.callback
+
+
+def view_model(callback):
+    """Модель, с которой работает view или viewset, если её можно узнать."""
+    view = getattr(callback, 'view_class', None) or getattr(callback, 'cls', None)
+    queryset = getattr(view, 'queryset', None)
+    if queryset is not None:
+        return queryset.model
+    return getattr(view, 'model', None)
+
+
+def list_variants(viewset, model, search: str):
+    """Параметры фильтрации, сортировки и поиска списка viewset."""
+    sample = model.objects.order_by('pk').first() if model else None
+    for field in getattr(viewset, 'filterset_fields', None) or ():
+        if sample is not None:
+            value = getattr(sample, model._meta.get_field(field).attname)
+            yield {field: value}
+    for field in getattr(viewset, 'ordering_fields', None) or ():
+        yield {'ordering': field}
+        yield {'ordering': f'-{field}'}
+    if getattr(viewset, 'search_fields', None):
+        yield {'search': search}
+
+
+def iter_endpoints(search: str, namespaces=CHECKED_NAMESPACES) -> Iterator[Endpoint]:
+    """
+    GET-адреса приложений из `namespaces`. Параметры маршрута берутся
+    у первых объектов в базе, для списков viewset добавляются варианты
+    с фильтрами, сортировками и поиском по строке `search`.
+    """
+    user = User.objects.order_by('pk').first()
+    for name, params, callback in iter_patterns(get_resolver().url_patterns):
+        if not name.startswith(namespaces) or 'format' in params:
+            continue
+        actions = getattr(callback, 'actions', None)
+        if actions is not None and 'get' not in actions:
+            continue
+        model = view_model(callback)
+        kwargs = {}
+        for param in params:
+            if param == 'user_id':
+                kwargs[param] = user.pk if user else 1
+            else:
+                obj = model.objects.order_by('pk').first() if model else None
+                kwargs[param] = obj.pk if obj else 1
+        yield Endpoint(name, kwargs, {})
+        if actions is not None and actions.get('get') == 'list':
+            for query in list_variants(callback.cls, model, search):
+                yield Endpoint(name, kwargs, query)
+
+
+@contextmanager
+def test_database(name: Optional[str] = None, keepdb: bool = False):
+    """
+    Создаёт тестовую базу с миграциями и переключает на неё соединение,
+    чтобы данные команды не попадали в рабочую базу и не держали её
+    блокировку на запись. `name` — файл базы SQLite (по умолчанию база в
+    памяти), `keepdb` сохраняет базу с данными для следующего запуска.
+    """
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    test_name = test_settings.get('NAME')
+    if connection.vendor == 'sqlite' and name and not test_name:
+        test_settings['NAME'] = name
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, serialize=False, keepdb=keepdb,
+    )
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+        test_settings['NAME'] = test_name
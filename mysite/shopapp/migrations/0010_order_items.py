@@ -0,0 +1,106 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:00
+
+from collections import defaultdict
+from decimal import ROUND_HALF_UP, Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def fill_items_and_totals(apps, schema_editor):
+    # Цены на момент старых заказов неизвестны, поэтому в позиции
+    # записываются текущие цена и скидка товара.
+    Order = apps.get_model('shopapp', 'Order')
+    OrderItem = apps.get_model('shopapp', 'OrderItem')
+    Product = apps.get_model('shopapp', 'Product')
+    product = Product.objects.filter(pk=models.OuterRef('product_id'))
+    order_pks = list(Order.objects.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(order_pks), BATCH_SIZE):
+        batch = order_pks[start:start + BATCH_SIZE]
+        items = OrderItem.objects.filter(order_id__in=batch)
+        items.update(
+            unit_price=models.Subquery(product.values('price')),
+            discount=models.Subquery(product.values('discount')),
+        )
+        totals = defaultdict(lambda: [Decimal(0), 0])
+        for order_id, quantity, price, discount in items.values_list(
+            'order_id', 'quantity', 'unit_price', 'discount',
+        ):
+            totals[order_id][0] += quantity * price * (100 - discount) / 100
+            totals[order_id][1] += quantity
+        Order.objects.bulk_update(
+            [
+                Order(
+                    pk=pk,
+                    total=total.quantize(Decimal('0.01'), ROUND_HALF_UP),
+                    items_count=count,
+                )
+                for pk, (total, count) in totals.items()
+            ],
+            ['total', 'items_count'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0009_updated_at'),
+    ]
+
+    operations = [
+        # Промежуточная таблица уже есть: модель OrderItem описывает её
+        # как есть, без изменения схемы, а новые колонки добавляются ниже.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='OrderItem',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='shopapp.order')),
+                        ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_items', to='shopapp.product')),
+                    ],
+                    options={
+                        'db_table': 'shopapp_order_products',
+                        'unique_together': {('order', 'product')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='order',
+                    name='products',
+                    field=models.ManyToManyField(related_name='orders', through='shopapp.OrderItem', to='shopapp.product'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=8),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='discount',
+            field=models.SmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['total'], name='shopapp_order_total_idx'),
+        ),
+        migrations.RunPython(fill_items_and_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.18 on 2026-10-18 00:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0010_order_items'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('watermark', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PromocodeSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('period', models.DateTimeField()),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('items', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('promocode', models.CharField(blank=True, max_length=20)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period'], name='shopapp_codesales_period_idx'), models.Index(fields=['promocode', 'period'], name='shopapp_codesales_code_idx')],
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'period', 'promocode'), name='shopapp_promocodesales_period_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SalesTotals',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('period', models.DateTimeField()),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('items', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period'], name='shopapp_sales_period_idx')],
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'period'), name='shopapp_salestotals_period_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('period', models.DateTimeField()),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('items', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shopapp.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['period'], name='shopapp_prodsales_period_idx'), models.Index(fields=['product', 'period'], name='shopapp_prodsales_prod_idx')],
+                'constraints': [models.UniqueConstraint(fields=('granularity', 'period', 'product'), name='shopapp_productsales_period_uniq')],
+            },
+        ),
+    ]
@@ -1,17 +1,37 @@
+from collections import defaultdict
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Iterable
+
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
 from django.urls import reverse
 
+# Заказов за один пересчёт итогов в `update_order_totals`.
+ORDER_TOTALS_BATCH_SIZE = 1000
+CENT = Decimal("0.01")
+
 
 class Product(models.Model):
     class Meta:
         ordering = ["name", "price"]
+        indexes = [
+            models.Index(fields=["name", "price"], name="shopapp_product_name_price_idx"),
+            models.Index(
+                fields=["name", "price"],
+                condition=models.Q(archived=False),
+                name="shopapp_product_active_idx",
+            ),
+            models.Index(fields=["price"], name="shopapp_product_price_idx"),
+            models.Index(fields=["created_at"], name="shopapp_product_created_idx"),
+            models.Index(fields=["updated_at"], name="shopapp_product_updated_idx"),
+        ]
 
     name = models.CharField(max_length=100)
     description = models.TextField(null=False, blank=True)
     price = models.DecimalField(default=0, max_digits=8, decimal_places=2)
     discount = models.SmallIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     archived = models.BooleanField(default=False)
 
     def get_absolute_url(self):
@@ -22,8 +42,171 @@ class Product(models.Model):
 
 
 class Order(models.Model):
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "created_at"], name="shopapp_order_user_created_idx"),
+            models.Index(fields=["created_at"], name="shopapp_order_created_idx"),
+            models.Index(fields=["updated_at"], name="shopapp_order_updated_idx"),
+            models.Index(fields=["promocode"], name="shopapp_order_promocode_idx"),
+            models.Index(fields=["delivery_address"], name="shopapp_order_address_idx"),
+            models.Index(fields=["total"], name="shopapp_order_total_idx"),
+        ]
+
     delivery_address = models.TextField(null=True, blank=True)
     promocode = models.CharField(max_length=20, null=False, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     user = models.ForeignKey(User, on_delete=models.PROTECT)
-    products = models.ManyToManyField(Product, related_name="orders")
+    products = models.ManyToManyField(Product, related_name="orders", through="OrderItem")
+    # Итоги по позициям заказа, пересчитываются `update_order_totals`
+    # в той же транзакции, что и изменение позиций.
+    total = models.DecimalField(default=0, max_digits=12, decimal_places=2, editable=False)
+    items_count = models.PositiveIntegerField(default=0, editable=False)
+
+
+class OrderItem(models.Model):
+    """
+    Позиция заказа: количество, цена и скидка товара на момент заказа.
+
+    Таблица та же, что была у неявной промежуточной модели `Order.products`.
+    `order.products.add()` и `set()` создают позиции с количеством 1 и
+    запоминают текущие цену и скидку товара (см. `shopapp.signals`).
+    """
+
+    class Meta:
+        db_table = "shopapp_order_products"
+        unique_together = [("order", "product")]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="items")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="order_items")
+    quantity = models.PositiveIntegerField(default=1)
+    unit_price = models.DecimalField(default=0, max_digits=8, decimal_places=2)
+    discount = models.SmallIntegerField(default=0)
+
+    @property
+    def total(self) -> Decimal:
+        return line_total(self.quantity, self.unit_price, self.discount)
+
+    def take_price_snapshot(self) -> None:
+        self.unit_price = self.product.price
+        self.discount = self.product.discount
+
+    def __str__(self):
+        return f"OrderItem(order={self.order_id}, product={self.product_id}, quantity={self.quantity})"
+
+
+def line_total(quantity: int, unit_price: Decimal, discount: int) -> Decimal:
+    """Стоимость позиции со скидкой в процентах, без округления."""
+    return quantity * Decimal(unit_price) * (100 - discount) / 100
+
+
+def order_totals(items: Iterable[tuple]) -> dict[object, tuple[Decimal, int]]:
+    """
+    Итоги заказов по строкам `(order_key, quantity, unit_price, discount)`:
+    сумма, округлённая до копеек, и число единиц товара.
+    """
+    totals = defaultdict(lambda: [Decimal(0), 0])
+    for key, quantity, unit_price, discount in items:
+        totals[key][0] += line_total(quantity, unit_price, discount)
+        totals[key][1] += quantity
+    return {
+        key: (total.quantize(CENT, ROUND_HALF_UP), count)
+        for key, (total, count) in totals.items()
+    }
+
+
+def update_order_totals(order_pks: Iterable[int],
+                        batch_size: int = ORDER_TOTALS_BATCH_SIZE) -> None:
+    """
+    Пересчитывает `total` и `items_count` заказов по их позициям:
+    один запрос к позициям и один UPDATE на порцию заказов.
+    """
+    order_pks = sorted(set(order_pks))
+    with transaction.atomic():
+        for start in range(0, len(order_pks), batch_size):
+            batch = order_pks[start:start + batch_size]
+            totals = order_totals(
+                OrderItem.objects
+                .filter(order_id__in=batch)
+                .values_list("order_id", "quantity", "unit_price", "discount")
+            )
+            orders = []
+            for pk in batch:
+                total, count = totals.get(pk, (Decimal(0), 0))
+                orders.append(Order(pk=pk, total=total, items_count=count))
+            Order.objects.bulk_update(orders, ["total", "items_count"])
+
+
+class SalesRollup(models.Model):
+    """
+    Общие поля сводных таблиц продаж: заказы, единицы товара и выручка
+    за час или день (время начала периода, UTC). См. `shopapp.rollups`.
+    """
+
+    class Granularity(models.TextChoices):
+        HOUR = "hour"
+        DAY = "day"
+
+    class Meta:
+        abstract = True
+
+    granularity = models.CharField(max_length=4, choices=Granularity.choices)
+    period = models.DateTimeField()
+    orders = models.PositiveIntegerField(default=0)
+    items = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(default=0, max_digits=14, decimal_places=2)
+
+
+class SalesTotals(SalesRollup):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["granularity", "period"], name="shopapp_salestotals_period_uniq",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["period"], name="shopapp_sales_period_idx"),
+        ]
+
+
+class ProductSales(SalesRollup):
+    """Продажи товара: `orders` — заказы с этим товаром, `items` — проданные единицы."""
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["granularity", "period", "product"],
+                name="shopapp_productsales_period_uniq",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["period"], name="shopapp_prodsales_period_idx"),
+            models.Index(fields=["product", "period"], name="shopapp_prodsales_prod_idx"),
+        ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name="+")
+
+
+class PromocodeSales(SalesRollup):
+    """Продажи по промокоду; пустой промокод — заказы без него."""
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["granularity", "period", "promocode"],
+                name="shopapp_promocodesales_period_uniq",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["period"], name="shopapp_codesales_period_idx"),
+            models.Index(fields=["promocode", "period"], name="shopapp_codesales_code_idx"),
+        ]
+
+    promocode = models.CharField(max_length=20, blank=True)
+
+
+class RollupWatermark(models.Model):
+    """Момент `Order.created_at`, до которого заказы уже попали в сводки."""
+
+    name = models.CharField(max_length=50, primary_key=True)
+    watermark = models.DateTimeField(null=True)
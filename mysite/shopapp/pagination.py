@@ -0,0 +1,360 @@
+"""
+Keyset-пагинация (по курсору).
+
+Вместо `OFFSET` следующая страница выбирается условием «строго после
+последней строки текущей страницы» по полям сортировки, к которым в
+конце добавлен первичный ключ. Поэтому глубокая страница стоит столько
+же, сколько первая, запрос `COUNT(*)` не нужен, а новые строки не
+сдвигают уже выданные страницы.
+"""
+import base64
+import binascii
+import datetime
+import json
+from dataclasses import dataclass
+from typing import Optional
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import (
+    Count,
+    F,
+    Field,
+    Model,
+    OuterRef,
+    Prefetch,
+    Q,
+    QuerySet,
+    Subquery,
+    Value,
+)
+from django.db.models.functions import Coalesce, Greatest
+from django.http import Http404
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class OrderingTerm:
+    """Элемент сортировки: поле модели или аннотация queryset."""
+
+    lookup: str
+    field: Field
+    descending: bool
+
+    @property
+    def name(self) -> str:
+        return ('-' if self.descending else '') + self.lookup
+
+    def order_by(self, reverse: bool = False):
+        descending = self.descending != reverse
+        if not self.field.null:
+            return ('-' if descending else '') + self.lookup
+        # NULL всегда считается «меньше» любого значения.
+        if descending:
+            return F(self.lookup).desc(nulls_last=True)
+        return F(self.lookup).asc(nulls_first=True)
+
+    def after(self, value, reverse: bool = False) -> Q:
+        """Условие «значение поля идёт после `value`» в порядке сортировки."""
+        descending = self.descending != reverse
+        name = self.lookup
+        if value is None:
+            return Q(pk__in=[]) if descending else Q(**{f'{name}__isnull': False})
+        condition = Q(**{f'{name}__{"lt" if descending else "gt"}': value})
+        if self.field.null and descending:
+            condition |= Q(**{f'{name}__isnull': True})
+        return condition
+
+    def equal(self, value) -> Q:
+        if value is None:
+            return Q(**{f'{self.lookup}__isnull': True})
+        return Q(**{self.lookup: value})
+
+    def value_of(self, row):
+        attname = getattr(self.field, 'attname', None) or self.lookup
+        if isinstance(row, dict):
+            for key in (self.lookup, attname, 'pk'):
+                if key in row:
+                    return row[key]
+            raise KeyError(self.lookup)
+        return getattr(row, attname)
+
+
+class _CursorEncoder(DjangoJSONEncoder):
+    """
+    Время в курсоре — с микросекундами: `DjangoJSONEncoder` округляет его
+    до миллисекунд, и строки внутри той же миллисекунды выдавались бы снова.
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+@dataclass
+class KeysetPage:
+    object_list: list
+    next_cursor: Optional[str]
+    previous_cursor: Optional[str]
+
+
+def get_ordering(queryset: QuerySet) -> list[OrderingTerm]:
+    """
+    Порядок сортировки queryset (или `Meta.ordering` модели) с первичным
+    ключом в конце для однозначности. Поддерживаются собственные поля
+    модели и аннотации queryset; остальные элементы сортировки
+    отбрасываются.
+    """
+    meta = queryset.model._meta
+    annotations = queryset.query.annotations
+    terms = []
+    for item in queryset.query.order_by or meta.ordering or ():
+        if not isinstance(item, str):
+            continue
+        descending = item.startswith('-')
+        name = item.lstrip('-')
+        if name in annotations:
+            terms.append(OrderingTerm(name, annotations[name].output_field, descending))
+            continue
+        try:
+            field = meta.pk if name == 'pk' else meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if not field.concrete or field.many_to_many or '__' in name:
+            continue
+        terms.append(OrderingTerm(field.name, field, descending))
+        if field.primary_key:
+            break
+    if not terms or not terms[-1].field.primary_key:
+        descending = terms[0].descending if terms else False
+        terms.append(OrderingTerm(meta.pk.name, meta.pk, descending))
+    return terms
+
+
+def encode_cursor(ordering: list[OrderingTerm], row, reverse: bool) -> str:
+    payload = {
+        'o': [term.name for term in ordering],
+        'v': [term.value_of(row) for term in ordering],
+        'r': reverse,
+    }
+    data = json.dumps(payload, cls=_CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(ordering: list[OrderingTerm], cursor: str) -> tuple[list, bool]:
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(data)
+        names, values, reverse = payload['o'], payload['v'], payload['r']
+        values = [
+            None if value is None else term.field.to_python(value)
+            for term, value in zip(ordering, values, strict=True)
+        ]
+    except (binascii.Error, ValueError, KeyError, TypeError,
+            ValidationError) as exc:
+        raise InvalidCursor('Invalid cursor.') from exc
+    if names != [term.name for term in ordering]:
+        raise InvalidCursor('Cursor does not match the current ordering.')
+    return values, bool(reverse)
+
+
+def seek(queryset: QuerySet, ordering: list[OrderingTerm], values: list,
+         reverse: bool = False) -> QuerySet:
+    """Строки queryset строго после позиции `values` в порядке `ordering`."""
+    position = Q(pk__in=[])
+    for index in range(len(ordering)):
+        condition = ordering[index].after(values[index], reverse)
+        for term, value in zip(ordering[:index], values):
+            condition &= term.equal(value)
+        position |= condition
+    return queryset.filter(position)
+
+
+def _keyset_queryset(queryset: QuerySet, page_size: int,
+                     cursor: Optional[str]) -> tuple[QuerySet, list[OrderingTerm], bool]:
+    """Запрос строк страницы (на одну больше `page_size`) и его сортировка."""
+    ordering = get_ordering(queryset)
+    reverse = False
+    if cursor is not None:
+        values, reverse = decode_cursor(ordering, cursor)
+        queryset = seek(queryset, ordering, values, reverse)
+
+    queryset = queryset.order_by(*(term.order_by(reverse) for term in ordering))
+    return queryset[:page_size + 1], ordering, reverse
+
+
+def paginate_keyset(queryset: QuerySet, page_size: int,
+                    cursor: Optional[str] = None) -> KeysetPage:
+    """Одна страница queryset начиная с позиции `cursor`."""
+    queryset, ordering, reverse = _keyset_queryset(queryset, page_size, cursor)
+    return _keyset_page(list(queryset), page_size, ordering, reverse, cursor)
+
+
+async def apaginate_keyset(queryset: QuerySet, page_size: int,
+                           cursor: Optional[str] = None) -> KeysetPage:
+    """Асинхронный вариант `paginate_keyset`."""
+    queryset, ordering, reverse = _keyset_queryset(queryset, page_size, cursor)
+    rows = [row async for row in queryset]
+    return _keyset_page(rows, page_size, ordering, reverse, cursor)
+
+
+def _keyset_page(rows: list, page_size: int, ordering: list[OrderingTerm],
+                 reverse: bool, cursor: Optional[str]) -> KeysetPage:
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if reverse:
+        rows.reverse()
+
+    # Если пришли назад, следующая страница точно есть, а если вперёд
+    # по курсору — есть предыдущая.
+    more_after = has_more or reverse
+    more_before = has_more if reverse else cursor is not None
+    next_cursor = previous_cursor = None
+    if rows and more_after:
+        next_cursor = encode_cursor(ordering, rows[-1], reverse=False)
+    if rows and more_before:
+        previous_cursor = encode_cursor(ordering, rows[0], reverse=True)
+    return KeysetPage(rows, next_cursor, previous_cursor)
+
+
+def with_preview(queryset: QuerySet, name: str, limit: int,
+                 related: Optional[QuerySet] = None) -> QuerySet:
+    """
+    Подгружает для каждой строки не больше `limit` объектов связи
+    многие-ко-многим `name` в атрибут `<name>_preview`, а число
+    оставшихся — аннотацией `<name>_more`, без загрузки самих строк.
+    """
+    field = queryset.model._meta.get_field(name)
+    through: type[Model] = field.remote_field.through
+    source = field.m2m_field_name()
+    if related is None:
+        related = field.related_model._default_manager.all()
+    if not related.ordered:
+        related = related.order_by('pk')
+    total = (through.objects
+             .filter(**{source: OuterRef('pk')})
+             .order_by()
+             .values(source)
+             .annotate(count=Count('*'))
+             .values('count'))
+    return (queryset
+            .prefetch_related(Prefetch(name, related[:limit], to_attr=f'{name}_preview'))
+            .annotate(**{f'{name}_more': Greatest(
+                Coalesce(Subquery(total), 0) - Value(limit), Value(0),
+            )}))
+
+
+class KeysetPagination(PageNumberPagination):
+    """
+    Постраничная навигация DRF с опциональным keyset-режимом.
+
+    По умолчанию ведёт себя как `PageNumberPagination`. Keyset-режим
+    включается параметром `?pagination=keyset` (или наличием `?cursor=`)
+    и учитывает сортировку из `OrderingFilter`. Ответ содержит только
+    `next`, `previous` и `results`, без `count`.
+    """
+
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+
+    def is_keyset(self, request) -> bool:
+        return (self.cursor_query_param in request.query_params
+                or request.query_params.get(self.mode_query_param) == 'keyset')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset_page = None
+        if not self.is_keyset(request):
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        try:
+            self.keyset_page = paginate_keyset(
+                queryset,
+                self.get_page_size(request),
+                request.query_params.get(self.cursor_query_param),
+            )
+        except InvalidCursor as exc:
+            raise NotFound(str(exc))
+        return self.keyset_page.object_list
+
+    def get_cursor_link(self, cursor: Optional[str]) -> Optional[str]:
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.page_query_param)
+        url = remove_query_param(url, self.mode_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        if self.keyset_page is None:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_cursor_link(self.keyset_page.next_cursor),
+            'previous': self.get_cursor_link(self.keyset_page.previous_cursor),
+            'results': data,
+        })
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + [
+            {
+                'name': self.mode_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Set to "keyset" to paginate by cursor.',
+                'schema': {'type': 'string', 'enum': ['keyset']},
+            },
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Opaque cursor from the next/previous link.',
+                'schema': {'type': 'string'},
+            },
+        ]
+
+
+class KeysetPaginationMixin:
+    """
+    Keyset-пагинация для `ListView`.
+
+    В контекст попадают `page_obj` (`KeysetPage`), `is_paginated`
+    и ссылки `next_page_url` / `previous_page_url`, сохраняющие
+    остальные GET-параметры. Шаблон `shopapp/keyset-pager.html` выводит их.
+    """
+
+    paginate_by = 20
+    cursor_kwarg = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        try:
+            page = paginate_keyset(
+                queryset,
+                page_size,
+                self.request.GET.get(self.cursor_kwarg),
+            )
+        except InvalidCursor as exc:
+            raise Http404(str(exc))
+        is_paginated = bool(page.next_cursor or page.previous_cursor)
+        return None, page, page.object_list, is_paginated
+
+    def get_page_url(self, cursor: Optional[str]) -> Optional[str]:
+        if cursor is None:
+            return None
+        query = self.request.GET.copy()
+        query[self.cursor_kwarg] = cursor
+        return f'?{query.urlencode()}'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        page = context.get('page_obj')
+        if page is not None:
+            context['next_page_url'] = self.get_page_url(page.next_cursor)
+            context['previous_page_url'] = self.get_page_url(page.previous_cursor)
+        return context
@@ -0,0 +1,178 @@
+"""
+Кэшируемые ответы с заранее закодированным телом.
+
+В кэш кладутся готовые байты ответа (по умолчанию сжатые gzip), а не
+данные для сериализации, поэтому попадание в кэш не требует повторного
+кодирования JSON. Клиентам, принимающим gzip, байты отдаются как есть,
+остальным — распакованными (большие тела распаковываются потоково).
+`acached_response` — то же для async-представлений: кэш читается через
+асинхронный API, а потоковый ответ отдаётся асинхронным итератором.
+
+Тело, которое в сжатом виде больше `MAX_CACHED_BODY_SIZE`, не кэшируется:
+вместо него в кэш кладётся отметка, и такие ответы всегда отдаются
+потоком прямо из `render`, не собираясь в памяти целиком.
+"""
+import re
+import zlib
+from dataclasses import dataclass
+from typing import AsyncIterable, AsyncIterator, Callable, Iterable, Iterator, Optional
+
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+
+from .cache import aget_or_compute, get_or_compute
+from .exporters import STREAM_BUFFER_SIZE, abuffered, buffered
+
+COMPRESS_LEVEL = 6
+# Больше этого размера (после сжатия) тело не кэшируется, а отдаётся потоком.
+MAX_CACHED_BODY_SIZE = 1024 * 1024
+# Тела больше этого размера распаковываются для клиента потоково.
+STREAM_DECOMPRESSED_FROM = 16 * STREAM_BUFFER_SIZE
+
+_accepts_gzip = re.compile(r'\bgzip\b')
+# Заголовок и контрольная сумма gzip, а не «голый» deflate.
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+@dataclass(frozen=True)
+class EncodedBody:
+    content: bytes
+    content_type: str
+    gzipped: bool
+    size: int
+
+
+class _BodyEncoder:
+    """
+    Собирает тело ответа из кусков. При сжатии куски сразу проходят
+    через компрессор, так что в памяти оказывается только сжатый результат.
+    Если он вырос больше `max_size`, `write` возвращает False.
+    """
+
+    def __init__(self, content_type: str, compress: bool,
+                 max_size: Optional[int] = None):
+        self.content_type = content_type
+        self.compressor = None
+        if compress:
+            self.compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, _GZIP_WBITS)
+        self.max_size = max_size
+        self.parts = []
+        self.size = 0
+        self.stored_size = 0
+
+    def write(self, chunk: bytes) -> bool:
+        self.size += len(chunk)
+        if self.compressor is not None:
+            chunk = self.compressor.compress(chunk)
+        return self._store(chunk)
+
+    def _store(self, data: bytes) -> bool:
+        self.parts.append(data)
+        self.stored_size += len(data)
+        return self.max_size is None or self.stored_size <= self.max_size
+
+    def finish(self) -> Optional[EncodedBody]:
+        if self.compressor is not None and not self._store(self.compressor.flush()):
+            return None
+        return EncodedBody(
+            b''.join(self.parts), self.content_type, self.compressor is not None, self.size,
+        )
+
+
+def encode_body(chunks: Iterable[bytes], content_type: str,
+                compress: bool = True,
+                max_size: Optional[int] = None) -> Optional[EncodedBody]:
+    """Тело из кусков `chunks` или None, если оно больше `max_size`."""
+    encoder = _BodyEncoder(content_type, compress, max_size)
+    for chunk in chunks:
+        if not encoder.write(chunk):
+            return None
+    return encoder.finish()
+
+
+async def aencode_body(chunks: AsyncIterable[bytes], content_type: str,
+                       compress: bool = True,
+                       max_size: Optional[int] = None) -> Optional[EncodedBody]:
+    encoder = _BodyEncoder(content_type, compress, max_size)
+    try:
+        async for chunk in chunks:
+            if not encoder.write(chunk):
+                return None
+    finally:
+        # Брошенный асинхронный генератор иначе держал бы курсор базы.
+        if hasattr(chunks, 'aclose'):
+            await chunks.aclose()
+    return encoder.finish()
+
+
+def _iter_decompressed(content: bytes) -> Iterator[bytes]:
+    decompressor = zlib.decompressobj(_GZIP_WBITS)
+    for start in range(0, len(content), STREAM_BUFFER_SIZE):
+        if chunk := decompressor.decompress(content[start:start + STREAM_BUFFER_SIZE]):
+            yield chunk
+    if tail := decompressor.flush():
+        yield tail
+
+
+async def _aiter_decompressed(content: bytes) -> AsyncIterator[bytes]:
+    for chunk in _iter_decompressed(content):
+        yield chunk
+
+
+def body_response(request: HttpRequest, body: EncodedBody, asynchronous: bool = False):
+    """
+    Ответ с готовым телом в подходящей клиенту кодировке. Для ASGI
+    (`asynchronous`) потоковое тело отдаётся асинхронным итератором,
+    иначе Django сначала собрал бы его целиком в потоке.
+    """
+    if not body.gzipped:
+        return HttpResponse(body.content, content_type=body.content_type)
+    if _accepts_gzip.search(request.headers.get('Accept-Encoding', '')):
+        response = HttpResponse(body.content, content_type=body.content_type)
+        response.headers['Content-Encoding'] = 'gzip'
+    elif body.size >= STREAM_DECOMPRESSED_FROM:
+        chunks = _aiter_decompressed if asynchronous else _iter_decompressed
+        response = StreamingHttpResponse(
+            chunks(body.content), content_type=body.content_type,
+        )
+    else:
+        response = HttpResponse(
+            zlib.decompress(body.content, _GZIP_WBITS),
+            content_type=body.content_type,
+        )
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def cached_response(request: HttpRequest, key: str,
+                    render: Callable[[], Iterable[bytes]], content_type: str,
+                    timeout: int, compress: bool = True):
+    """
+    Отдаёт закэшированное тело по ключу `key`, при промахе вычисляя его
+    через `render` (с защитой от «давки», см. `get_or_compute`).
+
+    Тело больше `MAX_CACHED_BODY_SIZE` отдаётся потоком: первый запрос
+    кодирует его только до этого предела, следующие сразу читают `render`.
+    """
+    body = get_or_compute(
+        key,
+        lambda: encode_body(render(), content_type, compress, MAX_CACHED_BODY_SIZE),
+        timeout,
+    )
+    if body is None:
+        return StreamingHttpResponse(buffered(render()), content_type=content_type)
+    return body_response(request, body)
+
+
+async def acached_response(request: HttpRequest, key: str,
+                           render: Callable[[], AsyncIterable[bytes]], content_type: str,
+                           timeout: int, compress: bool = True):
+    """Асинхронный вариант `cached_response`: `render` — асинхронный генератор."""
+
+    async def compute() -> Optional[EncodedBody]:
+        return await aencode_body(render(), content_type, compress, MAX_CACHED_BODY_SIZE)
+
+    body = await aget_or_compute(key, compute, timeout)
+    if body is None:
+        return StreamingHttpResponse(abuffered(render()), content_type=content_type)
+    return body_response(request, body, asynchronous=True)
@@ -0,0 +1,259 @@
+"""
+Сводные таблицы продаж для отчётов.
+
+Почасовые и подневные строки: итог по всем заказам (`SalesTotals`), по
+товарам (`ProductSales`) и по промокодам (`PromocodeSales`). Отчёт за год
+по дням читает сотни строк сводок вместо всех заказов и их позиций.
+
+Сводки обновляются инкрементально от водяного знака — момента
+`Order.created_at`, до которого заказы уже учтены. Дни, начиная с дня
+водяного знака, пересчитываются целиком (вместе с их часами), каждый
+в своей транзакции вместе со сдвигом водяного знака, поэтому повторный
+или прерванный запуск ничего не портит. Заказы моложе `ROLLUP_SAFETY_LAG`
+не учитываются: их транзакции могли ещё не зафиксироваться.
+
+Изменения уже учтённых заказов в сводки сами не попадают, период
+пересчитывается заново через `refresh_rollups(since=...)`
+(`manage.py refresh_rollups --since`).
+
+Обновляет команда `refresh_rollups` или, при `SALES_ROLLUP_INTERVAL` > 0,
+фоновый поток в каждом воркере (`start_rollup_job`). Одновременно
+обновление идёт только в одном процессе: блокировка берётся в кэше.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import ROUND_HALF_UP, Decimal
+from timeit import default_timer
+from typing import Iterator, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import (
+    CENT,
+    Order,
+    OrderItem,
+    ProductSales,
+    PromocodeSales,
+    RollupWatermark,
+    SalesRollup,
+    SalesTotals,
+    line_total,
+)
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_SAFETY_LAG = timedelta(minutes=1)
+ROLLUP_WATERMARK = 'sales'
+ROLLUP_LOCK_KEY = 'sales_rollups_lock'
+ROLLUP_LOCK_TIMEOUT = 60 * 10
+ROLLUP_MODELS = (SalesTotals, ProductSales, PromocodeSales)
+
+HOUR = SalesRollup.Granularity.HOUR
+DAY = SalesRollup.Granularity.DAY
+
+
+class RollupBusy(Exception):
+    """Сводки уже обновляет другой процесс или поток."""
+
+
+@dataclass
+class RefreshStats:
+    days: int = 0
+    rows: int = 0
+    watermark: Optional[datetime] = None
+    elapsed: float = 0.0
+
+
+def truncate(moment: datetime, granularity: str) -> datetime:
+    """Начало часа или дня (UTC), в который попадает `moment`."""
+    moment = moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    if granularity == DAY:
+        moment = moment.replace(hour=0)
+    return moment
+
+
+@contextmanager
+def rollup_lock() -> Iterator[None]:
+    token = uuid.uuid4().hex
+    if not cache.add(ROLLUP_LOCK_KEY, token, ROLLUP_LOCK_TIMEOUT):
+        raise RollupBusy
+    try:
+        yield
+    finally:
+        if cache.get(ROLLUP_LOCK_KEY) == token:
+            cache.delete(ROLLUP_LOCK_KEY)
+
+
+def _new_values() -> list:
+    # Заказы, единицы товара, выручка.
+    return [0, 0, Decimal(0)]
+
+
+def _aggregate(start: datetime, end: datetime) -> list[SalesRollup]:
+    """Строки сводок по заказам, созданным в `[start, end)`."""
+    totals = defaultdict(_new_values)
+    promocodes = defaultdict(_new_values)
+    products = defaultdict(_new_values)
+
+    orders = (Order.objects
+              .filter(created_at__gte=start, created_at__lt=end)
+              .values_list('created_at', 'promocode', 'total', 'items_count'))
+    for created_at, promocode, total, items_count in orders.iterator():
+        for granularity in (HOUR, DAY):
+            period = truncate(created_at, granularity)
+            for values in (totals[granularity, period],
+                           promocodes[granularity, period, promocode]):
+                values[0] += 1
+                values[1] += items_count
+                values[2] += total
+
+    items = (OrderItem.objects
+             .filter(order__created_at__gte=start, order__created_at__lt=end)
+             .values_list('order__created_at', 'product_id', 'quantity',
+                          'unit_price', 'discount'))
+    for created_at, product_id, quantity, unit_price, discount in items.iterator():
+        revenue = line_total(quantity, unit_price, discount)
+        for granularity in (HOUR, DAY):
+            values = products[granularity, truncate(created_at, granularity), product_id]
+            values[0] += 1
+            values[1] += quantity
+            values[2] += revenue
+
+    def fields(values) -> dict:
+        orders, items, revenue = values
+        return {
+            'orders': orders,
+            'items': items,
+            'revenue': revenue.quantize(CENT, ROUND_HALF_UP),
+        }
+
+    return [
+        *(SalesTotals(granularity=granularity, period=period, **fields(values))
+          for (granularity, period), values in totals.items()),
+        *(PromocodeSales(granularity=granularity, period=period, promocode=promocode,
+                         **fields(values))
+          for (granularity, period, promocode), values in promocodes.items()),
+        *(ProductSales(granularity=granularity, period=period, product_id=product_id,
+                       **fields(values))
+          for (granularity, period, product_id), values in products.items()),
+    ]
+
+
+def _replace_day(day: datetime, end: datetime) -> int:
+    rows = _aggregate(day, end)
+    for model in ROLLUP_MODELS:
+        model.objects.filter(
+            granularity__in=[HOUR, DAY],
+            period__gte=day,
+            period__lt=day + timedelta(days=1),
+        ).delete()
+    by_model = defaultdict(list)
+    for row in rows:
+        by_model[type(row)].append(row)
+    for model, model_rows in by_model.items():
+        model.objects.bulk_create(model_rows)
+    return len(rows)
+
+
+def refresh_rollups(since: Optional[datetime] = None,
+                    until: Optional[datetime] = None,
+                    rebuild: bool = False) -> RefreshStats:
+    """
+    Пересчитывает сводки от дня водяного знака (или дня `since`) до
+    `until` (по умолчанию — сейчас минус `ROLLUP_SAFETY_LAG`). С `rebuild`
+    сводки строятся заново с первого заказа.
+    Если сводки уже обновляются, бросает `RollupBusy`.
+    """
+    stats = RefreshStats()
+    started_at = default_timer()
+    until = until or timezone.now() - ROLLUP_SAFETY_LAG
+    with rollup_lock():
+        state, _ = RollupWatermark.objects.get_or_create(name=ROLLUP_WATERMARK)
+        if rebuild:
+            with transaction.atomic():
+                for model in ROLLUP_MODELS:
+                    model.objects.all().delete()
+                state.watermark = None
+                state.save(update_fields=['watermark'])
+        start = (state.watermark
+                 or Order.objects.aggregate(first=Min('created_at'))['first'])
+        if since is not None and (start is None or since < start):
+            start = since
+        if start is not None:
+            day = truncate(start, DAY)
+            while day < until:
+                end = min(day + timedelta(days=1), until)
+                with transaction.atomic():
+                    stats.rows += _replace_day(day, end)
+                    if state.watermark is None or end > state.watermark:
+                        state.watermark = end
+                        state.save(update_fields=['watermark'])
+                stats.days += 1
+                day += timedelta(days=1)
+    stats.watermark = state.watermark
+    stats.elapsed = default_timer() - started_at
+    return stats
+
+
+class RollupJob:
+    """Фоновый поток, обновляющий сводки каждые `interval` секунд."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.thread = threading.Thread(target=self.run, name='sales-rollups', daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            self.run_once()
+
+    @staticmethod
+    def run_once() -> None:
+        try:
+            stats = refresh_rollups()
+        except RollupBusy:
+            return
+        except Exception:
+            logger.exception('Sales rollups refresh failed')
+        else:
+            logger.info('Sales rollups refreshed: %s days, %s rows in %.2fs',
+                        stats.days, stats.rows, stats.elapsed)
+        finally:
+            # Поток живёт долго, соединение между запусками не держим.
+            connections.close_all()
+
+
+_job: Optional[RollupJob] = None
+_job_pid: Optional[int] = None
+_job_lock = threading.Lock()
+
+
+def start_rollup_job(**kwargs) -> None:
+    """
+    Запускает `RollupJob` один раз на процесс. Подключается к сигналу
+    `request_started`, чтобы поток появлялся в воркерах, а не в процессе,
+    который их порождает, и не в командах manage.py.
+    """
+    global _job, _job_pid
+    if _job_pid == os.getpid():
+        return
+    with _job_lock:
+        if _job_pid == os.getpid():
+            return
+        _job = RollupJob(settings.SALES_ROLLUP_INTERVAL)
+        _job.start()
+        _job_pid = os.getpid()
@@ -0,0 +1,165 @@
+"""
+Полнотекстовый поиск на SQLite FTS5.
+
+Для модели создаётся виртуальная таблица FTS5 с внешним содержимым
+(`content=` исходной таблицы), которую синхронизируют триггеры на вставку,
+изменение и удаление строк. Триггеры срабатывают и для `bulk_create`,
+и для `QuerySet.update`, которые не отправляют сигналы Django.
+
+Таблица и триггеры создаются после `migrate` (SQLite пересоздаёт таблицу
+при некоторых изменениях схемы и при этом удаляет её триггеры), полная
+перестройка индекса — командой `rebuild_search_index`.
+На других СУБД поиск откатывается к обычному `icontains`.
+"""
+import operator
+from functools import reduce
+from typing import Iterable, Type
+
+from django.db import connections, models
+from django.db.models import Q, QuerySet
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+
+from .models import Product
+
+INDEXES: list['FullTextIndex'] = []
+
+
+class FullTextIndex:
+    """Индекс FTS5 по текстовым полям модели."""
+
+    def __init__(self, model: Type[models.Model], fields: Iterable[str]):
+        self.model = model
+        self.fields = tuple(fields)
+        INDEXES.append(self)
+
+    @property
+    def source(self) -> str:
+        return self.model._meta.db_table
+
+    @property
+    def table(self) -> str:
+        return f'{self.source}_fts'
+
+    def is_available(self, using: str = 'default') -> bool:
+        return connections[using].vendor == 'sqlite'
+
+    def _columns(self, prefix: str = '') -> str:
+        return ', '.join(prefix + field for field in self.fields)
+
+    def schema_sql(self) -> list[str]:
+        pk = self.model._meta.pk.column
+        columns = self._columns()
+        delete = (
+            f"INSERT INTO {self.table} ({self.table}, rowid, {columns}) "
+            f"VALUES ('delete', old.{pk}, {self._columns('old.')});"
+        )
+        insert = (
+            f"INSERT INTO {self.table} (rowid, {columns}) "
+            f"VALUES (new.{pk}, {self._columns('new.')});"
+        )
+        return [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+            f"{columns}, content='{self.source}', content_rowid='{pk}', "
+            f"tokenize='unicode61 remove_diacritics 2')",
+            f"CREATE TRIGGER IF NOT EXISTS {self.table}_ai "
+            f"AFTER INSERT ON {self.source} BEGIN {insert} END",
+            f"CREATE TRIGGER IF NOT EXISTS {self.table}_ad "
+            f"AFTER DELETE ON {self.source} BEGIN {delete} END",
+            f"CREATE TRIGGER IF NOT EXISTS {self.table}_au "
+            f"AFTER UPDATE OF {columns} ON {self.source} "
+            f"BEGIN {delete} {insert} END",
+        ]
+
+    def ensure(self, using: str = 'default') -> None:
+        """Создаёт таблицу и триггеры, если их ещё нет."""
+        connection = connections[using]
+        if not self.is_available(using):
+            return
+        tables = connection.introspection.table_names()
+        if self.source not in tables:
+            return
+        created = self.table not in tables
+        with connection.cursor() as cursor:
+            for sql in self.schema_sql():
+                cursor.execute(sql)
+        if created:
+            self.rebuild(using)
+
+    def rebuild(self, using: str = 'default') -> None:
+        """Перестраивает индекс по текущему содержимому таблицы."""
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {self.table} ({self.table}) VALUES ('rebuild')"
+            )
+
+    def post_migrate(self, using: str = 'default', **kwargs) -> None:
+        self.ensure(using)
+
+    @staticmethod
+    def build_query(terms: Iterable[str]) -> str:
+        # Каждое слово — префиксная фраза, поэтому спецсимволы
+        # синтаксиса FTS5 в пользовательском вводе не интерпретируются.
+        return ' '.join(
+            '"{}"*'.format(term.replace('"', '""')) for term in terms
+        )
+
+    def search(self, queryset: QuerySet, terms: Iterable[str]) -> QuerySet:
+        """
+        Оставляет в queryset все совпадения, отсортированные по
+        релевантности. Оценка bm25 (меньше — лучше) доступна как аннотация
+        `search_rank`, поэтому по ней работает и keyset-пагинация.
+
+        Отбор — подзапрос `pk IN (... MATCH ...)`, оценка — подзапрос к
+        результатам поиска, поэтому queryset остаётся обычным и сочетается
+        с `distinct()`, `count()` и `union`, а сортировка и пагинация
+        выполняются в SQL по всем совпадениям. `LIMIT -1` не даёт SQLite
+        встроить поиск в подзапрос оценки: иначе MATCH и статистика bm25
+        считались бы заново для каждой строки (секунды на тысячи
+        совпадений), а так поиск выполняется один раз, и оценка строки
+        находится по автоматическому индексу.
+
+        Без FTS5 каждое слово ищется через `icontains` по всем полям индекса.
+        """
+        if not self.is_available(queryset.db):
+            for term in terms:
+                queryset = queryset.filter(reduce(operator.or_, (
+                    Q(**{f'{field}__icontains': term}) for field in self.fields
+                )))
+            return queryset
+        query = self.build_query(terms)
+        if not query:
+            return queryset.none()
+        quote = connections[queryset.db].ops.quote_name
+        pk = f'{quote(self.source)}.{quote(self.model._meta.pk.column)}'
+        table = quote(self.table)
+        matches = f'SELECT rowid, rank FROM {table} WHERE {table} MATCH %s'
+        return queryset.filter(
+            pk__in=RawSQL(f'SELECT rowid FROM {table} WHERE {table} MATCH %s', [query]),
+        ).annotate(
+            search_rank=RawSQL(
+                f'SELECT matches.rank FROM ({matches} LIMIT -1) AS matches '
+                f'WHERE matches.rowid = {pk}',
+                [query],
+                output_field=models.FloatField(),
+            ),
+        ).order_by('search_rank')
+
+
+class FullTextSearchFilter(SearchFilter):
+    """
+    `SearchFilter`, использующий `view.search_index`.
+
+    Без индекса (или не на SQLite) работает как обычный `SearchFilter`
+    по `search_fields`.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        index = getattr(view, 'search_index', None)
+        terms = self.get_search_terms(request)
+        if not terms or index is None or not index.is_available(queryset.db):
+            return super().filter_queryset(request, queryset, view)
+        return index.search(queryset, terms)
+
+
+PRODUCT_INDEX = FullTextIndex(Product, ('name', 'description'))
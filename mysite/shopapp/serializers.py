@@ -1,8 +1,121 @@
+from django.db.models import QuerySet
 from rest_framework import serializers
-from .models import Product, Order
+from rest_framework.relations import ManyRelatedField, PKOnlyObject, RelatedField
+from rest_framework.response import Response
 
+from mysite.instrumentation import timed
 
-class ProductSerializer(serializers.ModelSerializer):
+from .bulk import BULK_MAX_ITEMS
+from .exporters import am2m_values, m2m_values
+from .models import Order, Product, ProductSales, PromocodeSales, SalesTotals
+
+
+class ValuesSerializerMixin:
+    """
+    Быстрый путь сериализации списков только для чтения.
+
+    Вместо экземпляров модели строки читаются через `values()` ровно
+    по колонкам объявленных полей, а pk для many-to-many полей
+    подгружаются одним запросом к промежуточной таблице на весь список.
+    Значения проходят через `to_representation` тех же полей DRF,
+    поэтому результат совпадает с обычной сериализацией.
+
+    Поддерживаются поля модели без вложенных `source`
+    и связи через `PrimaryKeyRelatedField`.
+    """
+
+    def values_queryset(self, queryset: QuerySet) -> QuerySet:
+        columns = [
+            field.source
+            for field in self._readable_fields
+            if not isinstance(field, ManyRelatedField)
+        ]
+        # Аннотации оставлены в строках: по ним может идти сортировка,
+        # а значит и keyset-пагинация.
+        columns = dict.fromkeys(['pk', *columns, *queryset.query.annotations])
+        return (queryset
+                .select_related(None)
+                .prefetch_related(None)
+                .values(*columns))
+
+    def _many_related_fields(self) -> list[ManyRelatedField]:
+        return [
+            field for field in self._readable_fields
+            if isinstance(field, ManyRelatedField)
+        ]
+
+    def serialize_rows(self, rows: list[dict]) -> list[dict]:
+        meta = self.Meta.model._meta
+        pks = [row['pk'] for row in rows]
+        related = {
+            field.field_name: m2m_values(
+                meta.get_field(field.source), pks, related_ordering=True,
+            )
+            for field in self._many_related_fields()
+        }
+        return self._serialize(rows, related)
+
+    async def aserialize_rows(self, rows: list[dict]) -> list[dict]:
+        """Асинхронный вариант `serialize_rows`."""
+        meta = self.Meta.model._meta
+        pks = [row['pk'] for row in rows]
+        related = {
+            field.field_name: await am2m_values(
+                meta.get_field(field.source), pks, related_ordering=True,
+            )
+            for field in self._many_related_fields()
+        }
+        return self._serialize(rows, related)
+
+    def _serialize(self, rows: list[dict], related: dict[str, dict]) -> list[dict]:
+        fields = list(self._readable_fields)
+        result = []
+        for row in rows:
+            item = {}
+            for field in fields:
+                if field.field_name in related:
+                    value = [
+                        PKOnlyObject(pk)
+                        for pk in related[field.field_name].get(row['pk'], ())
+                    ]
+                else:
+                    value = row[field.source]
+                    if value is None:
+                        item[field.field_name] = None
+                        continue
+                    if isinstance(field, RelatedField):
+                        value = PKOnlyObject(value)
+                item[field.field_name] = field.to_representation(value)
+            result.append(item)
+        return result
+
+
+class TimedSerializerMixin:
+    """Время получения `data` попадает в фазу "serializer" (Server-Timing)."""
+
+    @property
+    def data(self):
+        with timed('serializer'):
+            return super().data
+
+
+class FastListModelMixin:
+    """`list()` для ModelViewSet через `ValuesSerializerMixin`."""
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.get_serializer()
+        rows = serializer.values_queryset(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        items = list(rows) if page is None else page
+        with timed('serializer'):
+            data = serializer.serialize_rows(items)
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+
+class ProductSerializer(TimedSerializerMixin, ValuesSerializerMixin,
+                        serializers.ModelSerializer):
     """Сериализатор для модели Product."""
     class Meta:
         model = Product
@@ -13,12 +126,35 @@ class ProductSerializer(serializers.ModelSerializer):
             'price',
             'discount',
             'created_at',
+            'updated_at',
             'archived',
         ]
 
 
-class OrderSerializer(serializers.ModelSerializer):
-    """Сериализатор для модели Order."""
+class ProductArchiveSerializer(serializers.Serializer):
+    """Тело запроса архивирования товаров: список pk."""
+
+    pks = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=BULK_MAX_ITEMS,
+    )
+
+
+class OrderSerializer(TimedSerializerMixin, ValuesSerializerMixin,
+                      serializers.ModelSerializer):
+    """
+    Сериализатор для модели Order.
+
+    `products` объявлено явно: связь через модель позиций DRF иначе
+    делает только для чтения. Новые товары попадают в заказ в количестве
+    одной штуки по текущей цене; `total` и `items_count` только для чтения.
+    """
+
+    products = serializers.PrimaryKeyRelatedField(
+        many=True, queryset=Product.objects.all(), required=False,
+    )
+
     class Meta:
         model = Order
         fields = [
@@ -26,6 +162,55 @@ class OrderSerializer(serializers.ModelSerializer):
             'delivery_address',
             'promocode',
             'created_at',
+            'updated_at',
             'user',
             'products',
+            'total',
+            'items_count',
         ]
+
+    def save(self, **kwargs):
+        instance = super().save(**kwargs)
+        # Итоги и время изменения пересчитаны в базе при записи позиций.
+        instance.refresh_from_db(fields=['total', 'items_count', 'updated_at'])
+        return instance
+
+
+SALES_ROLLUP_FIELDS = ['granularity', 'period', 'orders', 'items', 'revenue']
+
+
+class SalesTotalsSerializer(TimedSerializerMixin, ValuesSerializerMixin,
+                            serializers.ModelSerializer):
+    class Meta:
+        model = SalesTotals
+        fields = SALES_ROLLUP_FIELDS
+
+
+class ProductSalesSerializer(TimedSerializerMixin, ValuesSerializerMixin,
+                             serializers.ModelSerializer):
+    class Meta:
+        model = ProductSales
+        fields = [*SALES_ROLLUP_FIELDS, 'product']
+
+
+class PromocodeSalesSerializer(TimedSerializerMixin, ValuesSerializerMixin,
+                               serializers.ModelSerializer):
+    class Meta:
+        model = PromocodeSales
+        fields = [*SALES_ROLLUP_FIELDS, 'promocode']
+
+
+class SalesSummarySerializer(serializers.Serializer):
+    """Сумма строк сводки за период по одному товару или промокоду."""
+
+    orders = serializers.IntegerField()
+    items = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class ProductSalesSummarySerializer(SalesSummarySerializer):
+    product = serializers.IntegerField()
+
+
+class PromocodeSalesSummarySerializer(SalesSummarySerializer):
+    promocode = serializers.CharField()
@@ -0,0 +1,169 @@
+"""
+Обработчики сигналов, сбрасывающие кэш заказов при изменении данных
+и сдвигающие время изменения заказа при изменении его состава.
+
+Итоги заказа пересчитываются при изменении его позиций в той же
+транзакции: `order.products.add()`/`set()` и `save()`/`delete()`
+позиций уже выполняются в транзакции. Удаление нескольких позиций одним
+вызовом (`remove()`, `clear()`, `delete()` queryset) и удаление товара
+пересчитывают итоги каждого затронутого заказа один раз, а не на каждую
+позицию.
+"""
+from weakref import WeakKeyDictionary
+
+from django.db.models import OuterRef, QuerySet, Subquery
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cache import invalidate_catalog, invalidate_user_orders
+from .models import Order, OrderItem, Product, update_order_totals
+
+
+def users_of_orders(order_pks) -> set:
+    return set(
+        Order.objects
+        .filter(pk__in=order_pks)
+        .values_list('user_id', flat=True)
+    )
+
+
+def users_of_products(product_pks) -> set:
+    return set(
+        Order.objects
+        .filter(products__in=product_pks)
+        .values_list('user_id', flat=True)
+        .distinct()
+    )
+
+
+# Заказы позиций, удаляемых одним вызовом `delete()`, по объекту или
+# queryset, с которого удаление началось (`origin` сигналов удаления).
+_deleted_items_orders = WeakKeyDictionary()
+
+
+def touch_orders(orders: QuerySet) -> None:
+    orders.update(updated_at=timezone.now())
+
+
+def orders_changed(order_pks) -> None:
+    """Пересчитывает итоги заказов, сдвигает их время изменения и сбрасывает кэш."""
+    update_order_totals(order_pks)
+    touch_orders(Order.objects.filter(pk__in=order_pks))
+    invalidate_user_orders(users_of_orders(order_pks))
+
+
+def deleted_with(origin, model) -> bool:
+    """Удаление началось с объекта `model` или queryset этой модели."""
+    if isinstance(origin, QuerySet):
+        return origin.model is model
+    return isinstance(origin, model)
+
+
+@receiver(pre_save, sender=Order)
+def remember_order_owner(sender, instance: Order, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    instance._previous_user_id = (
+        Order.objects
+        .filter(pk=instance.pk)
+        .values_list('user_id', flat=True)
+        .first()
+    )
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def order_changed(sender, instance: Order, **kwargs):
+    invalidate_user_orders(filter(None, [
+        instance.user_id,
+        getattr(instance, '_previous_user_id', None),
+    ]))
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def order_products_added(sender, instance, action, reverse, pk_set, **kwargs):
+    # Удаление позиций через remove() и clear() обрабатывает
+    # `order_item_changed`: они удаляются с сигналами post_delete.
+    if action != 'post_add':
+        return
+    if not reverse:
+        product = Product.objects.filter(pk=OuterRef('product_id'))
+        OrderItem.objects.filter(order=instance, product_id__in=pk_set).update(
+            unit_price=Subquery(product.values('price')),
+            discount=Subquery(product.values('discount')),
+        )
+        order_pks = [instance.pk]
+        users = [instance.user_id]
+    else:
+        OrderItem.objects.filter(product=instance, order_id__in=pk_set).update(
+            unit_price=instance.price,
+            discount=instance.discount,
+        )
+        order_pks = pk_set
+        users = users_of_orders(pk_set)
+    update_order_totals(order_pks)
+    touch_orders(Order.objects.filter(pk__in=order_pks))
+    invalidate_user_orders(users)
+
+
+def _handled_by_owner(origin) -> bool:
+    # Позиции удаляемых заказов и товаров: заказ сбросит кэш сам,
+    # а товар пересчитает свои заказы разом (`product_deleted`).
+    return deleted_with(origin, Order) or deleted_with(origin, Product)
+
+
+@receiver(pre_delete, sender=OrderItem)
+def remember_item_order(sender, instance: OrderItem, origin=None, **kwargs):
+    if origin is None or _handled_by_owner(origin):
+        return
+    _deleted_items_orders.setdefault(origin, set()).add(instance.order_id)
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def order_item_changed(sender, instance: OrderItem, raw=False, origin=None, **kwargs):
+    if raw or _handled_by_owner(origin):
+        return
+    if kwargs['signal'] is post_delete and origin is not None:
+        # pre_delete приходит для всех позиций до удаления, а post_delete —
+        # когда удалены уже все: заказы пересчитываются на первом из них.
+        order_pks = _deleted_items_orders.pop(origin, None)
+        if order_pks:
+            orders_changed(order_pks)
+        return
+    orders_changed([instance.order_id])
+
+
+@receiver(post_save, sender=Product)
+@receiver(pre_delete, sender=Product)
+def product_changed(sender, instance: Product, raw=False, created=False, **kwargs):
+    # Новый товар ещё не входит ни в один заказ, а при удалении
+    # связи с заказами нужно прочитать до каскадного удаления.
+    if raw or created:
+        return
+    if kwargs['signal'] is pre_delete:
+        orders = Order.objects.filter(products=instance.pk)
+        instance._order_pks = list(orders.values_list('pk', flat=True))
+        touch_orders(orders)
+    invalidate_user_orders(users_of_products([instance.pk]))
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance: Product, **kwargs):
+    # Позиции товара уже удалены каскадом, заказы запомнены в pre_delete.
+    order_pks = getattr(instance, '_order_pks', None)
+    if order_pks:
+        update_order_totals(order_pks)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def catalog_changed(sender, instance: Product, **kwargs):
+    invalidate_catalog()
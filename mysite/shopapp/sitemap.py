@@ -1,14 +1,55 @@
+import hashlib
+import math
+from datetime import datetime
+from typing import Optional
+
+from django.conf import settings
 from django.contrib.sitemaps import Sitemap
+from django.db.models import Max
 
 from .models import Product
 
 
 class ShopSitemap(Sitemap):
+    """
+    Карта сайта по товарам, не находящимся в архиве.
+
+    Товары разбиты на секции по диапазонам первичного ключа
+    (`SITEMAP_SECTION_SIZE` ключей на секцию), поэтому изменение товара
+    затрагивает только его секцию, а новые товары не сдвигают старые.
+    """
+
     changefreq = 'monthly'
     priority = 0.8
 
+    def __init__(self, section: Optional[int] = None):
+        self.section = section
+        self.limit = settings.SITEMAP_SECTION_SIZE
+
+    def sections(self) -> range:
+        """Номера секций (с единицы) от первого до последнего товара."""
+        last = Product.objects.aggregate(last=Max('pk'))['last']
+        return range(1, math.ceil((last or 0) / self.limit) + 1)
+
     def items(self):
-        return Product.objects.order_by('-created_at')
+        products = (Product.objects
+                    .filter(archived=False)
+                    .only('pk', 'updated_at')
+                    .order_by('pk'))
+        if self.section is not None:
+            start = (self.section - 1) * self.limit
+            products = products.filter(pk__gt=start, pk__lte=start + self.limit)
+        return products
 
     def lastmod(self, obj: Product):
-        return obj.created_at
+        return obj.updated_at
+
+    def fingerprint(self) -> tuple[str, Optional[datetime]]:
+        """Отпечаток содержимого секции и дата последнего изменения в ней."""
+        digest = hashlib.sha1()
+        latest = None
+        rows = self.items().values_list('pk', 'updated_at')
+        for pk, updated_at in rows.iterator():
+            digest.update(f'{pk}:{updated_at.isoformat()};'.encode())
+            latest = updated_at if latest is None else max(latest, updated_at)
+        return digest.hexdigest(), latest
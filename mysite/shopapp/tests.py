@@ -1,12 +1,49 @@
+import csv
+import gzip
+import io
+import json
+import tempfile
+import time
 from string import ascii_letters
+from pathlib import Path
 from random import choices
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock
+from urllib.parse import urlencode
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import F, Max, Min
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
 
-from shopapp.models import Product
+from shopapp.cache import (
+    aget_catalog_version,
+    get_catalog_version,
+    get_or_compute,
+    user_orders_cache_key,
+)
+from shopapp.exporters import iter_csv
+from shopapp.importers import import_orders_csv
+from shopapp.management.commands.audit_query_plans import fingerprint
+from shopapp.models import (
+    Order,
+    Product,
+    ProductSales,
+    PromocodeSales,
+    SalesTotals,
+    update_order_totals,
+)
+from shopapp.rollups import DAY, HOUR, ROLLUP_LOCK_KEY, RollupBusy, refresh_rollups, truncate
+from shopapp.serializers import OrderSerializer, ProductSerializer
+from shopapp.search import PRODUCT_INDEX
 from shopapp.utils import add_two_numbers
 
 
@@ -66,7 +103,7 @@ class ProductsListViewTestVase(TestCase):
 
     def test_products(self):
         response = self.client.get(reverse("shopapp:products_list"))
-        self.assertQuerysetEqual(
+        self.assertQuerySetEqual(
             qs=Product.objects.filter(archived=False).all(),
             values=(p.pk for p in response.context["products"]),
             transform=lambda p: p.pk,
@@ -98,11 +135,404 @@ class OrdersListViewTestCase(TestCase):
         self.assertIn(str(settings.LOGIN_URL), response.url)
 
 
+class PaginatedListViewsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="pager_test", password="qwerty")
+        cls.products = Product.objects.bulk_create(
+            Product(name=f"Product {i:02}", price=i) for i in range(25)
+        )
+        cls.order = Order.objects.create(user=cls.user, promocode="PAGER")
+        cls.order.products.set(cls.products[:8])
+
+    def setUp(self) -> None:
+        self.client.force_login(self.user)
+
+    def test_products_pages(self):
+        url = reverse("shopapp:products_list")
+        first = self.client.get(url)
+        self.assertEqual(len(first.context["products"]), 20)
+        self.assertIsNone(first.context["previous_page_url"])
+        second = self.client.get(url + first.context["next_page_url"])
+        self.assertEqual(
+            [p.name for p in second.context["products"]],
+            [f"Product {i:02}" for i in range(20, 25)],
+        )
+        self.assertIsNone(second.context["next_page_url"])
+        self.assertContains(second, "Previous")
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("shopapp:products_list"), {"cursor": "bad"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_order_products_are_capped(self):
+        response = self.client.get(reverse("shopapp:orders_list"))
+        order = response.context["object_list"][0]
+        self.assertEqual(len(order.products_preview), 5)
+        self.assertEqual(order.products_more, 3)
+        self.assertContains(response, "+3 more")
+
+
+class ConditionalGetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name="Conditional", price=10)
+        cls.order = Order.objects.create(
+            user=User.objects.create_user(username="conditional_test"),
+        )
+
+    def assertNotModified(self, url, num_queries=1, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.client.get(url, params, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(len(queries), num_queries)
+        return response
+
+    def test_product_details(self):
+        url = reverse("shopapp:product_details", kwargs={"pk": self.product.pk})
+        response = self.assertNotModified(url)
+        cached = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(cached.status_code, 304)
+
+        self.product.price = 20
+        self.product.save()
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(changed.status_code, 200)
+
+    def test_product_api(self):
+        # Валидаторы списка берутся из поколения каталога, без запросов.
+        self.assertNotModified(
+            reverse("shopapp:product-list"), num_queries=0, search="Conditional",
+        )
+        self.assertNotModified(
+            reverse("shopapp:product-list"), num_queries=0, pagination="keyset",
+        )
+        self.assertNotModified(
+            reverse("shopapp:product-detail", kwargs={"pk": self.product.pk}),
+        )
+
+    def test_product_list_changes_on_delete(self):
+        url = reverse("shopapp:product-list")
+        cache.set("catalog_changed_at", time.time() - 60, timeout=None)
+        response = self.client.get(url)
+        cached = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(cached.status_code, 304)
+
+        Product.objects.create(name="Deleted").delete()
+        for headers in (
+            {"HTTP_IF_MODIFIED_SINCE": response["Last-Modified"]},
+            {"HTTP_IF_NONE_MATCH": response["ETag"]},
+        ):
+            self.assertEqual(self.client.get(url, **headers).status_code, 200)
+
+    def test_order_touched_by_products_change(self):
+        updated_at = self.order.updated_at
+        self.order.products.add(self.product)
+        self.order.refresh_from_db()
+        self.assertGreater(self.order.updated_at, updated_at)
+
+
+class LatestProductFeedTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = Product.objects.bulk_create(
+            Product(name=f"Feed product {i}") for i in range(8)
+        )
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.url = reverse("shopapp:latest_products_feed")
+
+    def test_cached_until_catalog_changes(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url)
+        self.assertEqual(cached.content, first.content)
+        not_modified = self.client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=first["Last-Modified"],
+        )
+        self.assertEqual(not_modified.status_code, 304)
+
+        product = Product.objects.get(pk=self.products[-1].pk)
+        product.archived = True
+        product.save()
+        changed = self.client.get(self.url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotContains(changed, product.name)
+
+    def test_limit(self):
+        response = self.client.get(self.url, {"limit": 7})
+        self.assertEqual(response.content.count(b"<item>"), 7)
+        response = self.client.get(self.url, {"limit": "many"})
+        self.assertEqual(response.content.count(b"<item>"), 5)
+
+
+class ValuesSerializerTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user(username="values_test")
+        cls.products = Product.objects.bulk_create([
+            Product(name="Zeta", price="10.50", description="Last"),
+            Product(name="Alpha", price="3.00", discount=5),
+            Product(name="Alpha", price="1.25", archived=True),
+        ])
+        cls.orders = [
+            Order.objects.create(user=user, promocode="P1", delivery_address=None),
+            Order.objects.create(user=user, promocode="P2", delivery_address="Street"),
+        ]
+        cls.orders[0].products.set(cls.products)
+        cls.orders[1].products.set(cls.products[:1])
+
+    def assertSameJSON(self, serializer_class, queryset, num_queries):
+        expected = JSONRenderer().render(serializer_class(queryset, many=True).data)
+        serializer = serializer_class()
+        with self.assertNumQueries(num_queries):
+            rows = serializer.serialize_rows(list(serializer.values_queryset(queryset)))
+        self.assertEqual(JSONRenderer().render(rows), expected)
+
+    def test_products(self):
+        self.assertSameJSON(ProductSerializer, Product.objects.all(), 1)
+
+    def test_orders(self):
+        # Заказы и один запрос к промежуточной таблице на все заказы.
+        self.assertSameJSON(
+            OrderSerializer, Order.objects.prefetch_related("products").order_by("pk"), 2,
+        )
+
+    def test_order_api(self):
+        self.client.force_login(User.objects.get(username="values_test"))
+        response = self.client.get(reverse("shopapp:order-list"))
+        self.assertEqual(
+            response.json()["results"][0]["products"],
+            [self.products[2].pk, self.products[1].pk, self.products[0].pk],
+        )
+
+
+class OrderItemsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="items_test", password="qwerty")
+        cls.products = [
+            Product.objects.create(name="Cheap", price="3.33", discount=10),
+            Product.objects.create(name="Expensive", price="10.00"),
+        ]
+
+    def setUp(self) -> None:
+        self.order = Order.objects.create(user=self.user)
+
+    def assertTotals(self, total, items_count):
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.total, self.order.items_count),
+                         (Decimal(total), items_count))
+
+    def test_totals_follow_items(self):
+        self.order.products.add(*self.products)
+        # 3.33 * 0.9 + 10.00 = 12.997
+        self.assertTotals("13.00", 2)
+
+        # Цена в позиции — на момент добавления товара.
+        Product.objects.filter(pk=self.products[1].pk).update(price="99.00")
+        item = self.order.items.get(product=self.products[1])
+        self.assertEqual(item.unit_price, Decimal("10.00"))
+        item.quantity = 3
+        item.save()
+        self.assertTotals("33.00", 4)
+
+        self.order.products.remove(self.products[0])
+        self.assertTotals("30.00", 3)
+        self.products[1].delete()
+        self.assertTotals("0.00", 0)
+
+    def count_queries(self, delete) -> int:
+        with CaptureQueriesContext(connection) as queries:
+            delete()
+        return len(queries)
+
+    def test_deletes_do_not_recompute_per_item(self):
+        counts = []
+        for orders_count in (1, 5):
+            product = Product.objects.create(name="Deleted", price="5.00")
+            orders = [Order.objects.create(user=self.user) for _ in range(orders_count)]
+            for order in orders:
+                order.products.add(product, self.products[1])
+            counts.append(self.count_queries(product.delete))
+            self.assertEqual(
+                [order.total for order in Order.objects.filter(pk__in=[o.pk for o in orders])],
+                [Decimal("10.00")] * orders_count,
+            )
+            counts.append(self.count_queries(
+                Order.objects.filter(pk__in=[order.pk for order in orders]).delete
+            ))
+        # Число запросов не зависит от числа заказов и позиций.
+        self.assertEqual(counts[:2], counts[2:])
+
+    def test_removed_items_recompute_order_once(self):
+        counts = []
+        for items_count in (1, 5):
+            products = Product.objects.bulk_create(
+                Product(name=f"Line {i}", price="2.00") for i in range(items_count)
+            )
+            self.order.products.add(self.products[1], *products)
+            counts.append(self.count_queries(lambda: self.order.products.remove(*products)))
+            self.assertTotals("10.00", 1)
+
+            self.order.products.add(*products)
+            counts.append(self.count_queries(self.order.products.clear))
+            self.assertTotals("0.00", 0)
+
+            self.order.products.add(self.products[1], *products)
+            counts.append(self.count_queries(self.order.items.all().delete))
+            self.assertTotals("0.00", 0)
+        self.assertEqual(counts[:3], counts[3:])
+
+    def test_api(self):
+        self.client.force_login(self.user)
+        response = self.client.post(
+            reverse("shopapp:order-list"),
+            {"user": self.user.pk, "promocode": "API", "products": [p.pk for p in self.products]},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["total"], "13.00")
+        self.assertEqual(response.json()["items_count"], 2)
+
+        response = self.client.get(
+            reverse("shopapp:order-list"), {"total__gte": "1", "ordering": "-total"},
+        )
+        self.assertEqual(
+            [order["promocode"] for order in response.json()["results"]], ["API"],
+        )
+
+
+class SalesRollupsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="rollups_test", password="qwerty")
+        cls.staff = User.objects.create_user(username="rollups_staff", is_staff=True)
+        cls.products = [
+            Product.objects.create(name="Ten", price="10.00"),
+            Product.objects.create(name="Five", price="5.00"),
+        ]
+        cls.day = truncate(timezone.now(), DAY) - timedelta(days=3)
+
+    def setUp(self) -> None:
+        cache.clear()
+        ten, five = self.products
+        self.create_order(self.day + timedelta(hours=1), "SUMMER", ten)
+        self.create_order(self.day + timedelta(hours=1, minutes=30), "", ten, five)
+        self.create_order(self.day + timedelta(days=1, hours=2), "SUMMER", five)
+
+    def create_order(self, created_at, promocode, *products) -> Order:
+        order = Order.objects.create(user=self.user, promocode=promocode)
+        order.products.add(*products)
+        Order.objects.filter(pk=order.pk).update(created_at=created_at)
+        return order
+
+    def totals(self, granularity=DAY):
+        return list(
+            SalesTotals.objects
+            .filter(granularity=granularity)
+            .order_by("period")
+            .values_list("period", "orders", "items", "revenue")
+        )
+
+    def test_refresh(self):
+        stats = refresh_rollups(until=self.day + timedelta(days=1, hours=3))
+        self.assertEqual(stats.days, 2)
+        self.assertEqual(stats.watermark, self.day + timedelta(days=1, hours=3))
+        next_day = self.day + timedelta(days=1)
+        self.assertEqual(self.totals(), [
+            (self.day, 2, 3, Decimal("25.00")),
+            (next_day, 1, 1, Decimal("5.00")),
+        ])
+        self.assertEqual(self.totals(HOUR), [
+            (self.day + timedelta(hours=1), 2, 3, Decimal("25.00")),
+            (next_day + timedelta(hours=2), 1, 1, Decimal("5.00")),
+        ])
+        self.assertEqual(
+            ProductSales.objects.get(granularity=DAY, period=self.day,
+                                     product=self.products[0]).revenue,
+            Decimal("20.00"),
+        )
+        self.assertEqual(
+            PromocodeSales.objects.get(granularity=DAY, period=self.day,
+                                       promocode="SUMMER").orders,
+            1,
+        )
+
+        # Следующий запуск пересчитывает только день водяного знака.
+        self.create_order(next_day + timedelta(hours=5), "", self.products[0])
+        stats = refresh_rollups(until=self.day + timedelta(days=2))
+        self.assertEqual(stats.days, 1)
+        self.assertEqual(self.totals()[1], (next_day, 2, 2, Decimal("15.00")))
+
+        rows = SalesTotals.objects.count() + ProductSales.objects.count()
+        refresh_rollups(since=self.day, until=self.day + timedelta(days=2))
+        self.assertEqual(SalesTotals.objects.count() + ProductSales.objects.count(), rows)
+        self.assertEqual(self.totals()[1], (next_day, 2, 2, Decimal("15.00")))
+
+    def test_command(self):
+        call_command("refresh_rollups", stdout=io.StringIO())
+        self.assertEqual(len(self.totals()), 2)
+
+        # Уже учтённый заказ изменился: нужен --since.
+        Order.objects.filter(promocode="").update(created_at=self.day + timedelta(days=1))
+        call_command("refresh_rollups", stdout=io.StringIO())
+        self.assertEqual(self.totals()[0][1], 2)
+        call_command("refresh_rollups", "--since", self.day.date().isoformat(),
+                     stdout=io.StringIO())
+        self.assertEqual([row[1] for row in self.totals()], [1, 2])
+
+        call_command("refresh_rollups", rebuild=True, stdout=io.StringIO())
+        self.assertEqual([row[1] for row in self.totals()], [1, 2])
+
+    def test_lock(self):
+        cache.add(ROLLUP_LOCK_KEY, "other", 60)
+        with self.assertRaises(RollupBusy):
+            refresh_rollups()
+        with self.assertRaises(CommandError):
+            call_command("refresh_rollups", stdout=io.StringIO())
+        self.assertFalse(SalesTotals.objects.exists())
+
+    def test_api(self):
+        refresh_rollups()
+        url = reverse("shopapp:salestotals-list")
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(self.staff)
+        response = self.client.get(url, {"granularity": "day"})
+        self.assertEqual(
+            [(row["orders"], row["revenue"]) for row in response.json()["results"]],
+            [(2, "25.00"), (1, "5.00")],
+        )
+        response = self.client.get(url, {
+            "granularity": "hour",
+            "period__gte": (self.day + timedelta(days=1)).isoformat(),
+        })
+        self.assertEqual(len(response.json()["results"]), 1)
+
+        response = self.client.get(reverse("shopapp:productsales-summary"), {"limit": 1})
+        self.assertEqual(response.json(), [
+            {"orders": 2, "items": 2, "revenue": "20.00", "product": self.products[0].pk},
+        ])
+        response = self.client.get(reverse("shopapp:promocodesales-summary"))
+        self.assertEqual(
+            [(row["promocode"], row["revenue"]) for row in response.json()],
+            [("", "15.00"), ("SUMMER", "15.00")],
+        )
+
+
 class ProductsExportViewTestCase(TestCase):
     fixtures = [
         'products-fixture.json',
     ]
 
+    def setUp(self) -> None:
+        cache.clear()
+
     def test_get_products_view(self):
         response = self.client.get(
             reverse("shopapp:products-export"),
@@ -118,8 +548,698 @@ class ProductsExportViewTestCase(TestCase):
             }
             for product in products
         ]
-        products_data = response.json()
+        products_data = json.loads(response.getvalue())
         self.assertEqual(
             products_data["products"],
             expected_data,
         )
+
+    def test_get_products_ndjson(self):
+        response = self.client.get(
+            reverse("shopapp:products-export"),
+            {"format": "ndjson"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["content-type"], "application/x-ndjson")
+        lines = response.getvalue().splitlines()
+        self.assertEqual(
+            [json.loads(line)["pk"] for line in lines],
+            list(Product.objects.order_by("pk").values_list("pk", flat=True)),
+        )
+
+    def test_export_invalidated_on_catalog_changes(self):
+        url = reverse("shopapp:products-export")
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+        Product.objects.create(name="New product")
+        products = json.loads(self.client.get(url).getvalue())["products"]
+        self.assertEqual(products[-1]["name"], "New product")
+
+    def test_large_export_is_streamed_not_cached(self):
+        url = reverse("shopapp:products-export")
+        expected = self.client.get(url).getvalue()
+        cache.clear()
+        with mock.patch("shopapp.responses.MAX_CACHED_BODY_SIZE", 64):
+            for _ in range(2):
+                response = self.client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+                self.assertTrue(response.streaming)
+                self.assertNotIn("Content-Encoding", response)
+                self.assertEqual(response.getvalue(), expected)
+        body, *_ = cache.get(f"products_export_json_v{get_catalog_version()}")
+        self.assertIsNone(body)
+
+
+class OrdersCSVExportTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="csv_test", password="qwerty")
+        cls.products = [
+            Product.objects.create(name=f"Product {i}") for i in range(3)
+        ]
+        cls.order = Order.objects.create(
+            delivery_address="ul Pupkina, d 8",
+            promocode="SALE123",
+            user=cls.user,
+        )
+        cls.order.products.add(*cls.products[:2])
+
+    def test_export_orders(self):
+        content = b"".join(iter_csv(Order.objects.all(), chunk_size=1))
+        header, row = list(csv.reader(io.StringIO(content.decode())))
+        self.assertEqual(
+            header,
+            ["id", "delivery_address", "promocode", "created_at", "updated_at",
+             "user", "total", "items_count", "products"],
+        )
+        self.assertEqual(row[0], str(self.order.pk))
+        self.assertEqual(row[5], str(self.user.pk))
+        self.assertEqual(row[7], "2")
+        self.assertEqual(
+            row[8],
+            ",".join(str(product.pk) for product in self.products[:2]),
+        )
+
+    def test_admin_action(self):
+        admin = User.objects.create_superuser(username="csv_admin", password="qwerty")
+        self.client.force_login(admin)
+        response = self.client.post(
+            reverse("admin:shopapp_order_changelist"),
+            {"action": "export_as_csv", "_selected_action": [self.order.pk]},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["content-type"], "text/csv")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+
+
+class OrdersCSVImportTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="import_test", password="qwerty")
+        cls.products = [
+            Product.objects.create(name=f"Product {i}") for i in range(2)
+        ]
+
+    def test_import_orders(self):
+        pks = ",".join(str(product.pk) for product in self.products)
+        content = (
+            "delivery_address,promocode,user,products\n"
+            f"ul Pupkina,SALE,{self.user.pk},\"{pks}\"\n"
+            f"ul Pupkina,,{self.user.pk + 100},\"{pks}\"\n"
+            f"ul Pupkina,,{self.user.pk},\"{self.products[0].pk},999999\"\n"
+            f"ul Lenina,,{self.user.pk},\"{self.products[0].pk}\"\n"
+        )
+        stats = import_orders_csv(io.BytesIO(content.encode()), "utf-8", batch_size=2)
+        self.assertEqual(stats.imported, 2)
+        self.assertEqual([line for line, _ in stats.rejected], [3, 4])
+        order = Order.objects.get(promocode="SALE")
+        self.assertEqual(order.items_count, 2)
+        self.assertQuerySetEqual(
+            order.products.order_by("pk"),
+            [product.pk for product in self.products],
+            transform=lambda p: p.pk,
+        )
+
+
+class UserOrdersExportViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="export_test", password="qwerty")
+        cls.product = Product.objects.create(name="Cached product")
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.client.force_login(self.user)
+        self.url = reverse("shopapp:user_orders_export", kwargs={"user_id": self.user.pk})
+
+    def test_cache_invalidated_on_order_changes(self):
+        self.assertEqual(self.client.get(self.url).json(), [])
+
+        order = Order.objects.create(user=self.user, promocode="NEW")
+        data = self.client.get(self.url).json()
+        self.assertEqual([item["pk"] for item in data], [order.pk])
+        self.assertEqual(data[0]["products"], [])
+
+        order.products.add(self.product)
+        data = self.client.get(self.url).json()
+        self.assertEqual(data[0]["products"], [self.product.pk])
+
+        order.delete()
+        self.assertEqual(self.client.get(self.url).json(), [])
+
+    def test_cache_hit_without_queries(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(2):
+            # Только сессия и пользователь, заказы берутся из кэша.
+            self.client.get(self.url)
+
+    def test_gzip_bytes_served_from_cache(self):
+        Order.objects.create(user=self.user, promocode="GZIP")
+        plain = self.client.get(self.url)
+        with mock.patch("shopapp.views.OrderSerializer") as serializer:
+            response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip, deflate")
+        serializer.assert_not_called()
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+
+
+class AsyncViewsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="async_test", password="qwerty")
+        cls.products = Product.objects.bulk_create([
+            Product(name=f"Async product {i}", price=f"{i}.50") for i in range(12)
+        ])
+        for i in range(3):
+            order = Order.objects.create(user=cls.user, promocode=f"ASYNC{i}")
+            order.products.set(cls.products[i:i + 2])
+
+    def setUp(self) -> None:
+        cache.clear()
+
+    @staticmethod
+    async def read(response) -> bytes:
+        if not response.streaming:
+            return response.content
+        return b"".join([chunk async for chunk in response.streaming_content])
+
+    async def assertSameBody(self, sync_url, async_url, **extra):
+        expected = await self.read(await self.async_client.get(sync_url, **extra))
+        # Синхронный ответ уже в кэше, асинхронный должен посчитать свой.
+        await cache.aclear()
+        response = await self.async_client.get(async_url, **extra)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await self.read(response), expected)
+
+    async def test_products_export(self):
+        for query in ({}, {"format": "ndjson"}):
+            await self.assertSameBody(
+                reverse("shopapp:products-export") + "?" + urlencode(query),
+                reverse("shopapp:products-export-async") + "?" + urlencode(query),
+            )
+
+    async def test_large_products_export_is_streamed(self):
+        url = reverse("shopapp:products-export-async")
+        expected = await self.read(await self.async_client.get(url))
+        await cache.aclear()
+        with mock.patch("shopapp.responses.MAX_CACHED_BODY_SIZE", 64):
+            response = await self.async_client.get(url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(await self.read(response), expected)
+        body, *_ = await cache.aget(f"products_export_json_v{await aget_catalog_version()}")
+        self.assertIsNone(body)
+
+    async def test_user_orders_export(self):
+        await self.async_client.aforce_login(self.user)
+        kwargs = {"user_id": self.user.pk}
+        await self.assertSameBody(
+            reverse("shopapp:user_orders_export", kwargs=kwargs),
+            reverse("shopapp:user_orders_export_async", kwargs=kwargs),
+        )
+
+    async def test_user_orders_export_requires_login(self):
+        url = reverse("shopapp:user_orders_export_async", kwargs={"user_id": self.user.pk})
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response["Location"].startswith(str(settings.LOGIN_URL)))
+
+    async def test_api_same_as_viewsets(self):
+        await self.async_client.aforce_login(self.user)
+        for basename in ("product", "order"):
+            sync_url = reverse(f"shopapp:{basename}-list")
+            async_url = reverse(f"shopapp:{basename}-list-async")
+            while sync_url:
+                expected = (await self.async_client.get(sync_url)).json()
+                data = (await self.async_client.get(async_url)).json()
+                self.assertEqual(data["results"], expected["results"])
+                self.assertEqual(data["previous"] is None, expected["previous"] is None)
+                sync_url, async_url = expected["next"], data["next"]
+            self.assertIsNone(async_url)
+
+            pk = expected["results"][0]["pk"]
+            expected = await self.async_client.get(
+                reverse(f"shopapp:{basename}-detail", kwargs={"pk": pk}))
+            response = await self.async_client.get(
+                reverse(f"shopapp:{basename}-detail-async", kwargs={"pk": pk}))
+            self.assertEqual(response.json(), expected.json())
+
+        response = await self.async_client.get(
+            reverse("shopapp:product-detail-async", kwargs={"pk": 999999}))
+        self.assertEqual(response.status_code, 404)
+
+
+class ChangeFeedTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="feed_test", password="qwerty")
+        cls.products = Product.objects.bulk_create([
+            Product(name=f"Feed product {i}", price=f"{i}.00") for i in range(5)
+        ])
+        cls.order = Order.objects.create(user=cls.user, promocode="FEED")
+        cls.order.products.set(cls.products[:2])
+        # Все строки старше задержки ленты, товары 0 и 1 — с одним временем.
+        cls.past = timezone.now() - timedelta(hours=1)
+        Product.objects.update(updated_at=cls.past)
+        Order.objects.update(updated_at=cls.past)
+
+    def setUp(self) -> None:
+        self.client.force_login(self.user)
+
+    def get_changes(self, name, accept="application/x-ndjson", **query):
+        response = self.client.get(reverse(f"shopapp:{name}-changes"), query, HTTP_ACCEPT=accept)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        return rows, response.get("X-Next-Cursor"), response["X-Has-More"]
+
+    def test_products(self):
+        seen = []
+        cursor = None
+        while True:
+            query = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+            rows, cursor, has_more = self.get_changes("product", **query)
+            seen += [row["pk"] for row in rows]
+            if has_more == "false":
+                break
+        self.assertEqual(seen, sorted(product.pk for product in self.products))
+
+        # Ничего не изменилось: пусто, курсор прежний.
+        rows, next_cursor, has_more = self.get_changes("product", cursor=cursor)
+        self.assertEqual((rows, next_cursor, has_more), ([], cursor, "false"))
+
+        product = self.products[1]
+        Product.objects.filter(pk=product.pk).update(
+            archived=True, updated_at=timezone.now() - timedelta(minutes=1),
+        )
+        rows, _, _ = self.get_changes("product", cursor=cursor)
+        self.assertEqual([(row["pk"], row["archived"]) for row in rows], [(product.pk, True)])
+
+        # Свежие изменения ещё не отдаются.
+        Product.objects.filter(pk=product.pk).update(name="Just now", updated_at=timezone.now())
+        rows, _, _ = self.get_changes("product", cursor=cursor)
+        self.assertEqual(rows, [])
+
+    def test_orders(self):
+        rows, cursor, has_more = self.get_changes("order")
+        self.assertEqual(has_more, "false")
+        self.assertEqual(
+            rows,
+            OrderSerializer().serialize_rows(
+                list(OrderSerializer().values_queryset(Order.objects.all()))
+            ),
+        )
+        self.assertEqual(rows[0]["products"], [p.pk for p in self.products[:2]])
+        self.assertIsNotNone(cursor)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("shopapp:order-changes"), {"cursor": "bogus"})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+
+    def test_any_accept(self):
+        for accept in ("application/json", "text/html", "*/*"):
+            with self.subTest(accept=accept):
+                rows, _, _ = self.get_changes("order", accept=accept)
+                self.assertEqual(len(rows), 1)
+
+
+class ProductBulkApiTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="bulk_test", password="qwerty")
+        cls.products = Product.objects.bulk_create([
+            Product(name=f"Bulk product {i}", price=f"{i}.00") for i in range(3)
+        ])
+        cls.order = Order.objects.create(user=cls.user)
+        cls.order.products.add(cls.products[0])
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def send(self, method, name, data):
+        return getattr(self.client, method)(
+            reverse(f"shopapp:{name}"), data, content_type="application/json",
+        )
+
+    def test_create(self):
+        version = get_catalog_version()
+        response = self.send("post", "product-bulk", [
+            {"name": "New", "price": "5.50", "description": "Fresh"},
+            {"price": "1.00"},
+            {"name": "Other", "discount": 3},
+        ])
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual((data["succeeded"], data["failed"]), (2, 1))
+        self.assertEqual([item["index"] for item in data["results"]], [0, 1, 2])
+        self.assertIn("name", data["results"][1]["errors"])
+        created = Product.objects.get(pk=data["results"][0]["pk"])
+        self.assertEqual((created.name, created.price), ("New", Decimal("5.50")))
+        self.assertIsNotNone(created.updated_at)
+        self.assertNotEqual(get_catalog_version(), version)
+        # Новые товары сразу находятся поиском.
+        response = self.client.get(reverse("shopapp:product-list"), {"search": "fresh"})
+        self.assertEqual([item["pk"] for item in response.json()["results"]], [created.pk])
+
+    def test_update(self):
+        first, second, _ = self.products
+        orders_key = user_orders_cache_key(self.user.pk)
+        response = self.send("patch", "product-bulk", [
+            {"pk": first.pk, "price": "9.99"},
+            {"pk": second.pk, "name": "Renamed"},
+            {"pk": second.pk, "name": "Twice"},
+            {"pk": 0, "name": "Missing"},
+            {"name": "No pk"},
+            {"pk": first.pk + 100},
+        ])
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data["succeeded"], data["failed"]), (2, 4))
+        self.assertEqual(
+            [item.get("pk") for item in data["results"]],
+            [first.pk, second.pk, None, None, None, None],
+        )
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.name, first.price), ("Bulk product 0", Decimal("9.99")))
+        self.assertEqual((second.name, second.price), ("Renamed", Decimal("1.00")))
+        self.assertGreater(first.updated_at, first.created_at)
+        # Товар входит в заказ пользователя: кэш его заказов сброшен.
+        self.assertNotEqual(user_orders_cache_key(self.user.pk), orders_key)
+
+        response = self.send("patch", "product-bulk", [{"pk": first.pk, "price": "x"}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.send("patch", "product-bulk", {"pk": 1}).status_code, 400)
+
+    def test_archive(self):
+        first, second, third = self.products
+        response = self.send("post", "product-bulk-archive",
+                             {"pks": [first.pk, 0, second.pk]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [("pk" in item) for item in response.json()["results"]], [True, False, True],
+        )
+        self.assertEqual(
+            list(Product.objects.filter(archived=True).order_by("pk").values_list("pk", flat=True)),
+            [first.pk, second.pk],
+        )
+        self.assertEqual(self.send("post", "product-bulk-archive", {"pks": []}).status_code, 400)
+
+    def test_queries(self):
+        items = [{"name": f"Many {i}", "price": "1.00"} for i in range(50)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.send("post", "product-bulk", items)
+        self.assertEqual(response.json()["succeeded"], 50)
+        pks = [item["pk"] for item in response.json()["results"]]
+        writes = [q for q in queries.captured_queries if q["sql"].startswith("INSERT")]
+        self.assertEqual(len(writes), 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.send("patch", "product-bulk", [{"pk": pk, "discount": 5} for pk in pks])
+        # executemany записывается как «50 times: UPDATE ...».
+        writes = [q for q in queries.captured_queries if "UPDATE" in q["sql"]]
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(Product.objects.filter(discount=5).count(), 50)
+
+
+class GetOrComputeTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_computes_once_while_fresh(self):
+        self.assertEqual(get_or_compute("key", self.compute, timeout=60), 1)
+        self.assertEqual(get_or_compute("key", self.compute, timeout=60), 1)
+        self.assertEqual(self.calls, 1)
+
+    def test_stale_value_while_locked(self):
+        get_or_compute("key", self.compute, timeout=-1, grace=60)
+        cache.add("key:lock", 1)
+        self.assertEqual(get_or_compute("key", self.compute, timeout=60), 1)
+        self.assertEqual(self.calls, 1)
+        cache.delete("key:lock")
+        self.assertEqual(get_or_compute("key", self.compute, timeout=60), 2)
+
+    def test_expired_lock_of_another_owner_is_kept(self):
+        def slow_compute():
+            # Блокировка истекла во время вычисления и досталась другому.
+            cache.set("key:lock", "other")
+            return self.compute()
+
+        self.assertEqual(get_or_compute("key", slow_compute, timeout=60), 1)
+        self.assertEqual(cache.get("key:lock"), "other")
+
+
+class KeysetPaginationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.bulk_create(
+            Product(name=f"Product {i:02}", price=i % 4) for i in range(25)
+        )
+
+    def walk(self, url, params):
+        pks = []
+        response = self.client.get(url, params)
+        for _ in range(100):
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertNotIn("count", data)
+            pks.extend(item["pk"] for item in data["results"])
+            if data["next"] is None:
+                return pks, data
+            response = self.client.get(data["next"])
+        self.fail(f"Pages do not end: {len(pks)} rows so far")
+
+    def test_pages_follow_ordering(self):
+        url = reverse("shopapp:product-list")
+        pks, _ = self.walk(url, {"pagination": "keyset", "ordering": "-price"})
+        expected = list(
+            Product.objects.order_by("-price", "-pk").values_list("pk", flat=True)
+        )
+        self.assertEqual(pks, expected)
+
+    def test_previous_page(self):
+        url = reverse("shopapp:product-list")
+        first = self.client.get(url, {"pagination": "keyset"}).json()
+        self.assertIsNone(first["previous"])
+        second = self.client.get(first["next"]).json()
+        back = self.client.get(second["previous"]).json()
+        self.assertEqual(back["results"], first["results"])
+
+    def test_no_count_query(self):
+        url = reverse("shopapp:product-list")
+        first = self.client.get(url, {"pagination": "keyset"}).json()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(first["next"])
+        # Только сама страница: валидаторы условного GET — из кэша.
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("COUNT", queries[0]["sql"])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("shopapp:order-list"), {"cursor": "bad"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_datetime_cursor_keeps_microseconds(self):
+        user = User.objects.create_user(username="keyset_test")
+        orders = Order.objects.bulk_create(Order(user=user) for _ in range(25))
+        # Все заказы созданы в пределах одной миллисекунды.
+        started = timezone.now().replace(microsecond=0)
+        for i, order in enumerate(orders):
+            Order.objects.filter(pk=order.pk).update(
+                created_at=started + timedelta(microseconds=(i * 7) % 25 * 10),
+            )
+        url = reverse("shopapp:order-list")
+        for ordering in ("created_at", "-created_at"):
+            with self.subTest(ordering=ordering):
+                pks, _ = self.walk(url, {"pagination": "keyset", "ordering": ordering})
+                self.assertEqual(sorted(pks), sorted(order.pk for order in orders))
+                self.assertEqual(
+                    pks,
+                    list(Order.objects.order_by(ordering, ordering.replace("created_at", "pk"))
+                         .values_list("pk", flat=True)),
+                )
+
+
+class ProductFullTextSearchTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.laptop = Product.objects.create(
+            name="Gaming laptop", description="Laptop with a laptop bag",
+        )
+        cls.desktop = Product.objects.create(
+            name="Desktop", description="Comes without a laptop",
+        )
+        Product.objects.bulk_create([Product(name="Smartphone")])
+
+    def search(self, term):
+        response = self.client.get(reverse("shopapp:product-list"), {"search": term})
+        return [item["pk"] for item in response.json()["results"]]
+
+    def test_ranked_results(self):
+        self.assertEqual(self.search("laptop"), [self.laptop.pk, self.desktop.pk])
+        self.assertEqual(self.search("lap gam"), [self.laptop.pk])
+
+    def test_index_follows_writes(self):
+        self.assertEqual(len(self.search("smartphone")), 1)
+        Product.objects.filter(pk=self.desktop.pk).update(name="Workstation")
+        self.assertEqual(self.search("workstation"), [self.desktop.pk])
+        self.desktop.delete()
+        self.assertEqual(self.search("workstation"), [])
+
+    def test_syntax_is_escaped(self):
+        self.assertEqual(self.search('"laptop OR* ('), [])
+
+    def test_all_matches_are_paginated_by_rank(self):
+        Product.objects.bulk_create(
+            Product(name=f"Tablet {number}", description="tablet " * (number % 3))
+            for number in range(1200)
+        )
+        response = self.client.get(reverse("shopapp:product-list"), {"search": "tablet"})
+        self.assertEqual(response.json()["count"], 1200)
+
+        pks = []
+        response = self.client.get(
+            reverse("shopapp:product-list"),
+            {"search": "tablet", "pagination": "keyset", "page_size": 100},
+        )
+        while True:
+            data = response.json()
+            pks.extend(item["pk"] for item in data["results"])
+            if data["next"] is None:
+                break
+            response = self.client.get(data["next"])
+        self.assertEqual(len(pks), 1200)
+        self.assertEqual(len(set(pks)), 1200)
+        ranks = dict(PRODUCT_INDEX.search(Product.objects.all(), ["tablet"])
+                     .values_list("pk", "search_rank"))
+        self.assertEqual(pks, sorted(pks, key=lambda pk: (ranks[pk], pk)))
+
+    def test_search_queryset_composes(self):
+        found = PRODUCT_INDEX.search(Product.objects.all(), ["laptop"])
+        self.assertEqual(found.distinct().count(), 2)
+        others = Product.objects.filter(name="Smartphone").values_list("pk", flat=True).order_by()
+        self.assertEqual(
+            sorted(found.values_list("pk", flat=True).order_by().union(others)),
+            sorted([self.laptop.pk, self.desktop.pk, *others]),
+        )
+
+
+class AuditQueryPlansCommandTestCase(TestCase):
+    def audit(self, baseline, **options):
+        call_command(
+            "audit_query_plans", seed=20, current_db=True, baseline=baseline,
+            stdout=io.StringIO(), **options,
+        )
+
+    def test_reports_regressions_against_baseline(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            baseline = Path(tmp_dir) / "baseline.json"
+            baseline.write_text("[]")
+            with self.assertRaises(CommandError):
+                self.audit(baseline)
+            self.audit(baseline, update_baseline=True)
+            self.audit(baseline)
+            findings = json.loads(baseline.read_text())
+        self.assertFalse(Product.objects.exists())
+        self.assertTrue(all(len(finding.split(" | ")) == 3 for finding in findings))
+
+    def test_fingerprint_ignores_values(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE name = 'a''b' AND id IN (1, 2) LIMIT 21"),
+            fingerprint("SELECT *  FROM t WHERE name = 'c' AND id IN (7) LIMIT 10"),
+        )
+        self.assertNotEqual(
+            fingerprint("SELECT * FROM t WHERE id = 1"),
+            fingerprint("SELECT * FROM t WHERE pk = 1"),
+        )
+
+
+class BenchmarkCommandTestCase(TestCase):
+    def benchmark(self, **options):
+        call_command(
+            "benchmark", current_db=True, products=30, orders=30, users=3,
+            articles=5, tags=3, repeat=3, warmup=0, filter="shopapp:orders_list",
+            stdout=io.StringIO(), **options,
+        )
+
+    def test_results_and_baseline(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output = Path(tmp_dir) / "results.json"
+            baseline = Path(tmp_dir) / "baseline.json"
+            self.benchmark(output=output)
+            report = json.loads(output.read_text())
+            self.assertEqual(report["meta"]["volumes"]["products"], 30)
+            [(label, result)] = report["results"].items()
+            self.assertEqual(label, "shopapp:orders_list")
+            self.assertEqual(result["status"], 200)
+            self.assertGreater(result["queries"], 0)
+            self.assertLessEqual(result["p50_ms"], result["p95_ms"])
+
+            # Timings are too noisy for a test; only query counts are compared.
+            self.benchmark(baseline=baseline, update_baseline=True)
+            self.benchmark(baseline=baseline, tolerance=1000)
+            report = json.loads(baseline.read_text())
+            report["results"][label]["queries"] -= 1
+            baseline.write_text(json.dumps(report))
+            with self.assertRaises(CommandError):
+                self.benchmark(baseline=baseline, tolerance=1000)
+        self.assertFalse(Product.objects.exists())
+
+
+class GenerateDataCommandTestCase(TestCase):
+    def generate(self, seed):
+        with transaction.atomic():
+            call_command(
+                "generate_data", users=5, products=40, orders=60, articles=10,
+                tags=5, seed=seed, batch_size=16, stdout=io.StringIO(),
+            )
+            snapshot = (
+                list(Product.objects.order_by("pk").values_list("name", "price", "created_at")),
+                list(Order.products.through.objects.order_by("pk")
+                     .values_list("order_id", "product_id")),
+            )
+            transaction.set_rollback(True)
+        return snapshot
+
+    def test_generated_volumes(self):
+        version = get_catalog_version()
+        call_command(
+            "generate_data", users=5, products=40, orders=60, articles=10,
+            tags=5, batch_size=16, stdout=io.StringIO(),
+        )
+        self.assertNotEqual(get_catalog_version(), version)
+        self.assertEqual(User.objects.filter(profile__isnull=False).count(), 5)
+        self.assertEqual(Product.objects.count(), 40)
+        self.assertEqual(Order.objects.count(), 60)
+        self.assertFalse(Order.objects.filter(products__isnull=True).exists())
+        created = list(Order.objects.order_by("pk").values_list("created_at", flat=True))
+        self.assertEqual(created, sorted(created))
+        self.assertFalse(Order.objects.exclude(updated_at=F("created_at")).exists())
+        totals = list(Order.objects.order_by("pk").values_list("total", "items_count"))
+        update_order_totals(Order.objects.values_list("pk", flat=True))
+        self.assertEqual(
+            list(Order.objects.order_by("pk").values_list("total", "items_count")), totals,
+        )
+
+    def test_same_seed_same_data(self):
+        self.assertEqual(self.generate(1), self.generate(1))
+        self.assertNotEqual(self.generate(1)[1], self.generate(2)[1])
+
+    def test_end(self):
+        with transaction.atomic():
+            call_command(
+                "generate_data", "--end=2024-03-01", users=0, products=10, orders=0,
+                articles=0, days=10, stdout=io.StringIO(),
+            )
+            created = Product.objects.aggregate(first=Min("created_at"), last=Max("created_at"))
+            transaction.set_rollback(True)
+        end = datetime.fromisoformat("2024-03-01T00:00:00+00:00")
+        self.assertGreaterEqual(created["first"], end - timedelta(days=10))
+        self.assertLess(created["last"], end)
@@ -1,6 +1,12 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
+from .async_views import (
+    OrderApiAsyncView,
+    ProductApiAsyncView,
+    ProductsDataExportAsyncView,
+    UserOrdersExportAsyncView,
+)
 from .views import (
     ShopIndexView,
     ProductDetailsView,
@@ -14,6 +20,9 @@ from .views import (
     OrdersListView,
     OrderDetailView,
     OrderViewSet,
+    ProductSalesViewSet,
+    PromocodeSalesViewSet,
+    SalesTotalsViewSet,
     UserOrdersListView,
     UserOrdersExportView,
 )
@@ -23,6 +32,9 @@ app_name = "shopapp"
 routers = DefaultRouter()
 routers.register('product', ProductViewSet)
 routers.register('order', OrderViewSet)
+routers.register('analytics/sales', SalesTotalsViewSet)
+routers.register('analytics/products', ProductSalesViewSet)
+routers.register('analytics/promocodes', PromocodeSalesViewSet)
 
 urlpatterns = [
     path("", ShopIndexView.as_view(), name="index"),
@@ -37,5 +49,16 @@ urlpatterns = [
     path("orders/", OrdersListView.as_view(), name="orders_list"),
     path("orders/<int:pk>/", OrderDetailView.as_view(), name="order_details"),
     path('users/<int:user_id>/orders/', UserOrdersListView.as_view(), name='user_orders'),
-    path('users/<int:user_id>/orders/export/', UserOrdersExportView.as_view(), name='user_orders_export')
+    path('users/<int:user_id>/orders/export/', UserOrdersExportView.as_view(), name='user_orders_export'),
+    # Асинхронные варианты для запуска под ASGI (см. shopapp/async_views.py)
+    path("async/products/export/", ProductsDataExportAsyncView.as_view(),
+         name="products-export-async"),
+    path("async/users/<int:user_id>/orders/export/", UserOrdersExportAsyncView.as_view(),
+         name="user_orders_export_async"),
+    path("async/api/product/", ProductApiAsyncView.as_view(), name="product-list-async"),
+    path("async/api/product/<int:pk>/", ProductApiAsyncView.as_view(),
+         name="product-detail-async"),
+    path("async/api/order/", OrderApiAsyncView.as_view(), name="order-list-async"),
+    path("async/api/order/<int:pk>/", OrderApiAsyncView.as_view(),
+         name="order-detail-async"),
 ]
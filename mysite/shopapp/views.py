@@ -3,19 +3,26 @@
 
 Разные view для интернет-магазина: по товарам, заказам и так далее.
 """
+import hashlib
+import json
 import logging
+from functools import partial
 from timeit import default_timer
+from typing import Iterator
 
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch, Sum
 from django.http import (
     HttpResponse,
     HttpRequest,
     HttpResponseRedirect,
-    JsonResponse,
 )
 from django.shortcuts import render, get_object_or_404
 from django.urls import reverse_lazy, reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
 from django.views import View
 from django.views.generic import (
     ListView,
@@ -30,37 +37,87 @@ from django.contrib.auth.mixins import (
 )
 from django.contrib.syndication.views import Feed
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.viewsets import ModelViewSet
-from rest_framework.filters import SearchFilter, OrderingFilter
-
-from .models import Product, Order
-from .serializers import ProductSerializer, OrderSerializer
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAdminUser
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
+from rest_framework.filters import OrderingFilter
+
+from mysite.instrumentation import timed
+
+from .bulk import (
+    archive_products,
+    bulk_create_products,
+    bulk_update_products,
+    check_items,
+)
+from .cache import (
+    CATALOG_TIMEOUT,
+    USER_ORDERS_TIMEOUT,
+    get_catalog_changed_at,
+    get_catalog_version,
+    get_or_compute,
+    get_user_orders_version,
+    user_orders_cache_key,
+)
+from .changes import ChangeFeedMixin
+from .conditional import ConditionalGetMixin, conditional_response
+from .exporters import iter_json_object, iter_ndjson, iter_rows
+from .models import (
+    Order,
+    OrderItem,
+    Product,
+    ProductSales,
+    PromocodeSales,
+    SalesRollup,
+    SalesTotals,
+)
+from .pagination import KeysetPagination, KeysetPaginationMixin, with_preview
+from .responses import cached_response
+from .search import PRODUCT_INDEX, FullTextSearchFilter
+from .serializers import (
+    FastListModelMixin,
+    OrderSerializer,
+    ProductSalesSerializer,
+    ProductSalesSummarySerializer,
+    ProductArchiveSerializer,
+    ProductSerializer,
+    PromocodeSalesSerializer,
+    PromocodeSalesSummarySerializer,
+    SalesTotalsSerializer,
+)
 
 
 logger = logging.getLogger(__name__)
 
+# Сколько товаров заказа показывать в списках заказов.
+ORDER_PRODUCTS_PREVIEW = 5
 
-class UserOrdersExportView(LoginRequiredMixin, View):
 
-    def get(self, request: HttpRequest, user_id) -> JsonResponse:
-        cache_key = f'user_orders_{user_id}'
-        serialized_data = cache.get(cache_key)
+class UserOrdersExportView(LoginRequiredMixin, View):
 
-        if serialized_data is None:
-            logger.info('Cache miss, set data in the cache!')
-            self.owner = get_object_or_404(User, pk=self.kwargs['user_id'])
-            orders = (Order.objects.filter(user=self.owner)
-                      .prefetch_related('products')
-                      .select_related('user')
-                      .order_by('-created_at'))
-            serialized_data = OrderSerializer(orders, many=True).data
-            cache.set(cache_key, serialized_data, 300)
+    def get(self, request: HttpRequest, user_id) -> HttpResponse:
+        return cached_response(
+            request,
+            user_orders_cache_key(user_id),
+            partial(self.render_orders, user_id),
+            'application/json',
+            USER_ORDERS_TIMEOUT,
+        )
 
-        logger.info('Cache hits, get data from cache.')
-        return JsonResponse(serialized_data, safe=False)
+    def render_orders(self, user_id) -> list[bytes]:
+        logger.info('Cache miss, set data in the cache!')
+        owner = get_object_or_404(User, pk=user_id)
+        orders = Order.objects.filter(user=owner).order_by('-created_at')
+        serializer = OrderSerializer()
+        data = serializer.serialize_rows(list(serializer.values_queryset(orders)))
+        with timed('json'):
+            return [json.dumps(data, cls=DjangoJSONEncoder).encode()]
 
 
-class UserOrdersListView(LoginRequiredMixin, ListView):
+class UserOrdersListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Order
     template_name_suffix = '_of_user_list'
 
@@ -69,23 +126,92 @@ class UserOrdersListView(LoginRequiredMixin, ListView):
         return super().dispatch(request, *args, **kwargs)
 
     def get_queryset(self):
-        return (Order.objects.filter(user=self.owner)
-                .prefetch_related('products')
-                .only('pk', 'promocode', 'delivery_address', 'products__name'))
+        queryset = (Order.objects.filter(user=self.owner)
+                    .only('pk', 'promocode', 'delivery_address', 'created_at')
+                    .order_by('-created_at'))
+        return with_preview(
+            queryset, 'products', ORDER_PRODUCTS_PREVIEW,
+            Product.objects.only('pk', 'name'),
+        )
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['owner'] = self.owner
+        # Считается, только если фрагмент шаблона не взят из кэша.
+        context['owner_orders'] = Order.objects.filter(user=self.owner)
+        context['orders_version'] = get_user_orders_version(self.owner.pk)
+        context['orders_cache_timeout'] = USER_ORDERS_TIMEOUT
         return context
 
 
 class LatestProductFeed(Feed):
+    """
+    RSS-лента последних товаров.
+
+    Готовый XML кэшируется по поколению каталога, которое сдвигается при
+    создании, изменении, архивировании и удалении товаров, поэтому
+    повторные запросы не обращаются к базе. Число товаров задаётся
+    параметром `?limit=` (не больше `LATEST_PRODUCTS_FEED_MAX_ITEMS`).
+    """
+
     title = 'Shop latest products'
     description = 'Updates on changes and additions shop products'
     link = reverse_lazy('shopapp:products_list')
 
-    def items(self):
-        return Product.objects.order_by('-created_at')[:5]
+    def __call__(self, request, *args, **kwargs):
+        limit = self.get_limit(request)
+        key = (f'latest_products_feed_{request.get_host()}_{limit}'
+               f'_v{get_catalog_version()}')
+        content, content_type, last_modified = get_or_compute(
+            key,
+            partial(self.render, request, *args, **kwargs),
+            CATALOG_TIMEOUT,
+        )
+        etag = quote_etag(hashlib.sha1(key.encode()).hexdigest())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified,
+        )
+        if response is None:
+            response = HttpResponse(content, content_type=content_type)
+        response.headers['ETag'] = etag
+        if last_modified is not None:
+            response.headers['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def render(self, request, *args, **kwargs):
+        """Байты ленты, её тип и время последнего изменения товаров в ней."""
+        response = super().__call__(request, *args, **kwargs)
+        last_modified = response.headers.get('Last-Modified')
+        return (
+            response.content,
+            response['Content-Type'],
+            parse_http_date_safe(last_modified) if last_modified else None,
+        )
+
+    @staticmethod
+    def get_limit(request: HttpRequest) -> int:
+        default = settings.LATEST_PRODUCTS_FEED_ITEMS
+        try:
+            limit = int(request.GET.get('limit', default))
+        except ValueError:
+            limit = default
+        return max(1, min(limit, settings.LATEST_PRODUCTS_FEED_MAX_ITEMS))
+
+    def get_object(self, request, *args, **kwargs):
+        # Объект ленты — число товаров в ней, оно передаётся в items().
+        return self.get_limit(request)
+
+    def items(self, limit: int):
+        return (Product.objects
+                .filter(archived=False)
+                .only('pk', 'name', 'description', 'created_at', 'updated_at')
+                .order_by('-created_at')[:limit])
+
+    def item_pubdate(self, item: Product):
+        return item.created_at
+
+    def item_updateddate(self, item: Product):
+        return item.updated_at
 
     def item_title(self, item: Product):
         return item.name
@@ -122,8 +248,15 @@ class ProductDetailsView(DetailView):
     model = Product
     context_object_name = "product"
 
+    def get(self, request, *args, **kwargs):
+        return conditional_response(
+            request,
+            Product.objects.filter(pk=kwargs["pk"]),
+            partial(super().get, request, *args, **kwargs),
+        )
+
 
-class ProductsListView(ListView):
+class ProductsListView(KeysetPaginationMixin, ListView):
     """Представление для возвращения списка товаров."""
 
     template_name = "shopapp/products-list.html"
@@ -165,17 +298,17 @@ class ProductDeleteView(DeleteView):
         """Метод не удаляет, а помещает товар в архив."""
         success_url = self.get_success_url()
         self.object.archived = True
-        self.object.save()
+        self.object.save(update_fields=["archived", "updated_at"])
         return HttpResponseRedirect(success_url)
 
 
-class OrdersListView(LoginRequiredMixin, ListView):
+class OrdersListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     """Представление для возвращения списка заказов."""
 
-    queryset = (
-        Order.objects
-        .select_related("user")
-        .prefetch_related("products")
+    queryset = with_preview(
+        Order.objects.select_related("user").order_by("pk"),
+        "products",
+        ORDER_PRODUCTS_PREVIEW,
     )
 
 
@@ -186,51 +319,192 @@ class OrderDetailView(PermissionRequiredMixin, DetailView):
     queryset = (
         Order.objects
         .select_related("user")
-        .prefetch_related("products")
+        .prefetch_related(Prefetch(
+            "items",
+            OrderItem.objects.select_related("product").order_by("product__name", "product__price"),
+        ))
     )
 
 
 class ProductsDataExportView(View):
-    """Представление для возвращения списка товаров."""
+    """Представление для потоковой выгрузки списка товаров."""
 
-    def get(self, request: HttpRequest) -> JsonResponse:
-        """Гет-запрос списка товаров в формате JSON."""
-        products = Product.objects.order_by("pk").all()
-        products_data = [
-            {
-                "pk": product.pk,
-                "name": product.name,
-                "price": product.price,
-                "archived": product.archived,
-            }
-            for product in products
-        ]
-        return JsonResponse({"products": products_data})
+    export_fields = "pk", "name", "price", "archived"
+
+    def get(self, request: HttpRequest) -> HttpResponse:
+        """
+        Гет-запрос списка товаров в формате JSON.
+
+        По умолчанию отдаёт `{"products": [...]}`, с `?format=ndjson` —
+        по одному товару на строку. Товары читаются порциями и сразу
+        сжимаются, готовые байты кэшируются до изменения каталога.
+        """
+        ndjson = request.GET.get("format") == "ndjson"
+        return cached_response(
+            request,
+            f"products_export_{'ndjson' if ndjson else 'json'}_v{get_catalog_version()}",
+            partial(self.render_products, ndjson),
+            "application/x-ndjson" if ndjson else "application/json",
+            CATALOG_TIMEOUT,
+        )
+
+    def render_products(self, ndjson: bool) -> Iterator[bytes]:
+        rows = iter_rows(
+            Product.objects.order_by("pk"),
+            self.export_fields,
+        )
+        if ndjson:
+            return iter_ndjson(rows)
+        return iter_json_object("products", rows)
 
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(ChangeFeedMixin, ConditionalGetMixin, FastListModelMixin,
+                     ModelViewSet):
     """
     Набор представлений для действий над товарами.
 
     Полный CRUD для объектов Product: методы GET, POST, PUT, PATCH, DELETE.
+    `changes` — лента изменений товаров (см. `shopapp.changes`).
     """
 
     serializer_class = ProductSerializer
     queryset = Product.objects.all()
-    filter_backends = [SearchFilter, OrderingFilter]
+    filter_backends = [FullTextSearchFilter, OrderingFilter]
     search_fields = ['name', 'description']
+    search_index = PRODUCT_INDEX
     ordering_fields = ['pk', 'name', 'price', 'discount']
-
-
-class OrderViewSet(ModelViewSet):
+    pagination_class = KeysetPagination
+
+    def get_list_version(self) -> tuple:
+        # Все изменения товаров сдвигают поколение каталога.
+        return get_catalog_version(), get_catalog_changed_at()
+
+    @action(detail=False, methods=['post'])
+    def bulk(self, request: Request):
+        """Создание товаров массивом (см. `shopapp.bulk`)."""
+        return self.bulk_response(bulk_create_products, request, status.HTTP_201_CREATED)
+
+    @bulk.mapping.patch
+    def bulk_update(self, request: Request):
+        """Частичное изменение товаров массивом, каждый элемент — с `pk`."""
+        return self.bulk_response(bulk_update_products, request, status.HTTP_200_OK,
+                                  partial=True)
+
+    @action(detail=False, methods=['post'], url_path='bulk/archive',
+            serializer_class=ProductArchiveSerializer)
+    def bulk_archive(self, request: Request):
+        """Архивирование товаров по списку `pks`."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        result = archive_products(serializer.validated_data['pks'])
+        return self.result_response(result, status.HTTP_200_OK)
+
+    def bulk_response(self, write, request: Request, success_status: int,
+                      partial: bool = False) -> Response:
+        items = check_items(request.data)
+        serializer = self.get_serializer(data=items, many=True, partial=partial)
+        return self.result_response(write(serializer, items), success_status)
+
+    @staticmethod
+    def result_response(result, success_status: int) -> Response:
+        # Если не прошёл ни один элемент, весь запрос считается ошибочным.
+        if result.failed and not result.succeeded:
+            success_status = status.HTTP_400_BAD_REQUEST
+        return Response(result.as_dict(), status=success_status)
+
+
+class OrderViewSet(ChangeFeedMixin, FastListModelMixin, ModelViewSet):
     """
     Набор представлений для действий над заказами.
 
     Полный CRUD для объектов Order: методы GET, POST, PUT, PATCH, DELETE.
+    `changes` — лента изменений заказов (см. `shopapp.changes`).
     """
 
     serializer_class = OrderSerializer
-    queryset = Order.objects.prefetch_related('products').all()
+    queryset = Order.objects.prefetch_related('products').order_by('pk')
     filter_backends = [DjangoFilterBackend, OrderingFilter]
-    ordering_fields = ['pk', 'delivery_address', 'created_at']
-    filterset_fields = ['delivery_address', 'promocode', 'user']
+    ordering_fields = ['pk', 'delivery_address', 'created_at', 'total']
+    filterset_fields = {
+        'delivery_address': ['exact'],
+        'promocode': ['exact'],
+        'user': ['exact'],
+        'total': ['exact', 'gte', 'lte'],
+    }
+    pagination_class = KeysetPagination
+
+
+class SalesRollupViewSet(FastListModelMixin, ReadOnlyModelViewSet):
+    """
+    Сводки продаж (см. `shopapp.rollups`) только для чтения, для персонала.
+
+    Фильтры: `granularity` (hour или day), `period__gte`, `period__lt`.
+    """
+
+    permission_classes = [IsAdminUser]
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_fields = {
+        'granularity': ['exact'],
+        'period': ['gte', 'lt'],
+    }
+    ordering_fields = ['period']
+    pagination_class = KeysetPagination
+
+
+class SalesSummaryMixin:
+    """
+    Действие `summary`: строки сводки за период, просуммированные по
+    `summary_field` и отсортированные по убыванию выручки (`?limit=`).
+    Без `granularity` суммируются подневные строки.
+    """
+
+    summary_field: str = None
+    summary_serializer_class = None
+    summary_limit = 20
+    summary_max_limit = 100
+
+    @action(detail=False)
+    def summary(self, request: Request):
+        queryset = self.filter_queryset(self.get_queryset())
+        if 'granularity' not in request.query_params:
+            queryset = queryset.filter(granularity=SalesRollup.Granularity.DAY)
+        try:
+            limit = int(request.query_params.get('limit', self.summary_limit))
+        except ValueError:
+            limit = self.summary_limit
+        limit = min(max(limit, 1), self.summary_max_limit)
+        rows = (
+            queryset
+            .order_by()
+            .values(self.summary_field)
+            .annotate(orders=Sum('orders'), items=Sum('items'), revenue=Sum('revenue'))
+            .order_by('-revenue', self.summary_field)
+        )[:limit]
+        return Response(self.summary_serializer_class(rows, many=True).data)
+
+
+class SalesTotalsViewSet(SalesRollupViewSet):
+    """Выручка, заказы и проданные единицы по часам или дням."""
+
+    serializer_class = SalesTotalsSerializer
+    queryset = SalesTotals.objects.order_by('period', 'pk')
+
+
+class ProductSalesViewSet(SalesSummaryMixin, SalesRollupViewSet):
+    """Продажи по товарам; `summary` — самые продаваемые товары за период."""
+
+    serializer_class = ProductSalesSerializer
+    queryset = ProductSales.objects.order_by('period', 'pk')
+    filterset_fields = {**SalesRollupViewSet.filterset_fields, 'product': ['exact']}
+    summary_field = 'product'
+    summary_serializer_class = ProductSalesSummarySerializer
+
+
+class PromocodeSalesViewSet(SalesSummaryMixin, SalesRollupViewSet):
+    """Продажи по промокодам; `summary` — выручка по промокодам за период."""
+
+    serializer_class = PromocodeSalesSerializer
+    queryset = PromocodeSales.objects.order_by('period', 'pk')
+    filterset_fields = {**SalesRollupViewSet.filterset_fields, 'promocode': ['exact']}
+    summary_field = 'promocode'
+    summary_serializer_class = PromocodeSalesSummarySerializer